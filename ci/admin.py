@@ -1 +1,28 @@
-# Admin goes here
+from django.contrib import admin
+
+from .models import AuditLogEntry, BulkActionJob, BulkActionRow
+
+
+@admin.register(AuditLogEntry)
+class AuditLogEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'created_at', 'attempts', 'next_attempt_at')
+    readonly_fields = ('created_at',)
+
+
+@admin.register(BulkActionJob)
+class BulkActionJobAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'file_name', 'created_by', 'created_at', 'status',
+        'total_rows', 'processed_rows', 'failed_rows')
+    list_filter = ('status',)
+    readonly_fields = ('created_at',)
+    exclude = ('services',)
+
+
+@admin.register(BulkActionRow)
+class BulkActionRowAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'job', 'row_number', 'identity', 'action', 'status',
+        'processed_at')
+    list_filter = ('status', 'action')
+    raw_id_fields = ('job',)
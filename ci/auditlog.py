@@ -0,0 +1,137 @@
+import json
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from . import caching, clients
+from .models import AuditLogEntry
+
+
+logger = logging.getLogger(__name__)
+
+
+def record(data):
+    """
+    Records an audit log entry, to be sent to the control interface service
+    by `flush`. Unless `AUDITLOG_FLUSH_IN_PROCESS` is off, a flush is started
+    in the background once the current transaction commits.
+    """
+    entry = AuditLogEntry.objects.create(data=json.dumps(data))
+    if settings.AUDITLOG_FLUSH_IN_PROCESS:
+        transaction.on_commit(kick)
+    return entry
+
+
+def get_retry_delay(attempts):
+    """
+    Returns how long to wait before sending an entry again after it has
+    failed the given number of times.
+    """
+    return min(
+        settings.AUDITLOG_RETRY_DELAY * 2 ** (attempts - 1),
+        settings.AUDITLOG_MAX_RETRY_DELAY)
+
+
+def claim_batch(batch_size):
+    """
+    Returns a batch of the entries that are due, leased for
+    `AUDITLOG_LEASE_TIME` seconds so that other flushes skip them while they
+    are being sent. Entries whose flush didn't finish are due again once
+    their lease runs out.
+    """
+    with transaction.atomic():
+        # Skip the entries that another process is busy claiming
+        entries = list(
+            AuditLogEntry.objects.select_for_update(skip_locked=True)
+            .filter(next_attempt_at__lte=now())[:batch_size])
+        AuditLogEntry.objects.filter(
+            pk__in=[entry.pk for entry in entries]).update(
+                next_attempt_at=now() + timedelta(
+                    seconds=settings.AUDITLOG_LEASE_TIME))
+    return entries
+
+
+def flush_batch(batch_size=None):
+    """
+    Sends a batch of the entries that are due to the control interface
+    service concurrently. Sent entries are deleted, and failed ones are kept
+    to be retried later. Returns a tuple of (sent, failed) counts.
+
+    The entries are sent outside of a transaction, so that a slow control
+    interface service doesn't hold a database connection's transaction and
+    row locks open.
+    """
+    if batch_size is None:
+        batch_size = settings.AUDITLOG_BATCH_SIZE
+    ci_api = clients.get_ci_client()
+    entries = claim_batch(batch_size)
+    results, errors = clients.fan_out(dict(
+        (entry.pk,
+         lambda entry=entry: ci_api.create_auditlog(json.loads(entry.data)))
+        for entry in entries))
+
+    with transaction.atomic():
+        AuditLogEntry.objects.filter(pk__in=list(results)).delete()
+        # The identity pages don't show the entries until they're sent
+        for entry in entries:
+            identity = json.loads(entry.data).get("identity_id")
+            if entry.pk in results and identity:
+                caching.invalidate_identity(identity, ['audit_logs'])
+        for entry in entries:
+            if entry.pk not in errors:
+                continue
+            entry.attempts += 1
+            entry.last_error = repr(errors[entry.pk])
+            entry.next_attempt_at = now() + timedelta(
+                seconds=get_retry_delay(entry.attempts))
+            entry.save(update_fields=[
+                'attempts', 'last_error', 'next_attempt_at'])
+    return len(results), len(errors)
+
+
+def flush(batch_size=None):
+    """
+    Sends all of the entries that are due, a batch at a time. Returns a tuple
+    of (sent, failed) counts.
+    """
+    if batch_size is None:
+        batch_size = settings.AUDITLOG_BATCH_SIZE
+    total_sent = total_failed = 0
+    while True:
+        sent, failed = flush_batch(batch_size)
+        total_sent += sent
+        total_failed += failed
+        # Failed entries aren't due again yet, so a short batch means that
+        # there's nothing left to send
+        if sent + failed < batch_size:
+            return total_sent, total_failed
+
+
+_flushing = threading.Lock()
+
+
+def _flush_in_background():
+    try:
+        flush()
+    except Exception:
+        logger.exception('Flushing audit log entries failed')
+    finally:
+        _flushing.release()
+        connection.close()
+
+
+def kick():
+    """
+    Starts flushing the audit log entries in a background thread, unless one
+    is already running in this process.
+    """
+    if not _flushing.acquire(False):
+        return
+    thread = threading.Thread(
+        target=_flush_in_background, name='auditlog-flush')
+    thread.daemon = True
+    thread.start()
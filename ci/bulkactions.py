@@ -0,0 +1,339 @@
+import json
+import logging
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils.timezone import now
+
+from . import auditlog, caching, clients, uploads
+from .models import BulkActionJob, BulkActionRow
+
+logger = logging.getLogger(__name__)
+
+# The services that the actions use, which the creating user needs tokens for
+SERVICES = ('HUB', 'SEED_STAGE_BASED_MESSAGING')
+
+# How many pending rows to load from the database at a time
+ROW_BATCH_SIZE = 100
+
+
+class BulkActionError(Exception):
+    """
+    Raised when an action can't be run for a row, with the reason that is
+    reported as its result. `entries` are the audit log entries for the
+    changes that the action made before it failed, if any.
+    """
+    def __init__(self, message, entries=()):
+        super(BulkActionError, self).__init__(message)
+        self.entries = list(entries)
+
+
+def partial_failure(error, entries):
+    """
+    Returns the error to raise for an upstream call that failed part way
+    through an action, which carries the entries for the changes that were
+    already made, or the error itself if there weren't any.
+    """
+    if not entries:
+        return error
+    return BulkActionError('{}; {}'.format(
+        '; '.join(entry["detail"] for entry in entries),
+        describe_error(error)), entries)
+
+
+def get_active_subscriptions(sbm_api, identity):
+    return list(sbm_api.get_subscriptions(params={
+        "identity": identity,
+        "active": True,
+    })["results"])
+
+
+def deactivate(apis, identity, params):
+    """
+    Deactivates all of the identity's active subscriptions.
+    """
+    sbm_api = apis['SEED_STAGE_BASED_MESSAGING']
+    subscriptions = get_active_subscriptions(sbm_api, identity)
+    if not subscriptions:
+        raise BulkActionError('No active subscriptions')
+
+    entries = []
+    for subscription in subscriptions:
+        try:
+            sbm_api.update_subscription(subscription["id"], {"active": False})
+        except Exception as e:
+            raise partial_failure(e, entries)
+        entries.append({
+            "identity_id": identity,
+            "subscription_id": subscription["id"],
+            "action": "Update",
+            "model": "subscription",
+            "detail": "Deactivated subscription"
+        })
+    return entries
+
+
+def change(apis, identity, params):
+    """
+    Changes the language and/or messageset of all of the identity's active
+    subscriptions, through the hub.
+    """
+    sbm_api = apis['SEED_STAGE_BASED_MESSAGING']
+    hub_api = apis['HUB']
+    messagesets = caching.get_messagesets(sbm_api).short_names
+    language = params.get("language")
+    messageset = params.get("messageset")
+    if messageset and messageset not in messagesets.values():
+        raise BulkActionError('Unknown messageset: {}'.format(messageset))
+    subscriptions = get_active_subscriptions(sbm_api, identity)
+    if not subscriptions:
+        raise BulkActionError('No active subscriptions')
+
+    entries = []
+    for subscription in subscriptions:
+        current_messageset = messagesets.get(subscription["messageset"])
+        data = {
+            settings.IDENTITY_FIELD: identity,
+            "subscription": subscription["id"]
+        }
+        if language and language != subscription["lang"]:
+            data["language"] = language
+        if messageset and messageset != current_messageset:
+            data["messageset"] = messageset
+        if len(data) == 2:
+            continue
+
+        try:
+            hub_api.create_change_admin(data)
+        except Exception as e:
+            raise partial_failure(e, entries)
+        if "language" in data:
+            entries.append({
+                "identity_id": identity,
+                "action": "Update",
+                "model": "subscription",
+                "detail": "Updated language: {} to {}".format(
+                    subscription["lang"], language)
+            })
+        if "messageset" in data:
+            entries.append({
+                "identity_id": identity,
+                "action": "Update",
+                "model": "subscription",
+                "detail": "Updated messageset: {} to {}".format(
+                    current_messageset, messageset)
+            })
+    return entries
+
+
+# The actions that can be uploaded, and the identity page sections that they
+# change
+ACTIONS = {
+    'deactivate': (deactivate, ['subscriptions']),
+    'change': (change, ['subscriptions', 'changes']),
+}
+
+
+def _get_value(row, column):
+    if column is None or column >= len(row) or row[column] is None:
+        return ''
+    return str(row[column]).strip()
+
+
+def iter_actions(upload, max_rows=None):
+    """
+    Yields a (row number, identity, action, params) tuple for each of the
+    rows of an uploaded file, which has 'Identity' and 'Action' columns, and
+    'Language' and 'Messageset' columns for changes.
+
+    Raises UploadError if a column is missing, a row is invalid, or there
+    are more than `max_rows` (by default the BULK_ACTION_LIMIT setting) rows.
+    """
+    if max_rows is None:
+        max_rows = settings.BULK_ACTION_LIMIT
+    rows = uploads.iter_rows(upload)
+    header = next(rows, ())
+    columns = {}
+    for name in ('Identity', 'Action', 'Language', 'Messageset'):
+        columns[name] = uploads.find_column(header, name)
+    for name in ('Identity', 'Action'):
+        if columns[name] is None:
+            raise uploads.UploadError(
+                "File must contain '%s' column in the first sheet" % name)
+
+    count = 0
+    for number, row in enumerate(rows, 2):
+        values = dict(
+            (name, _get_value(row, column))
+            for name, column in columns.items())
+        if not any(values.values()):
+            continue
+        if not values['Identity']:
+            raise uploads.UploadError('Row %s has no identity' % number)
+        action = values['Action'].lower()
+        if action not in ACTIONS:
+            raise uploads.UploadError(
+                "Row %s has an invalid action, it must be one of: %s" % (
+                    number, ', '.join(sorted(ACTIONS))))
+        params = {}
+        if action == 'change':
+            if values['Language']:
+                params['language'] = values['Language']
+            if values['Messageset']:
+                params['messageset'] = values['Messageset']
+            if not params:
+                raise uploads.UploadError(
+                    'Row %s must have a language or messageset to change '
+                    'to' % number)
+        count += 1
+        if count > max_rows:
+            raise uploads.UploadError(
+                'File must contain at most %s actions' % max_rows)
+        yield number, values['Identity'], action, params
+
+
+def create_job(file_name, user_id, tokens, actions):
+    """
+    Creates a pending job for the actions from `iter_actions`, which runs
+    them with the user's service tokens.
+    """
+    with transaction.atomic():
+        job = BulkActionJob.objects.create(
+            file_name=file_name,
+            created_by=user_id,
+            services=json.dumps(dict(
+                (service, tokens[service]) for service in SERVICES)))
+        rows = BulkActionRow.objects.bulk_create(
+            (BulkActionRow(
+                job=job, row_number=number, identity=identity, action=action,
+                params=json.dumps(params))
+             for number, identity, action, params in actions),
+            batch_size=ROW_BATCH_SIZE)
+        job.total_rows = len(rows)
+        job.save(update_fields=['total_rows'])
+    return job
+
+
+def claim_job():
+    """
+    Marks the oldest pending job as running and returns it, or returns None
+    if there aren't any.
+
+    Running jobs whose runner hasn't processed a row for
+    BULK_ACTION_STALE_AFTER seconds are assumed to have lost their runner,
+    and are claimed again to run their remaining rows.
+    """
+    stale = now() - timedelta(seconds=settings.BULK_ACTION_STALE_AFTER)
+    with transaction.atomic():
+        # Skip the jobs that another runner is busy claiming
+        job = (
+            BulkActionJob.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status=BulkActionJob.PENDING) |
+                Q(status=BulkActionJob.RUNNING, heartbeat_at__lt=stale))
+            .order_by('id').first())
+        if job is None:
+            return None
+        job.status = BulkActionJob.RUNNING
+        job.heartbeat_at = now()
+        if job.started_at is None:
+            job.started_at = now()
+        job.save(update_fields=['status', 'heartbeat_at', 'started_at'])
+    return job
+
+
+def _iter_pending_rows(job):
+    last = 0
+    while True:
+        batch = list(
+            job.rows.filter(status=BulkActionRow.PENDING, pk__gt=last)
+            .order_by('pk')[:ROW_BATCH_SIZE])
+        if not batch:
+            return
+        for row in batch:
+            yield row
+        last = batch[-1].pk
+
+
+def run_action(apis, row):
+    run, _ = ACTIONS[row.action]
+    return run(apis, row.identity, json.loads(row.params))
+
+
+def describe_error(error):
+    if isinstance(error, BulkActionError):
+        return str(error)
+    return 'Failed: {!r}'.format(error)
+
+
+def record_entries(job, row, entries):
+    """
+    Records the audit log entries for the changes that an action made to the
+    row's identity, and invalidates its cached sections that they affect.
+    """
+    for entry in entries:
+        entry["action_by"] = job.created_by
+        auditlog.record(entry)
+    if entries:
+        caching.invalidate_identity(row.identity, ACTIONS[row.action][1])
+
+
+def run_job(job, concurrency=None):
+    """
+    Runs the job's pending rows, with at most `concurrency` (by default the
+    BULK_ACTION_CONCURRENCY setting) rows in flight at once. Each row's
+    result and the job's progress are saved as the rows finish, so that a
+    job whose runner stopped can be claimed again by `claim_job`.
+
+    If the job can't be run, for example because the database or a service
+    is unavailable, it's marked as failed before the error is raised. Either
+    way the user's tokens are removed from the job.
+    """
+    if concurrency is None:
+        concurrency = settings.BULK_ACTION_CONCURRENCY
+    try:
+        tokens = json.loads(job.services)
+        apis = dict(
+            (service, clients.get_token_client(service, tokens[service]))
+            for service in SERVICES)
+
+        # Only the upstream calls are run concurrently, the results are saved
+        # from this thread
+        for row, entries, error in clients.map_concurrently(
+                partial(run_action, apis), _iter_pending_rows(job),
+                concurrency, executor='bulk'):
+            row.processed_at = now()
+            if error is None:
+                row.status = BulkActionRow.SUCCEEDED
+                row.result = '; '.join(
+                    entry["detail"] for entry in entries
+                ) or 'Nothing to change'
+            else:
+                # The action may have made some of its changes before failing
+                entries = getattr(error, 'entries', [])
+                row.status = BulkActionRow.FAILED
+                row.result = describe_error(error)
+            record_entries(job, row, entries)
+            row.save(update_fields=['status', 'result', 'processed_at'])
+
+            failed = int(error is not None)
+            BulkActionJob.objects.filter(pk=job.pk).update(
+                processed_rows=F('processed_rows') + 1,
+                failed_rows=F('failed_rows') + failed,
+                heartbeat_at=now())
+            job.processed_rows += 1
+            job.failed_rows += failed
+        job.status = BulkActionJob.FINISHED
+    except Exception as e:
+        logger.exception('%s failed', job)
+        job.status = BulkActionJob.FAILED
+        job.error = describe_error(e)
+        raise
+    finally:
+        job.finished_at = now()
+        job.services = ''
+        job.save(update_fields=['status', 'finished_at', 'services', 'error'])
+    return job
@@ -0,0 +1,334 @@
+import hashlib
+import json
+import re
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+import attr
+
+
+MESSAGESETS_GENERATION_KEY = 'ci:messagesets:generation'
+DASHBOARDS_GENERATION_KEY = 'ci:dashboards:generation'
+USERS_GENERATION_KEY = 'ci:users:generation'
+
+INTERVAL_UNITS = {
+    's': 1,
+    'min': 60,
+    'h': 60 * 60,
+    'd': 24 * 60 * 60,
+    'w': 7 * 24 * 60 * 60,
+    'mon': 30 * 24 * 60 * 60,
+    'y': 365 * 24 * 60 * 60,
+}
+INTERVAL_RE = re.compile(r'^(\d+)({})$'.format('|'.join(INTERVAL_UNITS)))
+
+
+@attr.s
+class Messagesets(object):
+    """
+    The messagesets from the stage based messaging service, along with the
+    lookups that the views need from them.
+    """
+    results = attr.ib()
+    short_names = attr.ib()
+    schedules = attr.ib()
+    choices = attr.ib()
+
+    @classmethod
+    def from_results(cls, results):
+        results = list(results)
+        short_names = {}
+        schedules = {}
+        choices = []
+        for messageset in results:
+            short_names[messageset["id"]] = messageset["short_name"]
+            schedules[messageset["id"]] = messageset.get("default_schedule")
+            choices.append((messageset["id"], messageset["short_name"]))
+        return cls(
+            results=results, short_names=short_names, schedules=schedules,
+            choices=choices)
+
+
+def _get_generation(generation_key):
+    return cache.get_or_set(generation_key, uuid.uuid4().hex, None)
+
+
+def _messagesets_key(name, sbm_api):
+    return 'ci:messagesets:{}:{}:{}'.format(
+        _get_generation(MESSAGESETS_GENERATION_KEY), name,
+        sbm_api.session.url)
+
+
+def get_messagesets(sbm_api):
+    """
+    Returns the Messagesets for the service that sbm_api points at, from the
+    cache if they're there.
+    """
+    key = _messagesets_key('messagesets', sbm_api)
+    messagesets = cache.get(key)
+    if messagesets is None:
+        messagesets = Messagesets.from_results(
+            sbm_api.get_messagesets()["results"])
+        cache.set(key, messagesets, settings.MESSAGESET_CACHE_TTL)
+    return messagesets
+
+
+def get_messageset_languages(sbm_api):
+    """
+    Returns the languages available for each messageset, from the cache if
+    they're there.
+    """
+    key = _messagesets_key('languages', sbm_api)
+    languages = cache.get(key)
+    if languages is None:
+        languages = sbm_api.get_messageset_languages()
+        cache.set(key, languages, settings.MESSAGESET_CACHE_TTL)
+    return languages
+
+
+def invalidate_messagesets():
+    """
+    Invalidates the cached messagesets and messageset languages for all
+    services.
+    """
+    cache.set(MESSAGESETS_GENERATION_KEY, uuid.uuid4().hex, None)
+
+
+def _dashboards_key(name, ci_api, *args):
+    return 'ci:dashboards:{}:{}:{}:{}'.format(
+        _get_generation(DASHBOARDS_GENERATION_KEY), name, ci_api.session.url,
+        ':'.join(str(arg) for arg in args))
+
+
+def get_dashboard(ci_api, dashboard_id):
+    """
+    Returns the definition of a dashboard from the control interface service,
+    from the cache if it's there.
+    """
+    key = _dashboards_key('dashboard', ci_api, dashboard_id)
+    dashboard = cache.get(key)
+    if dashboard is None:
+        dashboard = ci_api.get_dashboard(dashboard_id)
+        cache.set(key, dashboard, settings.DASHBOARD_CACHE_TTL)
+    return dashboard
+
+
+def get_user_dashboards(ci_api, user_id):
+    """
+    Returns the list of dashboard settings for a user from the control
+    interface service, from the cache if it's there.
+    """
+    key = _dashboards_key('user', ci_api, user_id)
+    dashboards = cache.get(key)
+    if dashboards is None:
+        dashboards = list(ci_api.get_user_dashboards(user_id)['results'])
+        cache.set(key, dashboards, settings.DASHBOARD_CACHE_TTL)
+    return dashboards
+
+
+def invalidate_dashboards():
+    """
+    Invalidates the cached dashboard definitions and user dashboards.
+    """
+    cache.set(DASHBOARDS_GENERATION_KEY, uuid.uuid4().hex, None)
+
+
+def _user_directory_key(auth_url, token):
+    return 'ci:users:{}:{}:{}'.format(
+        _get_generation(USERS_GENERATION_KEY), auth_url,
+        hashlib.sha1(token.encode('utf-8')).hexdigest())
+
+
+def get_user_directory(auth_api):
+    """
+    Returns a dict of user id (as a string): email address for the users in
+    the auth service that auth_api's user can see, from the cache if it's
+    there. Which users are listed depends on the token, so each token has its
+    own cache entry.
+    """
+    key = _user_directory_key(auth_api.session.url, auth_api.token)
+    users = cache.get(key)
+    if users is None:
+        users = dict(
+            (str(user['id']), user['email'])
+            for user in auth_api.get_users())
+        cache.set(key, users, settings.USER_DIRECTORY_CACHE_TTL)
+    return users
+
+
+def invalidate_user_directory():
+    """
+    Invalidates the cached user directory.
+    """
+    cache.set(USERS_GENERATION_KEY, uuid.uuid4().hex, None)
+
+
+def get_identities_by_address(id_api, address_type, address):
+    """
+    Returns the ids of the identities with the given address, from the cache
+    if they're there.
+    """
+    key = 'ci:identities:{}:{}:{}'.format(
+        id_api.session.url, address_type, address)
+    identities = cache.get(key)
+    if identities is None:
+        identities = [
+            identity['id'] for identity in id_api.get_identity_by_address(
+                address_type, address)['results']]
+        cache.set(key, identities, settings.IDENTITY_LOOKUP_CACHE_TTL)
+    return identities
+
+
+# The sections of the identity page that are cached per identity
+IDENTITY_SECTIONS = (
+    'identity', 'subscriptions', 'registrations', 'changes', 'audit_logs')
+
+
+def _identity_generation_key(identity, section):
+    return 'ci:identity:generation:{}:{}'.format(identity, section)
+
+
+def _identity_section_key(api, identity, section):
+    return 'ci:identity:{}:{}:{}:{}'.format(
+        _get_generation(_identity_generation_key(identity, section)),
+        api.session.url, identity, section)
+
+
+def get_identity_section(api, identity, section, fetch):
+    """
+    Returns a section of the identity page's data for the identity, from the
+    cache if it's there, or calls fetch to get it from the service that api
+    points at otherwise.
+    """
+    key = _identity_section_key(api, identity, section)
+    data = cache.get(key)
+    if data is None:
+        data = fetch()
+        if data is not None:
+            cache.set(key, data, settings.IDENTITY_CACHE_TTL)
+    return data
+
+
+def invalidate_identity(identity, sections=IDENTITY_SECTIONS):
+    """
+    Invalidates the given cached sections of the identity page's data for the
+    identity, or all of them, whichever service they were fetched from.
+    """
+    cache.delete_many([
+        _identity_generation_key(identity, section) for section in sections])
+
+
+class SingleFlight(object):
+    """
+    Makes sure that only one call for a key is in flight at a time within
+    this process. Callers that arrive while a call is in flight wait for it,
+    and get its result instead of making their own call.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {
+                    'done': threading.Event(), 'result': None, 'error': None}
+
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = fn()
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+        return call['result']
+
+
+metrics_flight = SingleFlight()
+
+
+def parse_interval(interval):
+    """
+    Returns the number of seconds in a Metrics API interval, eg. `1d`, or None
+    if it isn't one that we understand.
+    """
+    match = INTERVAL_RE.match(interval or '')
+    if match is None:
+        return None
+    return int(match.group(1)) * INTERVAL_UNITS[match.group(2)]
+
+
+def canonicalise_metric_query(filters):
+    """
+    Returns the filters for a Metrics API query in a canonical form, so that
+    queries for the same data share cache entries. The metrics are sorted, and
+    absolute (epoch) start times are rounded down to the interval. Other
+    parameters with more than one value keep all of them, sorted.
+    """
+    def canonical(value):
+        if not isinstance(value, (list, tuple)):
+            return value
+        if len(value) > 1:
+            return sorted(value)
+        return value[0] if value else ''
+
+    query = {}
+    for k, v in filters.items():
+        if k == 'm':
+            query[k] = sorted(set(v))
+        else:
+            query[k] = canonical(v)
+
+    seconds = parse_interval(query.get('interval'))
+    for k in ('from', 'start'):
+        value = str(query.get(k, ''))
+        if seconds and value.isdigit():
+            query[k] = str(int(value) // seconds * seconds)
+    return query
+
+
+def _metrics_key(metrics_api, query):
+    digest = hashlib.sha1(json.dumps(
+        [metrics_api.session.url, sorted(query.items())]
+    ).encode('utf-8')).hexdigest()
+    return 'ci:metrics:{}'.format(digest)
+
+
+def get_metrics(metrics_api, filters):
+    """
+    Returns the results of a Metrics API query, from the cache if it's there.
+    Identical queries that are made at the same time only result in a single
+    request to the Metrics API. Results are cached for the query interval, or
+    `METRIC_CACHE_TTL` if that is shorter.
+    """
+    query = canonicalise_metric_query(filters)
+    key = _metrics_key(metrics_api, query)
+    results = cache.get(key)
+    if results is not None:
+        return results
+
+    def fetch():
+        results = cache.get(key)
+        if results is None:
+            results = metrics_api.get_metrics(**query)
+            ttl = min(
+                parse_interval(query.get('interval')) or
+                settings.METRIC_CACHE_TTL,
+                settings.METRIC_CACHE_TTL)
+            cache.set(key, results, ttl)
+        return results
+
+    return metrics_flight.do(key, fetch)
@@ -0,0 +1,270 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from demands import HTTPServiceClient, JSONServiceClient
+from django.conf import settings
+from seed_services_client import (
+    ControlInterfaceApiClient,
+    HubApiClient,
+    IdentityStoreApiClient,
+    MessageSenderApiClient,
+    SchedulerApiClient,
+    StageBasedMessagingApiClient,
+)
+from seed_services_client.auth import AuthApiClient
+from seed_services_client.metrics import MetricsApiClient
+from seed_services_client.seed_services import SeedHTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+
+SERVICE_CLIENTS = {
+    'HUB': HubApiClient,
+    'SEED_IDENTITY_SERVICE': IdentityStoreApiClient,
+    'SEED_MESSAGE_SENDER': MessageSenderApiClient,
+    'SEED_SCHEDULER': SchedulerApiClient,
+    'SEED_STAGE_BASED_MESSAGING': StageBasedMessagingApiClient,
+}
+
+
+def mount_pooled_adapters(client):
+    """
+    Replaces the HTTP adapters on all of the client's sessions with adapters
+    whose connection pools are sized according to the settings. Any timeout
+    configured on the existing adapters is kept.
+    """
+    for name in ('session', 'session_http'):
+        session = getattr(client, name, None)
+        if session is None:
+            continue
+        for prefix in ('http://', 'https://'):
+            timeout = getattr(session.get_adapter(prefix), 'timeout', None)
+            session.mount(prefix, SeedHTTPAdapter(
+                timeout=timeout,
+                pool_connections=settings.UPSTREAM_POOL_CONNECTIONS,
+                pool_maxsize=settings.UPSTREAM_POOL_MAXSIZE))
+    return client
+
+
+def close_client(client):
+    for name in ('session', 'session_http'):
+        session = getattr(client, name, None)
+        if session is not None:
+            session.close()
+
+
+class ClientRegistry(object):
+    """
+    A per-process registry of API clients, so that the keep-alive connections
+    held by their sessions are reused across requests. Clients that haven't
+    been used for `UPSTREAM_CLIENT_IDLE_TIMEOUT` seconds are closed and
+    removed.
+    """
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def get(self, key, factory):
+        """
+        Returns the client stored under key, creating it with factory if
+        there isn't one yet.
+        """
+        now = time.time()
+        with self._lock:
+            self._evict_idle(now)
+            try:
+                client, _ = self._clients[key]
+            except KeyError:
+                client = mount_pooled_adapters(factory())
+            self._clients[key] = (client, now)
+        return client
+
+    def clear(self):
+        with self._lock:
+            for client, _ in self._clients.values():
+                close_client(client)
+            self._clients.clear()
+
+    def _evict_idle(self, now):
+        cutoff = now - settings.UPSTREAM_CLIENT_IDLE_TIMEOUT
+        for key, (client, last_used) in list(self._clients.items()):
+            if last_used < cutoff:
+                close_client(client)
+                del self._clients[key]
+
+
+registry = ClientRegistry()
+
+
+def get_token_client(service, token):
+    """
+    Returns the shared client for the given service, authenticated with
+    token, a dict of the service's url and token.
+    """
+    client_class = SERVICE_CLIENTS[service]
+    return registry.get(
+        (service, token["url"], token["token"]),
+        lambda: client_class(auth_token=token["token"], api_url=token["url"]))
+
+
+def get_ci_client():
+    """
+    Returns the shared client for the control interface service.
+    """
+    return registry.get(
+        ('CONTROL_INTERFACE', settings.CONTROL_INTERFACE_SERVICE_URL,
+         settings.CONTROL_INTERFACE_SERVICE_TOKEN),
+        lambda: ControlInterfaceApiClient(
+            api_url=settings.CONTROL_INTERFACE_SERVICE_URL,
+            auth_token=settings.CONTROL_INTERFACE_SERVICE_TOKEN))
+
+
+class TokenAuthApiClient(AuthApiClient):
+    """
+    An auth service client for a user that has already logged in, using
+    their existing token rather than logging in again.
+    """
+    def __init__(self, token, api_url):
+        self.token = token
+        headers = {'Authorization': 'Token %s' % token}
+        self.session = JSONServiceClient(url=api_url, headers=headers)
+        self.session_http = HTTPServiceClient(url=api_url, headers=headers)
+
+
+def get_auth_client(request):
+    """
+    Returns the shared auth service client for the logged in user.
+    """
+    token = request.session['user_token']
+    return registry.get(
+        ('AUTH', settings.AUTH_SERVICE_URL, token),
+        lambda: TokenAuthApiClient(token, settings.AUTH_SERVICE_URL))
+
+
+def get_metrics_client():
+    """
+    Returns the shared client for the Go Metrics API.
+    """
+    auth = (settings.METRIC_API_USER, settings.METRIC_API_PASSWORD)
+    return registry.get(
+        ('METRICS', settings.METRIC_API_URL, auth),
+        lambda: MetricsApiClient(settings.METRIC_API_URL, auth=auth))
+
+
+# The settings that bound each of the executors' number of threads. Work
+# that requests don't wait on, such as prefetching, gets its own executor so
+# that it can't hold up the calls that they do.
+EXECUTOR_WORKERS = {
+    'upstream': 'UPSTREAM_MAX_WORKERS',
+    'prefetch': 'UPSTREAM_PREFETCH_WORKERS',
+    'export': 'UPSTREAM_EXPORT_WORKERS',
+    'bulk': 'UPSTREAM_BULK_WORKERS',
+}
+
+_executors = {}
+_executor_lock = threading.Lock()
+_worker = threading.local()
+
+
+def get_executor(name='upstream'):
+    """
+    Returns the named process wide executor for upstream calls. The
+    'upstream' executor, bounded by `UPSTREAM_MAX_WORKERS`, is for the calls
+    that requests are waiting on.
+    """
+    with _executor_lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(
+                max_workers=getattr(settings, EXECUTOR_WORKERS[name]))
+        return _executors[name]
+
+
+def _run_call(call):
+    _worker.active = True
+    try:
+        return call()
+    finally:
+        _worker.active = False
+
+
+def fan_out(calls):
+    """
+    Runs the callables in calls, a dict of name: callable, concurrently on the
+    upstream executor and waits for all of them to finish.
+
+    Returns a tuple of (results, errors), both dicts keyed on the call name.
+    A call raising an exception doesn't affect the others, the exception is
+    logged and stored in errors instead.
+
+    When called from one of the executor's own threads the calls are run
+    one after another, so that nested fan outs can't exhaust the pool.
+    """
+    if getattr(_worker, 'active', False) or len(calls) < 2:
+        futures = None
+    else:
+        executor = get_executor()
+        futures = dict(
+            (name, executor.submit(_run_call, call))
+            for name, call in calls.items())
+
+    results, errors = {}, {}
+    for name, call in calls.items():
+        try:
+            if futures is None:
+                results[name] = call()
+            else:
+                results[name] = futures[name].result()
+        except Exception as e:
+            logger.exception('Upstream call %r failed', name)
+            errors[name] = e
+    return results, errors
+
+
+def map_concurrently(func, items, window, executor='upstream'):
+    """
+    Calls func with each of items on the named executor, with at most window
+    calls in flight at once, and yields (item, result, error) tuples in the
+    order of items. Like `fan_out`, a call raising an exception is logged and
+    its exception returned as the error.
+
+    Items are only taken from the iterable as the earlier calls finish, so it
+    can be a generator that is too long to hold in memory. Long running bulk
+    work should use the 'bulk' executor, so that it doesn't hold up the calls
+    that page loads make.
+    """
+    executor = get_executor(executor)
+    pending = deque()
+
+    def result(item, future):
+        try:
+            return item, future.result(), None
+        except Exception as e:
+            logger.exception('Upstream call for %r failed', item)
+            return item, None, e
+
+    for item in items:
+        pending.append(
+            (item, executor.submit(_run_call, partial(func, item))))
+        if len(pending) >= window:
+            yield result(*pending.popleft())
+    while pending:
+        yield result(*pending.popleft())
+
+
+def fetch_all(method, *args, **kwargs):
+    """
+    Returns a callable that fetches every page of a paginated client method,
+    so that the pages are downloaded on the thread that runs it instead of
+    when the results are iterated over.
+    """
+    def fetch():
+        return {"results": list(method(*args, **kwargs)["results"])}
+    return fetch
@@ -1,10 +1,12 @@
 from django.conf import settings
 
+from . import users
+
 
 def dashboards(request):
     context = {}
-    if 'user_dashboards' in request.session and not settings.HIDE_DASHBOARDS:
-        context['dashboards'] = request.session['user_dashboards']
+    if 'user_id' in request.session and not settings.HIDE_DASHBOARDS:
+        context['dashboards'] = users.get_user_dashboards(request)
 
     return context
 
@@ -0,0 +1,227 @@
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from six.moves import queue
+
+from . import caching, clients, utils
+
+
+logger = logging.getLogger(__name__)
+
+# How often to send a comment down an idle stream, so that proxies don't
+# close it
+KEEPALIVE_INTERVAL = 15
+
+COMPACT_SEPARATORS = (',', ':')
+
+
+# How the metrics of each type of dashboard widget are reduced, since only
+# a single value is shown for them
+WIDGET_REDUCTIONS = {
+    'pie': 'sum',
+}
+
+# How many of the most recent points are needed by each type of dashboard
+# widget. Last value widgets show a sparkline of the same number of points as
+# sapphire's default sparklineLimit, and the difference from the point before
+# the last.
+WIDGET_TAILS = {
+    'last': 15,
+}
+
+
+def get_widget_query(widget, start, interval, max_points=None):
+    """
+    Returns the query for a widget from the control interface service's
+    dashboard, in the form that `fetch_widget_metrics` takes.
+    """
+    metrics = [metric["key"] for metric in widget["data"]]
+    if widget["type_of"] == 'bars':
+        # Multiple bar metrics per widget doesn't work, only the first is used
+        metrics = metrics[:1]
+    return {
+        "id": "w%s" % widget["id"],
+        "m": metrics,
+        "start": start,
+        "interval": interval,
+        "nulls": widget["nulls"],
+        "max_points": max_points,
+        "reduce": WIDGET_REDUCTIONS.get(widget["type_of"]),
+        "tail": WIDGET_TAILS.get(widget["type_of"]),
+    }
+
+
+def _widget_group(widget):
+    return (widget.get("start", ""), widget.get("interval", ""),
+            widget.get("nulls", ""))
+
+
+def fetch_widget_metrics(widgets):
+    """
+    Fetches the metric values for a list of dashboard widgets, each a dict
+    with an id, a list of metrics `m`, the start, interval and nulls
+    parameters, and optionally the `max_points` to downsample each series to,
+    the number of most recent points (the `tail`) to keep, or the name of a
+    `reduce` function to reduce each series with.
+
+    Widgets with the same start, interval and nulls are fetched with a single
+    Metrics API query, and the different queries are made concurrently.
+    Returns a dict of widget id: `{"objects": [...]}`, or `{"error": ...}` for
+    the widgets whose query failed.
+    """
+    groups = {}
+    for widget in widgets:
+        groups.setdefault(_widget_group(widget), set()).update(widget["m"])
+
+    client = clients.get_metrics_client()
+
+    def get_metrics(start, interval, nulls, metrics):
+        return lambda: caching.get_metrics(client, {
+            "m": list(metrics),
+            "start": start,
+            "interval": interval,
+            "nulls": nulls,
+        })
+
+    results, errors = clients.fan_out(dict(
+        (group, get_metrics(*(group + (metrics,))))
+        for group, metrics in groups.items()))
+
+    response = {}
+    for widget in widgets:
+        group = _widget_group(widget)
+        if group in errors:
+            response[widget["id"]] = {"error": "Could not load metrics"}
+            continue
+        max_points = utils.parse_max_points(widget.get("max_points"))
+        # Anything below 3 points is treated as 3, like max_points
+        tail = utils.parse_max_points(widget.get("tail"))
+        objects = []
+        for metric in widget["m"]:
+            points = results[group].get(metric, [])
+            if tail is not None:
+                points = points[-tail:]
+            objects.append(utils.get_series_object(
+                metric, points, max_points, widget.get("reduce")))
+        response[widget["id"]] = {"objects": objects}
+    return response
+
+
+class DashboardBroadcaster(threading.Thread):
+    """
+    Fetches the metrics for a dashboard's widgets every
+    `DASHBOARD_STREAM_STEP` seconds, on behalf of everyone viewing it, and
+    pushes the widgets whose values changed to each subscriber's queue.
+
+    The thread stops once it has no subscribers left.
+    """
+    def __init__(self, key, widgets):
+        super(DashboardBroadcaster, self).__init__(
+            name='dashboard-broadcaster-%s' % (key,))
+        self.daemon = True
+        self.key = key
+        self.widgets = widgets
+        self.latest = {}
+        self.subscribers = set()
+        self.wakeup = threading.Event()
+
+    def subscribe(self):
+        """
+        Returns a new subscriber queue, primed with the latest values of every
+        widget if there are any. Must be called with the broadcasters lock
+        held.
+        """
+        subscriber = queue.Queue()
+        if self.latest:
+            subscriber.put(dict(self.latest))
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def run(self):
+        while True:
+            with _lock:
+                if not self.subscribers:
+                    del _broadcasters[self.key]
+                    return
+            try:
+                self.broadcast(fetch_widget_metrics(self.widgets))
+            except Exception:
+                logger.exception('Updating dashboard %s failed', self.key)
+            self.wakeup.wait(settings.DASHBOARD_STREAM_STEP)
+            self.wakeup.clear()
+
+    def broadcast(self, values):
+        changed = dict(
+            (widget_id, value) for widget_id, value in values.items()
+            if self.latest.get(widget_id) != value)
+        if not changed:
+            return
+        with _lock:
+            self.latest.update(changed)
+            for subscriber in self.subscribers:
+                subscriber.put(changed)
+
+
+_broadcasters = {}
+_lock = threading.Lock()
+
+
+def subscribe(key, widgets):
+    """
+    Subscribes to the updates of the dashboard identified by key, starting a
+    broadcaster for it if there isn't one running. Returns the subscriber
+    queue, which should be passed to `unsubscribe` when done.
+    """
+    with _lock:
+        broadcaster = _broadcasters.get(key)
+        start = broadcaster is None
+        if start:
+            broadcaster = _broadcasters[key] = DashboardBroadcaster(
+                key, widgets)
+        subscriber = broadcaster.subscribe()
+    if start:
+        broadcaster.start()
+    return subscriber
+
+
+def unsubscribe(key, subscriber):
+    with _lock:
+        broadcaster = _broadcasters.get(key)
+        if broadcaster is None:
+            return
+        broadcaster.subscribers.discard(subscriber)
+        if not broadcaster.subscribers:
+            # Let it notice that it's no longer needed straight away
+            broadcaster.wakeup.set()
+
+
+def event_stream(key, widgets, columnar=False):
+    """
+    Yields server sent events with the changed widget values of the dashboard
+    identified by key, for up to `DASHBOARD_STREAM_MAX_AGE` seconds, after
+    which the browser reconnects. If columnar is true the series are sent in
+    the columnar form.
+    """
+    deadline = time.time() + settings.DASHBOARD_STREAM_MAX_AGE
+    subscriber = subscribe(key, widgets)
+    try:
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            try:
+                changed = subscriber.get(
+                    timeout=min(remaining, KEEPALIVE_INTERVAL))
+            except queue.Empty:
+                if time.time() < deadline:
+                    yield ': keepalive\n\n'
+                continue
+            if columnar:
+                changed = utils.to_columnar_widgets(changed)
+            yield 'data: %s\n\n' % json.dumps(
+                {"widgets": changed}, separators=COMPACT_SEPARATORS)
+    finally:
+        unsubscribe(key, subscriber)
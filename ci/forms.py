@@ -5,7 +5,8 @@ from seed_services_client.auth import AuthApiClient
 from demands import HTTPServiceError
 from bootstrap_datepicker.widgets import DatePicker
 from django.contrib.postgres.forms import SimpleArrayField
-from openpyxl import load_workbook
+
+from . import bulkactions, uploads
 
 
 class AuthenticationForm(forms.Form):
@@ -38,26 +39,23 @@ class AuthenticationForm(forms.Form):
         if username and password:
             # do remote login
             auth_url = settings.AUTH_SERVICE_URL
-            user_data = {}
             try:
                 auth_api = AuthApiClient(username, password, auth_url)
-
-                users = auth_api.get_users()
-                for user in users:
-                    user_data[user['id']] = user['email']
-
             except HTTPServiceError:
-                raise forms.ValidationError(
-                    self.error_messages['invalid_login'],
-                    code='invalid_login',
-                    params={'username': 'Email'},
-                )
+                raise self.get_invalid_login_error()
+
             self.user_cache = auth_api.get_permissions()
             self.user_cache["token"] = auth_api.token
-            self.user_cache["user_list"] = user_data
 
         return self.cleaned_data
 
+    def get_invalid_login_error(self):
+        return forms.ValidationError(
+            self.error_messages['invalid_login'],
+            code='invalid_login',
+            params={'username': 'Email'},
+        )
+
     def get_user(self):
         return self.user_cache
 
@@ -80,6 +78,49 @@ class IdentitySearchForm(forms.Form):
     )
 
 
+class IdentityLookupForm(forms.Form):
+    msisdn_list = forms.FileField(
+        help_text="A CSV file or Excel workbook with a 'Phone number' column")
+
+    def clean_msisdn_list(self):
+        """
+        Checks the whole upload, without keeping the phone numbers, and
+        returns the upload so that they can be read again as they are looked
+        up.
+        """
+        try:
+            for msisdn in uploads.iter_msisdns(
+                    self.cleaned_data['msisdn_list'],
+                    settings.IDENTITY_LOOKUP_LIMIT):
+                pass
+            return self.cleaned_data['msisdn_list']
+        except uploads.UploadError as e:
+            raise forms.ValidationError(
+                "Invalid contents for: %(file)s. %(error)s",
+                code='invalid',
+                params={
+                    'file': self.cleaned_data['msisdn_list'], 'error': e})
+
+
+class BulkActionForm(forms.Form):
+    actions_file = forms.FileField(
+        label="Actions",
+        help_text=(
+            "A CSV file or Excel workbook with 'Identity' and 'Action' "
+            "columns, and 'Language' and 'Messageset' columns for changes"))
+
+    def clean_actions_file(self):
+        try:
+            return list(bulkactions.iter_actions(
+                self.cleaned_data['actions_file']))
+        except uploads.UploadError as e:
+            raise forms.ValidationError(
+                "Invalid contents for: %(file)s. %(error)s",
+                code='invalid',
+                params={
+                    'file': self.cleaned_data['actions_file'], 'error': e})
+
+
 class AddSubscriptionForm(forms.Form):
     messageset = forms.IntegerField()
 
@@ -205,44 +246,12 @@ class MsisdnReportGenerationForm(ReportGenerationForm):
     msisdn_list = forms.FileField()
 
     def clean_msisdn_list(self):
-        msisdns = []
-        wb = load_workbook(self.cleaned_data['msisdn_list'])
-        ws = wb[wb.sheetnames[0]]  # There should only be one sheet
-        # Get msisdn column
-        msisdn_column = None
-        for i, column in enumerate(ws.columns):
-            if column[0].value is None:
-                # Skip untitled columns
-                continue
-            value = str(column[0].value)
-            if value.lower() == 'phone number':
-                msisdn_column = i
-                break
-        if msisdn_column is None:
+        try:
+            return list(
+                uploads.iter_msisdns(self.cleaned_data['msisdn_list']))
+        except uploads.UploadError as e:
             raise forms.ValidationError(
-                "Invalid contents for: %(file)s. File must contain "
-                "'Phone number' column in the first sheet",
+                "Invalid contents for: %(file)s. %(error)s",
                 code='invalid',
-                params={'file': self.cleaned_data['msisdn_list']})
-
-        for row in ws.rows:
-            value = row[msisdn_column].value
-            if value is None:
-                # Skip empty Rows
-                continue
-
-            value = str(value)
-            if value.lower() == 'phone number':
-                # Skip the header row
-                continue
-
-            # Clean the msisdn
-            msisdn = value.replace(" ", "")
-            if not msisdn.replace("+", "").isdigit():
-                raise forms.ValidationError(
-                    "Invalid contents for: %(file)s. 'Phone number' column "
-                    "must only contain valid phone numbers",
-                    code='invalid',
-                    params={'file': self.cleaned_data['msisdn_list']})
-            msisdns.append(msisdn)
-        return msisdns
+                params={
+                    'file': self.cleaned_data['msisdn_list'], 'error': e})
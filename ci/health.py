@@ -0,0 +1,169 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.timezone import now
+
+from . import caching, clients, utils
+
+
+METRIC_SENT_SUM = 'message.sent.sum'
+METRIC_SUBSCRIPTIONS_SUM = 'subscriptions.created.sum'
+METRIC_REGISTRATIONS_SUM = 'registrations.created.sum'
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+
+def estimated_vs_sent(client, today):
+    # The estimate data is stored as .last metrics with 0 - 6
+    # representing the days of the week. The cron format specifies
+    # 0 = Sunday whereas Python datetime.weekday() specifies
+    # 0 = Monday.
+    estimate_metrics = [
+        'subscriptions.send.estimate.%s.last' % day for day in range(7)]
+    # A week back always includes the start of this week, so the sent and
+    # estimated metrics can share a single query
+    results = caching.get_metrics(client, {
+        'm': [METRIC_SENT_SUM] + estimate_metrics,
+        'from': '-7d',
+        'interval': '1d',
+        'nulls': 'zeroize',
+    })
+    sent_data = utils.get_ranged_data_from_timeseries(
+        {METRIC_SENT_SUM: results.get(METRIC_SENT_SUM, [])}, today,
+        range_type='week')
+    estimate_data = [
+        utils.get_last_value_from_timeseries(
+            {metric: results.get(metric, [])})
+        for metric in estimate_metrics]
+    return {
+        'Estimated': estimate_data,
+        'Sent': sent_data
+    }
+
+
+def sent_today(client, today):
+    get_hours = today.hour
+    sent = client.get_metrics(
+        m=METRIC_SENT_SUM, from_='-%sh' % get_hours, interval='1h',
+        nulls='zeroize')
+    sent_data = utils.get_ranged_data_from_timeseries(
+        sent, today, range_type='day')
+    return {
+        'Today': sent_data
+    }
+
+
+def today_and_yesterday(metric):
+    def chart(client, today):
+        get_hours = today.hour + 24  # Include yesterday in the set.
+        timeseries = client.get_metrics(
+            m=metric, from_='-%sh' % get_hours, interval='1h',
+            nulls='zeroize')
+        today_data, yesterday_data = (
+            utils.get_ranged_windows_from_timeseries(
+                timeseries, [today, today - timedelta(days=1)],
+                range_type='day'))
+        return {
+            'Yesterday': yesterday_data,
+            'Today': today_data
+        }
+    return chart
+
+
+def this_and_last_week(metric):
+    def chart(client, today):
+        get_days = today.weekday() + 7  # Include last week in the set.
+        timeseries = client.get_metrics(
+            m=metric, from_='-%sd' % get_days, interval='1d',
+            nulls='zeroize')
+        this_week_data, last_week_data = (
+            utils.get_ranged_windows_from_timeseries(
+                timeseries, [today, today - timedelta(weeks=1)],
+                range_type='week'))
+        return {
+            'Last week': last_week_data,
+            'This week': this_week_data
+        }
+    return chart
+
+
+# The charts on each health page, keyed on chart type, along with the size
+# of the buckets that the chart's data is in.
+CHARTS = {
+    'messages': {
+        'estimated-vs-sent': (estimated_vs_sent, DAY),
+        'sent-today': (sent_today, HOUR),
+        'sent-this-week': (this_and_last_week(METRIC_SENT_SUM), DAY),
+    },
+    'subscriptions': {
+        'subscriptions-today': (
+            today_and_yesterday(METRIC_SUBSCRIPTIONS_SUM), HOUR),
+        'subscriptions-this-week': (
+            this_and_last_week(METRIC_SUBSCRIPTIONS_SUM), DAY),
+    },
+    'registrations': {
+        'registrations-today': (
+            today_and_yesterday(METRIC_REGISTRATIONS_SUM), HOUR),
+        'registrations-this-week': (
+            this_and_last_week(METRIC_REGISTRATIONS_SUM), DAY),
+    },
+}
+
+
+def seconds_until_boundary(dt, bucket):
+    """
+    Returns the number of seconds from dt until the start of the next bucket.
+    """
+    timestamp = int(dt.timestamp())
+    return bucket - timestamp % bucket
+
+
+def _chart_key(page, chart_type):
+    return 'ci:health:{}:{}:{}'.format(
+        settings.METRIC_API_URL, page, chart_type)
+
+
+def refresh_chart(page, chart_type, today=None):
+    """
+    Computes a chart's payload and stores it in the cache until the start of
+    the chart's next bucket, or `HEALTH_CHART_CACHE_TTL` if that is sooner.
+    """
+    chart, bucket = CHARTS[page][chart_type]
+    if today is None:
+        today = now()
+    payload = chart(clients.get_metrics_client(), today)
+    ttl = min(
+        seconds_until_boundary(today, bucket),
+        settings.HEALTH_CHART_CACHE_TTL)
+    cache.set(_chart_key(page, chart_type), payload, ttl)
+    return payload
+
+
+def get_chart(page, chart_type):
+    """
+    Returns the payload for a chart, precomputed if it's in the cache and
+    computed now otherwise. Returns None for an unknown chart.
+    """
+    if chart_type not in CHARTS.get(page, {}):
+        return None
+    payload = cache.get(_chart_key(page, chart_type))
+    if payload is None:
+        payload = refresh_chart(page, chart_type)
+    return payload
+
+
+def refresh_all_charts():
+    """
+    Computes the payloads of every chart concurrently, returning a dict of
+    failed (page, chart_type): exception.
+    """
+    today = now()
+    _, errors = clients.fan_out(dict(
+        ((page, chart_type),
+         lambda page=page, chart_type=chart_type: refresh_chart(
+             page, chart_type, today))
+        for page, charts in CHARTS.items()
+        for chart_type in charts))
+    return errors
@@ -0,0 +1,69 @@
+import timeit
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ci import utils
+
+
+def scan_windows(timeseries, dts, range_type):
+    """
+    Returns the windows for each of the datetimes the way that the health
+    pages used to, by scanning the series for each window with
+    `utils.transform_timeseries_data`.
+    """
+    get_boundry, _ = utils.RANGE_TYPES[range_type]
+    padding = {'week': 7, 'day': 24}[range_type]
+    windows = []
+    for dt in dts:
+        boundries = get_boundry(dt)
+        data = utils.transform_timeseries_data(
+            timeseries, utils.get_timestamp(boundries.start),
+            utils.get_timestamp(boundries.end))
+        windows.append(utils.right_pad_list(data, padding, 0))
+    return windows
+
+
+class Command(BaseCommand):
+
+    help = ('Time windowing a generated health timeseries by bisection, as '
+            'the health pages do, against scanning the series for each '
+            'window.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--range-type', choices=sorted(utils.RANGE_TYPES),
+            default='week', help='The size of the windows.')
+        parser.add_argument(
+            '--points', type=int, default=24 * 365,
+            help='The number of points in the series.')
+        parser.add_argument(
+            '--windows', type=int, default=4,
+            help='The number of windows to take from the end of the series.')
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='The number of times to time each way.')
+
+    def handle(self, *args, **kwargs):
+        range_type = kwargs['range_type']
+        _, interval = utils.RANGE_TYPES[range_type]
+        step = timedelta(milliseconds=interval)
+        end = datetime(2017, 1, 1, tzinfo=timezone.utc)
+        timeseries = {'benchmark.sum': [
+            {'x': utils.get_timestamp(end - step * i), 'y': float(i)}
+            for i in reversed(range(kwargs['points']))]}
+        window = step * {'week': 7, 'day': 24}[range_type]
+        dts = [end - window * (i + 1) for i in range(kwargs['windows'])]
+
+        timings = [
+            ('scanning', lambda: scan_windows(timeseries, dts, range_type)),
+            ('bisection', lambda: utils.get_ranged_windows_from_timeseries(
+                timeseries, dts, range_type)),
+        ]
+        for name, func in timings:
+            seconds = min(timeit.repeat(
+                func, number=1, repeat=kwargs['repeat']))
+            self.stdout.write('%s: %.3f ms for %s %s windows of %s points' % (
+                name, seconds * 1000, len(dts), range_type,
+                kwargs['points']))
@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ci import auditlog
+
+
+class Command(BaseCommand):
+
+    help = ('Send the recorded audit log entries that are due to the control '
+            'interface service. Entries that fail are retried later, backing '
+            'off up to AUDITLOG_MAX_RETRY_DELAY seconds.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true', default=False,
+            help=('Keep running, flushing the entries every '
+                  'AUDITLOG_FLUSH_INTERVAL seconds.'))
+
+    def handle(self, *args, **kwargs):
+        while True:
+            sent, failed = auditlog.flush()
+            if failed:
+                self.stderr.write(
+                    'Could not send %s audit log entries' % failed)
+            self.stdout.write('Sent %s audit log entries' % sent)
+
+            if not kwargs['loop']:
+                break
+            time.sleep(settings.AUDITLOG_FLUSH_INTERVAL)
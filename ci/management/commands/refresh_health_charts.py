@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from ci import health
+
+
+class Command(BaseCommand):
+
+    help = ('Precompute the health chart data into the cache, so that the '
+            'health pages can be served without querying the Metrics API. '
+            'The cache backend must be shared with the web processes for '
+            'this to affect them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true', default=False,
+            help=('Keep running, refreshing the charts at the start of every '
+                  'hour, or more often if HEALTH_CHART_CACHE_TTL is shorter.'))
+
+    def handle(self, *args, **kwargs):
+        while True:
+            errors = health.refresh_all_charts()
+            for (page, chart_type), error in errors.items():
+                self.stderr.write('Could not refresh %s %s: %r' % (
+                    page, chart_type, error))
+            self.stdout.write('Refreshed health charts')
+
+            if not kwargs['loop']:
+                break
+            time.sleep(min(
+                health.seconds_until_boundary(now(), health.HOUR),
+                settings.HEALTH_CHART_CACHE_TTL))
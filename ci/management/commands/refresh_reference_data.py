@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from seed_services_client import StageBasedMessagingApiClient
+
+from ci import caching
+
+
+class Command(BaseCommand):
+
+    help = ('Invalidate the cached reference data from the upstream '
+            'services, optionally fetching it again straight away. The '
+            'cache backend must be shared with the web processes for this to '
+            'affect them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sbm-url', type=str, default=None,
+            help=('The stage based messaging API URL to fetch the '
+                  'messagesets from, as stored in the user service tokens.'))
+        parser.add_argument(
+            '--sbm-token', type=str, default=None,
+            help='The stage based messaging API token.')
+
+    def handle(self, *args, **kwargs):
+        caching.invalidate_messagesets()
+        self.stdout.write('Invalidated cached messagesets')
+        caching.invalidate_dashboards()
+        self.stdout.write('Invalidated cached dashboards')
+        caching.invalidate_user_directory()
+        self.stdout.write('Invalidated cached user directory')
+
+        if kwargs['sbm_url'] and kwargs['sbm_token']:
+            sbm_api = StageBasedMessagingApiClient(
+                kwargs['sbm_token'], kwargs['sbm_url'])
+            messagesets = caching.get_messagesets(sbm_api)
+            caching.get_messageset_languages(sbm_api)
+            self.stdout.write(
+                'Cached %s messagesets' % len(messagesets.results))
@@ -0,0 +1,43 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ci import bulkactions
+
+
+class Command(BaseCommand):
+
+    help = ('Run the pending bulk action jobs, one at a time, with at most '
+            'BULK_ACTION_CONCURRENCY rows in flight at once.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true', default=False,
+            help=('Keep running, checking for new jobs every '
+                  'BULK_ACTION_POLL_INTERVAL seconds.'))
+        parser.add_argument(
+            '--concurrency', type=int, default=None,
+            help='The number of rows to run at once.')
+
+    def handle(self, *args, **kwargs):
+        while True:
+            job = bulkactions.claim_job()
+            if job is not None:
+                self.stdout.write('Running %s' % job)
+                try:
+                    job = bulkactions.run_job(job, kwargs['concurrency'])
+                except Exception as e:
+                    # The job has been marked as failed, carry on with the
+                    # next one
+                    self.stderr.write('Failed %s: %r' % (job, e))
+                    continue
+                self.stdout.write(
+                    'Finished %s: %s rows, %s failed, %.1f rows/s' % (
+                        job, job.processed_rows, job.failed_rows,
+                        job.throughput))
+                continue
+
+            if not kwargs['loop']:
+                break
+            time.sleep(settings.BULK_ACTION_POLL_INTERVAL)
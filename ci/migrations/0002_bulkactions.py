@@ -0,0 +1,54 @@
+# Generated by Django 2.2.8 on 2026-10-19 13:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ci', '0001_auditlogentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkActionJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_name', models.CharField(max_length=255)),
+                ('created_by', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('services', models.TextField(blank=True, default='')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('finished', 'Finished')], db_index=True, default='pending', max_length=10)),
+                ('total_rows', models.IntegerField(default=0)),
+                ('processed_rows', models.IntegerField(default=0)),
+                ('failed_rows', models.IntegerField(default=0)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ('-id',),
+            },
+        ),
+        migrations.CreateModel(
+            name='BulkActionRow',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row_number', models.IntegerField()),
+                ('identity', models.CharField(max_length=255)),
+                ('action', models.CharField(max_length=30)),
+                ('params', models.TextField(default='{}')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('result', models.TextField(blank=True, default='')),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rows', to='ci.BulkActionJob')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='bulkactionrow',
+            index=models.Index(fields=['job', 'status'], name='ci_bulkacti_job_id_baedfa_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.8 on 2026-10-19 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ci', '0002_bulkactions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulkactionjob',
+            name='error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='bulkactionjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='bulkactionjob',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('finished', 'Finished'), ('failed', 'Failed')], db_index=True, default='pending', max_length=10),
+        ),
+    ]
@@ -1 +1,123 @@
-# Models go here
+from django.db import models
+from django.utils import timezone
+
+
+class AuditLogEntry(models.Model):
+    """
+    An audit log entry that has been recorded, but not yet sent to the
+    control interface service. See ci/auditlog.py.
+    """
+    # The entry as JSON, in the form that the control interface service takes
+    data = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now, db_index=True)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        ordering = ('id',)
+        verbose_name_plural = 'audit log entries'
+
+    def __str__(self):
+        return 'Audit log entry %s' % self.pk
+
+
+class BulkActionJob(models.Model):
+    """
+    A spreadsheet of actions to run against many identities' subscriptions,
+    which are run in the background. See ci/bulkactions.py.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (FINISHED, 'Finished'),
+        (FAILED, 'Failed'),
+    )
+
+    file_name = models.CharField(max_length=255)
+    created_by = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    # The creating user's tokens for the services that the actions use, as
+    # JSON. They're removed once the job has finished.
+    services = models.TextField(blank=True, default='')
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING,
+        db_index=True)
+    total_rows = models.IntegerField(default=0)
+    processed_rows = models.IntegerField(default=0)
+    failed_rows = models.IntegerField(default=0)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Updated by the runner as it processes rows, so that jobs whose runner
+    # has stopped can be claimed again
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    # Why the job stopped before all of its rows were processed
+    error = models.TextField(blank=True, default='')
+
+    class Meta:
+        ordering = ('-id',)
+
+    def __str__(self):
+        return 'Bulk action job %s' % self.pk
+
+    @property
+    def progress(self):
+        """
+        The percentage of the rows that have been processed.
+        """
+        if not self.total_rows:
+            return 100
+        return self.processed_rows * 100 // self.total_rows
+
+    @property
+    def throughput(self):
+        """
+        The number of rows processed per second since the job started, or
+        None if it hasn't.
+        """
+        if self.started_at is None:
+            return None
+        elapsed = (
+            (self.finished_at or timezone.now()) -
+            self.started_at).total_seconds()
+        return self.processed_rows / max(elapsed, 1)
+
+
+class BulkActionRow(models.Model):
+    """
+    A single action of a BulkActionJob, and its result.
+    """
+    PENDING = 'pending'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+
+    job = models.ForeignKey(
+        BulkActionJob, related_name='rows', on_delete=models.CASCADE)
+    # The row's number in the uploaded spreadsheet
+    row_number = models.IntegerField()
+    identity = models.CharField(max_length=255)
+    action = models.CharField(max_length=30)
+    # The action's parameters as JSON, eg. the language to change to
+    params = models.TextField(default='{}')
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    result = models.TextField(blank=True, default='')
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('id',)
+        indexes = [models.Index(fields=['job', 'status'])]
+
+    def __str__(self):
+        return 'Row %s of bulk action job %s' % (
+            self.row_number, self.job_id)
@@ -0,0 +1,55 @@
+// Filters and paginates list pages in place, by fetching only the results
+// table from the same view and updating the browser history.
+$(function () {
+  var $results = $('.list-results')
+  if (!$results.length || !window.history.pushState) {
+    return
+  }
+
+  function load(url, push) {
+    $results.css('opacity', 0.5)
+    $.ajax({url: url, dataType: 'html'})
+      .done(function (html, status, xhr) {
+        if (!xhr.getResponseHeader('X-List-Results')) {
+          // Redirected to another page, like the login page when the
+          // session has expired, so load it properly
+          window.location.href = url
+          return
+        }
+        $results.html(html)
+        // Export what is being shown
+        var query = url.indexOf('?') === -1 ? '' : url.slice(url.indexOf('?'))
+        $('a.list-export').attr('href', function () {
+          return this.href.split('?')[0] + query
+        })
+        if (push) {
+          window.history.pushState({listResults: true}, '', url)
+        }
+      })
+      .fail(function () {
+        // Fall back to loading the whole page
+        window.location.href = url
+      })
+      .always(function () {
+        $results.css('opacity', '')
+      })
+  }
+
+  $results.on('click', '.pagination a', function (event) {
+    event.preventDefault()
+    load(this.href, true)
+  })
+
+  $('form.list-filter').on('submit', function (event) {
+    event.preventDefault()
+    var query = $(this).serialize()
+    load(window.location.pathname + (query ? '?' + query : ''), true)
+  })
+
+  window.history.replaceState({listResults: true}, '', window.location.href)
+  $(window).on('popstate', function (event) {
+    if (event.originalEvent.state && event.originalEvent.state.listResults) {
+      load(window.location.href, false)
+    }
+  })
+})
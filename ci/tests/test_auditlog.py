@@ -0,0 +1,100 @@
+import json
+from datetime import timedelta
+
+import responses
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+from django.utils.six import StringIO
+
+from .. import auditlog, caching, clients
+from ..models import AuditLogEntry
+
+
+class AuditLogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.url = clients.get_ci_client().session.url + '/auditlog/'
+
+    def test_record(self):
+        """
+        Recording an entry should store it without sending it.
+        """
+        auditlog.record({"identity_id": "abc", "action": "Update"})
+        entry = AuditLogEntry.objects.get()
+        self.assertEqual(json.loads(entry.data), {
+            "identity_id": "abc", "action": "Update"})
+        self.assertEqual(entry.attempts, 0)
+
+    @responses.activate
+    @override_settings(AUDITLOG_BATCH_SIZE=2)
+    def test_flush(self):
+        """
+        Flushing should send every entry that is due, a batch at a time,
+        deleting them once they are sent.
+        """
+        responses.add(responses.POST, self.url, json={}, status=201)
+        for i in range(5):
+            auditlog.record({"identity_id": str(i)})
+        AuditLogEntry.objects.create(
+            data='{}', next_attempt_at=now() + timedelta(minutes=1))
+        ci_api = clients.get_ci_client()
+        caching.get_identity_section(
+            ci_api, '0', 'audit_logs', lambda: 'stale')
+
+        self.assertEqual(auditlog.flush(), (5, 0))
+        self.assertEqual(
+            sorted(json.loads(c.request.body)["identity_id"]
+                   for c in responses.calls),
+            ['0', '1', '2', '3', '4'])
+        self.assertEqual(AuditLogEntry.objects.count(), 1)
+        # The sent entries should show on the identity's page
+        self.assertEqual(caching.get_identity_section(
+            ci_api, '0', 'audit_logs', lambda: 'fresh'), 'fresh')
+
+    @responses.activate
+    @override_settings(AUDITLOG_RETRY_DELAY=30, AUDITLOG_MAX_RETRY_DELAY=50)
+    def test_flush_failure(self):
+        """
+        Entries that couldn't be sent should be kept, and retried after a
+        delay that doubles with each attempt.
+        """
+        responses.add(responses.POST, self.url, status=500)
+        auditlog.record({"identity_id": "abc"})
+
+        self.assertEqual(auditlog.flush(), (0, 1))
+        entry = AuditLogEntry.objects.get()
+        self.assertEqual(entry.attempts, 1)
+        self.assertIn('500', entry.last_error)
+        self.assertGreater(entry.next_attempt_at, now())
+        # It isn't due again yet
+        self.assertEqual(auditlog.flush(), (0, 0))
+
+        self.assertEqual(auditlog.get_retry_delay(1), 30)
+        self.assertEqual(auditlog.get_retry_delay(2), 50)
+
+    def test_claim_batch(self):
+        """
+        Claimed entries should be leased, so that they aren't claimed again
+        while they are being sent.
+        """
+        for i in range(3):
+            auditlog.record({"identity_id": str(i)})
+
+        entries = auditlog.claim_batch(2)
+        self.assertEqual(len(entries), 2)
+        for entry in AuditLogEntry.objects.filter(
+                pk__in=[e.pk for e in entries]):
+            self.assertGreater(entry.next_attempt_at, now())
+        self.assertEqual(len(auditlog.claim_batch(2)), 1)
+        self.assertEqual(auditlog.claim_batch(2), [])
+
+    @responses.activate
+    def test_flush_command(self):
+        responses.add(responses.POST, self.url, json={}, status=201)
+        auditlog.record({"identity_id": "abc"})
+        stdout = StringIO()
+        call_command('flush_auditlogs', stdout=stdout)
+        self.assertEqual(stdout.getvalue().strip(), 'Sent 1 audit log entries')
+        self.assertFalse(AuditLogEntry.objects.exists())
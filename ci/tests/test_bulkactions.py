@@ -0,0 +1,269 @@
+import json
+from datetime import timedelta
+
+import responses
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils.six import StringIO
+from django.utils.timezone import now
+
+from .. import bulkactions, uploads
+from ..models import AuditLogEntry, BulkActionJob, BulkActionRow
+
+
+TOKENS = {
+    "HUB": {
+        "url": 'http://hub.example.com/', "token": 'hubtoken'},
+    "SEED_STAGE_BASED_MESSAGING": {
+        "url": 'http://sbm.example.com/', "token": 'sbmtoken'},
+    "SEED_IDENTITY_SERVICE": {
+        "url": 'http://idstore.example.com/', "token": 'idstoretoken'},
+}
+
+
+def upload(content):
+    return SimpleUploadedFile('actions.csv', content.encode('utf-8'))
+
+
+class IterActionsTests(TestCase):
+    def test_iter_actions(self):
+        """
+        Each row should be returned with its number and parameters, skipping
+        empty rows.
+        """
+        actions = list(bulkactions.iter_actions(upload(
+            'Identity,Action,Language,Messageset\n'
+            'identity-1,Deactivate,,\n'
+            ',,,\n'
+            'identity-2,change,eng_ZA,\n'
+            'identity-3,change,,baby\n')))
+        self.assertEqual(actions, [
+            (2, 'identity-1', 'deactivate', {}),
+            (4, 'identity-2', 'change', {'language': 'eng_ZA'}),
+            (5, 'identity-3', 'change', {'messageset': 'baby'}),
+        ])
+
+    def test_iter_actions_invalid(self):
+        """
+        Missing columns, unknown actions, changes to nothing and too many rows
+        should be rejected.
+        """
+        invalid = (
+            ('Identity\nidentity-1\n', None),
+            ('Identity,Action\nidentity-1,delete\n', None),
+            ('Identity,Action\nidentity-1,change\n', None),
+            ('Identity,Action\n,deactivate\n', None),
+            ('Identity,Action\nidentity-1,deactivate\n'
+             'identity-2,deactivate\n', 1),
+        )
+        for content, max_rows in invalid:
+            with self.assertRaises(uploads.UploadError):
+                list(bulkactions.iter_actions(upload(content), max_rows))
+
+
+class RunJobTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def create_job(self, content):
+        return bulkactions.create_job(
+            'actions.csv', 123, TOKENS,
+            bulkactions.iter_actions(upload(content)))
+
+    def add_subscriptions(self, identity, subscriptions):
+        responses.add(
+            responses.GET,
+            'http://sbm.example.com/subscriptions/?identity={}&active=True'
+            .format(identity),
+            match_querystring=True,
+            json={'next': None, 'results': subscriptions})
+
+    def test_create_job(self):
+        """
+        Creating a job should store a pending row for each action, and only
+        the tokens for the services that the actions use.
+        """
+        job = self.create_job(
+            'Identity,Action,Language\n'
+            'identity-1,deactivate,\n'
+            'identity-2,change,eng_ZA\n')
+        self.assertEqual(job.status, BulkActionJob.PENDING)
+        self.assertEqual(job.total_rows, 2)
+        self.assertEqual(
+            sorted(json.loads(job.services)),
+            ['HUB', 'SEED_STAGE_BASED_MESSAGING'])
+        rows = list(job.rows.all())
+        self.assertEqual(
+            [(row.row_number, row.identity, row.action, row.status)
+             for row in rows],
+            [(2, 'identity-1', 'deactivate', BulkActionRow.PENDING),
+             (3, 'identity-2', 'change', BulkActionRow.PENDING)])
+        self.assertEqual(json.loads(rows[1].params), {'language': 'eng_ZA'})
+
+    @responses.activate
+    def test_run_job(self):
+        """
+        Running a job should run each row's action, storing its result and
+        recording audit logs, and update the job's progress.
+        """
+        responses.add(
+            responses.GET, 'http://sbm.example.com/messageset/',
+            json={'next': None, 'results': [
+                {'id': 1, 'short_name': 'prebirth'},
+                {'id': 2, 'short_name': 'baby'},
+            ]})
+        self.add_subscriptions('identity-1', [
+            {'id': 'sub-1', 'lang': 'eng_ZA', 'messageset': 1}])
+        responses.add(
+            responses.PATCH, 'http://sbm.example.com/subscriptions/sub-1/',
+            json={})
+        self.add_subscriptions('identity-2', [
+            {'id': 'sub-2', 'lang': 'eng_ZA', 'messageset': 1}])
+        responses.add(
+            responses.POST, 'http://hub.example.com/change_admin/',
+            json={}, status=201)
+        self.add_subscriptions('identity-3', [])
+
+        job = self.create_job(
+            'Identity,Action,Language,Messageset\n'
+            'identity-1,deactivate,,\n'
+            'identity-2,change,zul_ZA,baby\n'
+            'identity-3,deactivate,,\n'
+            'identity-4,change,,unknown\n')
+        self.assertEqual(bulkactions.claim_job(), job)
+        self.assertIsNone(bulkactions.claim_job())
+        job = bulkactions.run_job(BulkActionJob.objects.get(pk=job.pk), 2)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, BulkActionJob.FINISHED)
+        self.assertEqual(job.processed_rows, 4)
+        self.assertEqual(job.failed_rows, 2)
+        self.assertEqual(job.services, '')
+        self.assertIsNotNone(job.throughput)
+        self.assertEqual(
+            [(row.status, row.result) for row in job.rows.all()],
+            [(BulkActionRow.SUCCEEDED, 'Deactivated subscription'),
+             (BulkActionRow.SUCCEEDED,
+              'Updated language: eng_ZA to zul_ZA; '
+              'Updated messageset: prebirth to baby'),
+             (BulkActionRow.FAILED, 'No active subscriptions'),
+             (BulkActionRow.FAILED, 'Unknown messageset: unknown')])
+
+        [change] = [
+            call for call in responses.calls
+            if call.request.url.endswith('/change_admin/')]
+        self.assertEqual(json.loads(change.request.body), {
+            settings.IDENTITY_FIELD: 'identity-2',
+            'subscription': 'sub-2',
+            'language': 'zul_ZA',
+            'messageset': 'baby',
+        })
+        self.assertEqual(
+            [(data['identity_id'], data['action_by']) for data in (
+                json.loads(entry.data)
+                for entry in AuditLogEntry.objects.all())],
+            [('identity-1', 123), ('identity-2', 123), ('identity-2', 123)])
+
+    @responses.activate
+    def test_run_job_partial_failure(self):
+        """
+        If an action fails after making some of its changes, the row should
+        fail, but the changes made should be reported and recorded in the
+        audit log.
+        """
+        self.add_subscriptions('identity-1', [
+            {'id': 'sub-1', 'lang': 'eng_ZA', 'messageset': 1},
+            {'id': 'sub-2', 'lang': 'eng_ZA', 'messageset': 1}])
+        responses.add(
+            responses.PATCH, 'http://sbm.example.com/subscriptions/sub-1/',
+            json={})
+        responses.add(
+            responses.PATCH, 'http://sbm.example.com/subscriptions/sub-2/',
+            status=500)
+
+        job = self.create_job('Identity,Action\nidentity-1,deactivate\n')
+        job = bulkactions.run_job(bulkactions.claim_job())
+
+        self.assertEqual(job.status, BulkActionJob.FINISHED)
+        self.assertEqual(job.failed_rows, 1)
+        [row] = job.rows.all()
+        self.assertEqual(row.status, BulkActionRow.FAILED)
+        self.assertTrue(row.result.startswith(
+            'Deactivated subscription; Failed: HTTPServiceError'))
+        [entry] = [
+            json.loads(entry.data) for entry in AuditLogEntry.objects.all()]
+        self.assertEqual(
+            (entry['subscription_id'], entry['action_by']), ('sub-1', 123))
+
+    @override_settings(BULK_ACTION_STALE_AFTER=60)
+    def test_claim_stale_job(self):
+        """
+        Running jobs that haven't processed a row recently should be claimed
+        again, but not ones that have.
+        """
+        job = self.create_job('Identity,Action\nidentity-1,deactivate\n')
+        self.assertEqual(bulkactions.claim_job(), job)
+        self.assertIsNone(bulkactions.claim_job())
+
+        BulkActionJob.objects.filter(pk=job.pk).update(
+            heartbeat_at=now() - timedelta(seconds=61))
+        job = bulkactions.claim_job()
+        self.assertEqual(job.status, BulkActionJob.RUNNING)
+        self.assertGreater(job.heartbeat_at, now() - timedelta(seconds=60))
+        self.assertIsNone(bulkactions.claim_job())
+
+    def test_run_job_error(self):
+        """
+        A job that can't be run should be marked as failed, with its tokens
+        removed, before the error is raised.
+        """
+        job = self.create_job('Identity,Action\nidentity-1,deactivate\n')
+        BulkActionJob.objects.filter(pk=job.pk).update(services='{}')
+        job = bulkactions.claim_job()
+
+        with self.assertLogs('ci.bulkactions', level='ERROR'):
+            with self.assertRaises(KeyError):
+                bulkactions.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, BulkActionJob.FAILED)
+        self.assertEqual(job.services, '')
+        self.assertIn('KeyError', job.error)
+        self.assertIsNotNone(job.finished_at)
+        self.assertIsNone(bulkactions.claim_job())
+
+    @responses.activate
+    def test_run_bulk_actions_command(self):
+        """
+        The command should run the pending jobs.
+        """
+        self.add_subscriptions('identity-1', [])
+        job = self.create_job('Identity,Action\nidentity-1,deactivate\n')
+
+        stdout = StringIO()
+        call_command('run_bulk_actions', stdout=stdout)
+        job.refresh_from_db()
+        self.assertEqual(job.status, BulkActionJob.FINISHED)
+        self.assertIn('1 rows, 1 failed', stdout.getvalue())
+
+    @responses.activate
+    def test_run_bulk_actions_command_error(self):
+        """
+        A job that fails shouldn't stop the command from running the others.
+        """
+        self.add_subscriptions('identity-2', [])
+        failing = self.create_job('Identity,Action\nidentity-1,deactivate\n')
+        BulkActionJob.objects.filter(pk=failing.pk).update(services='{}')
+        job = self.create_job('Identity,Action\nidentity-2,deactivate\n')
+
+        stderr = StringIO()
+        with self.assertLogs('ci.bulkactions', level='ERROR'):
+            call_command(
+                'run_bulk_actions', stdout=StringIO(), stderr=stderr)
+        self.assertIn('Failed %s' % failing, stderr.getvalue())
+        failing.refresh_from_db()
+        self.assertEqual(failing.status, BulkActionJob.FAILED)
+        job.refresh_from_db()
+        self.assertEqual(job.status, BulkActionJob.FINISHED)
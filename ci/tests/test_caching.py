@@ -0,0 +1,275 @@
+import threading
+import time
+
+import responses
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils.six import StringIO
+from seed_services_client import (
+    ControlInterfaceApiClient, StageBasedMessagingApiClient)
+from seed_services_client.metrics import MetricsApiClient
+
+from .. import caching, clients
+
+
+class MessagesetCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sbm_api = StageBasedMessagingApiClient(
+            'sbmtoken', 'http://sbm.example.com/')
+
+    def add_messagesets_callback(self):
+        responses.add(
+            responses.GET,
+            'http://sbm.example.com/messageset/',
+            json={
+                'next': None,
+                'results': [
+                    {'id': 1, 'short_name': 'ms.1', 'default_schedule': 2},
+                    {'id': 3, 'short_name': 'ms.3', 'default_schedule': 4},
+                ],
+            },
+            status=200,
+            content_type='application/json')
+
+    @responses.activate
+    def test_get_messagesets(self):
+        """
+        The messagesets should be fetched once, with the lookups built from
+        them, and returned from the cache afterwards.
+        """
+        self.add_messagesets_callback()
+
+        messagesets = caching.get_messagesets(self.sbm_api)
+        self.assertEqual(messagesets.short_names, {1: 'ms.1', 3: 'ms.3'})
+        self.assertEqual(messagesets.schedules, {1: 2, 3: 4})
+        self.assertEqual(messagesets.choices, [(1, 'ms.1'), (3, 'ms.3')])
+
+        self.assertEqual(caching.get_messagesets(self.sbm_api), messagesets)
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_invalidate_messagesets(self):
+        """
+        Invalidating the messagesets should cause them to be fetched again.
+        """
+        self.add_messagesets_callback()
+
+        caching.get_messagesets(self.sbm_api)
+        caching.invalidate_messagesets()
+        caching.get_messagesets(self.sbm_api)
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    @override_settings(MESSAGESET_CACHE_TTL=0)
+    def test_messagesets_ttl(self):
+        """
+        The cached messagesets should expire after the configured TTL.
+        """
+        self.add_messagesets_callback()
+
+        caching.get_messagesets(self.sbm_api)
+        caching.get_messagesets(self.sbm_api)
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_get_messageset_languages(self):
+        responses.add(
+            responses.GET,
+            'http://sbm.example.com/messageset_languages/',
+            json={"1": ["eng_ZA"]},
+            status=200,
+            content_type='application/json')
+
+        self.assertEqual(
+            caching.get_messageset_languages(self.sbm_api), {"1": ["eng_ZA"]})
+        self.assertEqual(
+            caching.get_messageset_languages(self.sbm_api), {"1": ["eng_ZA"]})
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_refresh_reference_data_command(self):
+        """
+        The command should invalidate the cached messagesets, and fetch them
+        again if given the service details.
+        """
+        self.add_messagesets_callback()
+        responses.add(
+            responses.GET,
+            'http://sbm.example.com/messageset_languages/',
+            json={},
+            status=200,
+            content_type='application/json')
+        caching.get_messagesets(self.sbm_api)
+
+        stdout = StringIO()
+        call_command(
+            'refresh_reference_data', '--sbm-url', 'http://sbm.example.com/',
+            '--sbm-token', 'sbmtoken', stdout=stdout)
+        self.assertEqual(len(responses.calls), 3)
+        self.assertIn('Cached 2 messagesets', stdout.getvalue())
+
+        caching.get_messagesets(self.sbm_api)
+        self.assertEqual(len(responses.calls), 3)
+
+
+class DashboardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ci_api = ControlInterfaceApiClient(
+            'token', 'http://ci.example.com/api/v1')
+
+    @responses.activate
+    def test_get_dashboard(self):
+        """
+        Dashboards should be fetched once, until they're invalidated by the
+        refresh_reference_data command.
+        """
+        responses.add(
+            responses.GET, 'http://ci.example.com/api/v1/dashboard/1/',
+            json={'id': 1, 'widgets': []})
+
+        self.assertEqual(
+            caching.get_dashboard(self.ci_api, 1), {'id': 1, 'widgets': []})
+        caching.get_dashboard(self.ci_api, 1)
+        self.assertEqual(len(responses.calls), 1)
+
+        stdout = StringIO()
+        call_command('refresh_reference_data', stdout=stdout)
+        self.assertIn('Invalidated cached dashboards', stdout.getvalue())
+        self.assertIn('Invalidated cached user directory', stdout.getvalue())
+        caching.get_dashboard(self.ci_api, 1)
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_get_user_directory(self):
+        """
+        The user directory should be cached separately for each token, since
+        different users can see different users.
+        """
+        responses.add(
+            responses.GET, 'http://auth.example.com/users/',
+            json=[{'id': 1, 'email': 'one@example.com'}])
+
+        for token in ('token1', 'token1', 'token2'):
+            self.assertEqual(
+                caching.get_user_directory(clients.TokenAuthApiClient(
+                    token, 'http://auth.example.com')),
+                {'1': 'one@example.com'})
+        self.assertEqual(
+            [call.request.headers['Authorization']
+             for call in responses.calls],
+            ['Token token1', 'Token token2'])
+
+
+class IdentityCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_get_identity_section(self):
+        """
+        Identity sections should be cached separately for each service, until
+        they're invalidated.
+        """
+        api1 = StageBasedMessagingApiClient('token', 'http://sbm1.example.com')
+        api2 = StageBasedMessagingApiClient('token', 'http://sbm2.example.com')
+
+        self.assertEqual(caching.get_identity_section(
+            api1, 'identity', 'subscriptions', lambda: 'sbm1'), 'sbm1')
+        self.assertEqual(caching.get_identity_section(
+            api2, 'identity', 'subscriptions', lambda: 'sbm2'), 'sbm2')
+        self.assertEqual(caching.get_identity_section(
+            api1, 'identity', 'subscriptions', lambda: 'new'), 'sbm1')
+
+        caching.invalidate_identity('identity', ['subscriptions'])
+        for api in (api1, api2):
+            self.assertEqual(caching.get_identity_section(
+                api, 'identity', 'subscriptions', lambda: 'new'), 'new')
+
+
+class MetricCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.metrics_api = MetricsApiClient('http://metrics.example.com/')
+
+    def test_parse_interval(self):
+        self.assertEqual(caching.parse_interval('1d'), 86400)
+        self.assertEqual(caching.parse_interval('2h'), 7200)
+        self.assertEqual(caching.parse_interval('1mon'), 2592000)
+        self.assertEqual(caching.parse_interval('soon'), None)
+        self.assertEqual(caching.parse_interval(None), None)
+
+    def test_canonicalise_metric_query(self):
+        """
+        Metrics should be sorted, absolute start times rounded down to the
+        interval, and every value of other repeated parameters kept.
+        """
+        self.assertEqual(caching.canonicalise_metric_query({
+            'm': ['b.sum', 'a.sum', 'b.sum'],
+            'start': ['86500'],
+            'interval': ['1d'],
+            'nulls': [],
+        }), {
+            'm': ['a.sum', 'b.sum'],
+            'start': '86400',
+            'interval': '1d',
+            'nulls': '',
+        })
+        self.assertEqual(caching.canonicalise_metric_query({
+            'm': ['a.sum'], 'start': '-30d', 'interval': '1d',
+        })['start'], '-30d')
+        self.assertEqual(caching.canonicalise_metric_query({
+            'm': ['a.sum'], 'tag': ['b', 'a'],
+        })['tag'], ['a', 'b'])
+
+    @responses.activate
+    @override_settings(METRIC_CACHE_TTL=60)
+    def test_get_metrics(self):
+        """
+        Equivalent queries should share a single upstream request.
+        """
+        responses.add(
+            responses.GET, 'http://metrics.example.com/metrics/',
+            json={'a.sum': [], 'b.sum': []})
+
+        results = caching.get_metrics(self.metrics_api, {
+            'm': ['a.sum', 'b.sum'], 'start': ['-30d'], 'interval': ['1d']})
+        self.assertEqual(results, {'a.sum': [], 'b.sum': []})
+        caching.get_metrics(self.metrics_api, {
+            'm': ['b.sum', 'a.sum'], 'start': ['-30d'], 'interval': ['1d']})
+        self.assertEqual(len(responses.calls), 1)
+
+    def test_single_flight(self):
+        """
+        Calls for a key made while another is in flight should wait for, and
+        return, the result of the call in flight.
+        """
+        flight = caching.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 'result'
+
+        results = []
+        leader = threading.Thread(
+            target=lambda: results.append(flight.do('key', slow)))
+        leader.start()
+        started.wait()
+        follower = threading.Thread(
+            target=lambda: results.append(flight.do('key', slow)))
+        follower.start()
+        # Give the follower a chance to find the call in flight
+        time.sleep(0.1)
+        release.set()
+        leader.join()
+        follower.join()
+
+        self.assertEqual(results, ['result', 'result'])
+        self.assertEqual(len(calls), 1)
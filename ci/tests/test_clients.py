@@ -0,0 +1,169 @@
+import threading
+
+from django.test import TestCase, RequestFactory, override_settings
+from seed_services_client import HubApiClient, IdentityStoreApiClient
+
+from .. import clients, users
+
+
+class ClientRegistryTests(TestCase):
+    def setUp(self):
+        self.registry = clients.ClientRegistry()
+        self.addCleanup(self.registry.clear)
+
+    def get_request(self, tokens):
+        request = RequestFactory().get('/')
+        request.session = {'user_id': 1}
+        users.set_user_data(request.session, {
+            'tokens': tokens, 'dashboards': [], 'default_dashboard': None})
+        return request
+
+    def test_reuses_client(self):
+        """
+        Getting a client for the same key twice should return the same
+        instance, only calling the factory once.
+        """
+        created = []
+
+        def factory():
+            created.append(1)
+            return HubApiClient('token', 'http://hub.example.com/')
+
+        client1 = self.registry.get(('HUB', 'url', 'token'), factory)
+        client2 = self.registry.get(('HUB', 'url', 'token'), factory)
+        self.assertIs(client1, client2)
+        self.assertEqual(len(created), 1)
+        self.assertEqual(len(self.registry), 1)
+
+    @override_settings(UPSTREAM_CLIENT_IDLE_TIMEOUT=-1)
+    def test_evicts_idle_clients(self):
+        """
+        Clients that haven't been used within the idle timeout should be
+        replaced with new instances.
+        """
+        def factory():
+            return HubApiClient('token', 'http://hub.example.com/')
+
+        client1 = self.registry.get(('HUB', 'url', 'token'), factory)
+        client2 = self.registry.get(('HUB', 'url', 'token'), factory)
+        self.assertIsNot(client1, client2)
+        self.assertEqual(len(self.registry), 1)
+
+    @override_settings(UPSTREAM_POOL_CONNECTIONS=3, UPSTREAM_POOL_MAXSIZE=7)
+    def test_mount_pooled_adapters(self):
+        """
+        The client's adapters should be sized according to the settings,
+        keeping the timeout that the client was configured with.
+        """
+        client = clients.mount_pooled_adapters(IdentityStoreApiClient(
+            'token', 'http://idstore.example.com/', timeout=12))
+        adapter = client.session.get_adapter('https://')
+        self.assertEqual(adapter._pool_connections, 3)
+        self.assertEqual(adapter._pool_maxsize, 7)
+        self.assertEqual(adapter.timeout, 12)
+
+    def test_get_service_client(self):
+        """
+        Service clients are keyed on the service, url and token from the
+        session.
+        """
+        tokens = {
+            'HUB': {'url': 'http://hub.example.com/', 'token': 'token1'},
+        }
+        client1 = users.get_service_client(self.get_request(tokens), 'HUB')
+        client2 = users.get_service_client(self.get_request(tokens), 'HUB')
+        self.assertIsInstance(client1, HubApiClient)
+        self.assertIs(client1, client2)
+
+        tokens['HUB']['token'] = 'token2'
+        client3 = users.get_service_client(self.get_request(tokens), 'HUB')
+        self.assertIsNot(client1, client3)
+
+
+class FanOutTests(TestCase):
+    def test_fan_out(self):
+        """
+        Each call's result should be returned under its name.
+        """
+        results, errors = clients.fan_out({
+            'one': lambda: 1,
+            'two': lambda: 2,
+        })
+        self.assertEqual(results, {'one': 1, 'two': 2})
+        self.assertEqual(errors, {})
+
+    def test_fan_out_errors(self):
+        """
+        A failing call should be returned in the errors, without affecting
+        the other calls.
+        """
+        error = ValueError('failed')
+
+        def fail():
+            raise error
+
+        results, errors = clients.fan_out({
+            'one': lambda: 1,
+            'two': fail,
+        })
+        self.assertEqual(results, {'one': 1})
+        self.assertEqual(errors, {'two': error})
+
+    def test_fan_out_nested(self):
+        """
+        Fanning out from inside a fanned out call should run the inner calls
+        inline rather than waiting on the pool.
+        """
+        results, _ = clients.fan_out({
+            'outer': lambda: clients.fan_out({
+                'a': lambda: 'a',
+                'b': lambda: 'b',
+            })[0],
+            'other': lambda: None,
+        })
+        self.assertEqual(results['outer'], {'a': 'a', 'b': 'b'})
+
+    def test_fetch_all(self):
+        """
+        fetch_all should consume the paginated results when called.
+        """
+        def method(params=None):
+            return {'results': (i for i in range(3))}
+
+        fetch = clients.fetch_all(method, params={})
+        self.assertEqual(fetch(), {'results': [0, 1, 2]})
+
+    def test_map_concurrently(self):
+        """
+        Each item's result or error should be yielded in the order of the
+        items, without taking more than the window of items ahead.
+        """
+        error = ValueError('failed')
+        taken = []
+
+        def items():
+            for i in range(4):
+                taken.append(i)
+                yield i
+
+        def func(i):
+            if i == 2:
+                raise error
+            return i * 10
+
+        results = clients.map_concurrently(func, items(), 2)
+        self.assertEqual(next(results), (0, 0, None))
+        self.assertEqual(taken, [0, 1])
+        self.assertEqual(list(results), [
+            (1, 10, None), (2, None, error), (3, 30, None)])
+
+    def test_map_concurrently_executor(self):
+        """
+        The calls should be run on the named executor.
+        """
+        results = clients.map_concurrently(
+            lambda i: threading.current_thread(), range(2), 2,
+            executor='bulk')
+        threads = clients.get_executor('bulk')._threads
+        for item, thread, error in results:
+            self.assertIn(thread, threads)
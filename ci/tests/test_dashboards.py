@@ -0,0 +1,131 @@
+import json
+
+import responses
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from .. import clients, dashboards
+
+
+@override_settings(METRIC_API_URL='http://metrics-api.org/')
+class DashboardStreamTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_broadcast_changed(self):
+        """
+        Only the widgets whose values changed should be pushed to the
+        subscribers, and new subscribers should get the latest values of
+        every widget.
+        """
+        broadcaster = dashboards.DashboardBroadcaster('key', [])
+        subscriber = broadcaster.subscribe()
+
+        broadcaster.broadcast({'w1': {'objects': []}, 'w2': {'objects': []}})
+        self.assertEqual(
+            subscriber.get_nowait(),
+            {'w1': {'objects': []}, 'w2': {'objects': []}})
+
+        broadcaster.broadcast({
+            'w1': {'objects': []}, 'w2': {'error': 'Could not load metrics'}})
+        self.assertEqual(
+            subscriber.get_nowait(),
+            {'w2': {'error': 'Could not load metrics'}})
+
+        broadcaster.broadcast({
+            'w1': {'objects': []}, 'w2': {'error': 'Could not load metrics'}})
+        self.assertTrue(subscriber.empty())
+
+        self.assertEqual(broadcaster.subscribe().get_nowait(), {
+            'w1': {'objects': []}, 'w2': {'error': 'Could not load metrics'}})
+
+    def test_get_widget_query(self):
+        """
+        Pie widgets should be reduced, last value widgets should only get
+        their most recent points, and bar widgets should only query their
+        first metric.
+        """
+        def widget(type_of):
+            return {
+                'id': 2, 'nulls': 'zeroize', 'type_of': type_of,
+                'data': [{'key': 'one.sum'}, {'key': 'two.sum'}],
+            }
+
+        self.assertEqual(
+            dashboards.get_widget_query(widget('lines'), '-7d', '1d', 500), {
+                'id': 'w2', 'm': ['one.sum', 'two.sum'], 'start': '-7d',
+                'interval': '1d', 'nulls': 'zeroize', 'max_points': 500,
+                'reduce': None, 'tail': None,
+            })
+        query = dashboards.get_widget_query(widget('last'), '-7d', '1d')
+        self.assertEqual((query['reduce'], query['tail']), (None, 15))
+        self.assertEqual(dashboards.get_widget_query(
+            widget('pie'), '-7d', '1d')['reduce'], 'sum')
+        self.assertEqual(dashboards.get_widget_query(
+            widget('bars'), '-7d', '1d')['m'], ['one.sum'])
+
+    def test_stream_turned_off(self):
+        """
+        The stream shouldn't be available unless streaming is turned on, so
+        that dashboards can't tie up the request workers.
+        """
+        session = self.client.session
+        session['user_token'] = 'token'
+        session['user_permissions'] = [{'type': 'ci:view', 'object_id': 1}]
+        session.save()
+        response = self.client.get(
+            '/api/v1/dashboard/1/stream/?start=-7d&interval=1d')
+        self.assertEqual(response.status_code, 404)
+
+    @responses.activate
+    def test_fetch_widget_metrics_tail(self):
+        """
+        Only the given number of most recent points should be returned.
+        """
+        responses.add(
+            responses.GET, 'http://metrics-api.org/metrics/',
+            json={'one.sum': [{'x': i, 'y': float(i)} for i in range(20)]})
+        response = dashboards.fetch_widget_metrics([{
+            'id': 'w1', 'm': ['one.sum'], 'start': '-30d', 'interval': '1d',
+            'nulls': 'zeroize', 'tail': 15}])
+        values = response['w1']['objects'][0]['values']
+        self.assertEqual([p['x'] for p in values], list(range(5, 20)))
+
+    @responses.activate
+    @override_settings(DASHBOARD_STREAM_MAX_AGE=1, DASHBOARD_STREAMING=True)
+    def test_stream(self):
+        """
+        The stream should send the widget values as a server sent event, and
+        stop the broadcaster once nobody is subscribed.
+        """
+        responses.add(
+            responses.GET,
+            clients.get_ci_client().session.url + '/dashboard/1/',
+            json={'id': 1, 'widgets': [{
+                'id': 2, 'nulls': 'zeroize', 'type_of': 'lines',
+                'data': [{'key': 'one.sum', 'title': 'One'}],
+            }]})
+        responses.add(
+            responses.GET, 'http://metrics-api.org/metrics/',
+            json={'one.sum': [{'x': 1, 'y': 2.0}]})
+
+        session = self.client.session
+        session['user_token'] = 'token'
+        session['user_permissions'] = [{'type': 'ci:view', 'object_id': 1}]
+        session.save()
+        response = self.client.get(
+            '/api/v1/dashboard/1/stream/?start=-7d&interval=1d')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        events = [
+            chunk.decode('utf-8') for chunk in response.streaming_content]
+        self.assertEqual(events, ['data: %s\n\n' % json.dumps({
+            'widgets': {'w2': {'objects': [{
+                'key': 'one.sum', 'values': [{'x': 1, 'y': 2.0}]}]}}},
+            separators=(',', ':'))])
+        key = (1, '-7d', '1d', None)
+        broadcaster = dashboards._broadcasters.get(key)
+        if broadcaster is not None:
+            broadcaster.join(5)
+        self.assertEqual(dashboards._broadcasters.get(key), None)
@@ -0,0 +1,69 @@
+import json
+from datetime import datetime
+
+import pytz
+import responses
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils.six import StringIO
+
+from .. import health
+
+
+@override_settings(METRIC_API_URL='http://metrics-api.org/')
+class HealthChartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def add_metrics_callback(self):
+        responses.add(
+            responses.GET, 'http://metrics-api.org/metrics/', json={})
+
+    def test_seconds_until_boundary(self):
+        dt = pytz.utc.localize(datetime(2017, 1, 2, 10, 59, 30))
+        self.assertEqual(health.seconds_until_boundary(dt, health.HOUR), 30)
+        self.assertEqual(
+            health.seconds_until_boundary(dt, health.DAY), 13 * 3600 + 30)
+
+    def test_get_chart_unknown(self):
+        self.assertEqual(health.get_chart('messages', 'unknown'), None)
+        self.assertEqual(health.get_chart('unknown', 'sent-today'), None)
+
+    @responses.activate
+    def test_get_chart(self):
+        """
+        A chart should be computed on a cache miss, and served from the cache
+        afterwards.
+        """
+        self.add_metrics_callback()
+
+        payload = health.get_chart('registrations', 'registrations-today')
+        self.assertEqual(payload, {'Today': [0] * 24, 'Yesterday': [0] * 24})
+        health.get_chart('registrations', 'registrations-today')
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_refresh_command(self):
+        """
+        The command should precompute every chart, so that the views don't
+        need to query the Metrics API.
+        """
+        self.add_metrics_callback()
+        stdout = StringIO()
+        call_command('refresh_health_charts', stdout=stdout)
+        self.assertEqual(stdout.getvalue().strip(), 'Refreshed health charts')
+        calls = len(responses.calls)
+        self.assertEqual(calls, 7)
+
+        session = self.client.session
+        session['user_token'] = 'token'
+        session['user_permissions'] = [{'type': 'ci:view', 'object_id': 1}]
+        session.save()
+        response = self.client.get(
+            '/health/messages/?chart_type=sent-this-week',
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(json.loads(response.content.decode('utf-8')), {
+            'Last week': [0] * 7, 'This week': [0] * 7})
+        self.assertEqual(len(responses.calls), calls)
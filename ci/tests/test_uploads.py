@@ -0,0 +1,141 @@
+import csv
+from io import BytesIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from openpyxl import Workbook, load_workbook
+
+from .. import uploads
+from ..forms import IdentityLookupForm, MsisdnReportGenerationForm
+
+
+def make_workbook(rows, name='msisdns.xlsx'):
+    wb = Workbook()
+    ws = wb.active
+    for row in rows:
+        ws.append(row)
+    content = BytesIO()
+    wb.save(content)
+    return SimpleUploadedFile(name, content.getvalue())
+
+
+def make_csv(content, name='msisdns.csv'):
+    return SimpleUploadedFile(name, content.encode('utf-8'))
+
+
+class UploadsTests(TestCase):
+    def test_iter_msisdns_workbook(self):
+        """
+        The phone numbers should be read from the header's column, normalised
+        and deduplicated.
+        """
+        upload = make_workbook([
+            ['Name', None, 'Phone Number'],
+            ['a', None, '+234 800 000 0001'],
+            ['b', None, 2348000000002],
+            ['c', None, None],
+            ['d', None, '+2348000000001'],
+            ['e', None, 2348000000003.0],
+        ])
+        self.assertEqual(list(uploads.iter_msisdns(upload)), [
+            '+2348000000001', '2348000000002', '2348000000003'])
+
+    def test_iter_msisdns_csv(self):
+        upload = make_csv(
+            '\ufeffphone number,name\r\n+27 82 000 0001,a\r\n,b\r\n'
+            '+27820000001,c\r\n+27820000002,d\r\n')
+        self.assertEqual(list(uploads.iter_msisdns(upload)), [
+            '+27820000001', '+27820000002'])
+
+    def test_iter_msisdns_missing_column(self):
+        upload = make_workbook([['Name'], ['a']])
+        with self.assertRaisesRegexp(uploads.UploadError, 'Phone number'):
+            list(uploads.iter_msisdns(upload))
+
+    def test_iter_msisdns_invalid(self):
+        upload = make_csv('phone number\n+27820000001\nnot a number\n')
+        with self.assertRaisesRegexp(uploads.UploadError, 'valid phone'):
+            list(uploads.iter_msisdns(upload))
+
+    def test_iter_msisdns_limit(self):
+        """
+        Only up to the limit of unique MSISDNs should be accepted, but
+        duplicates don't count towards it.
+        """
+        upload = make_csv('phone number\n1\n2\n1\n2\n')
+        self.assertEqual(
+            list(uploads.iter_msisdns(upload, max_msisdns=2)), ['1', '2'])
+
+        upload = make_csv('phone number\n1\n2\n3\n')
+        with self.assertRaisesRegexp(uploads.UploadError, 'at most 2'):
+            list(uploads.iter_msisdns(upload, max_msisdns=2))
+
+    def test_invalid_file(self):
+        upload = SimpleUploadedFile('msisdns.xlsx', b'not a workbook')
+        with self.assertRaises(uploads.UploadError):
+            list(uploads.iter_msisdns(upload))
+
+    def test_csv_not_utf8(self):
+        """
+        CSV files that aren't UTF-8 encoded should be rejected.
+        """
+        upload = SimpleUploadedFile(
+            'msisdns.csv', 'phone number,name\n1,Zo\xeb\n'.encode('latin-1'))
+        with self.assertRaisesRegexp(uploads.UploadError, 'UTF-8'):
+            list(uploads.iter_msisdns(upload))
+
+    def test_invalid_csv(self):
+        """
+        CSV files that can't be parsed should be rejected.
+        """
+        upload = make_csv(
+            'phone number\n' + '1' * (csv.field_size_limit() + 1) + '\n')
+        with self.assertRaisesRegexp(uploads.UploadError, 'valid CSV'):
+            list(uploads.iter_msisdns(upload))
+
+    def test_close_workbook(self):
+        """
+        Closing a read-only workbook should close the file that it reads its
+        rows from.
+        """
+        wb = load_workbook(make_workbook([['Phone number']]), read_only=True)
+        uploads._close_workbook(wb)
+        self.assertIsNone(wb._archive.fp)
+
+    @override_settings(MSISDN_UPLOAD_LIMIT=1)
+    def test_report_form(self):
+        form = MsisdnReportGenerationForm({}, {
+            'msisdn_list': make_csv('phone number\n1\n1\n')})
+        form.is_valid()
+        self.assertEqual(form.cleaned_data['msisdn_list'], ['1'])
+
+        form = MsisdnReportGenerationForm({}, {
+            'msisdn_list': make_csv('phone number\n1\n2\n')})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['msisdn_list'], [
+            'Invalid contents for: msisdns.csv. File must contain at most 1 '
+            'phone numbers'])
+
+        form = MsisdnReportGenerationForm({}, {
+            'msisdn_list': SimpleUploadedFile(
+                'msisdns.csv', 'phone number\n\xe9\n'.encode('latin-1'))})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['msisdn_list'], [
+            'Invalid contents for: msisdns.csv. CSV files must be saved as '
+            'UTF-8 CSV files'])
+
+    @override_settings(IDENTITY_LOOKUP_LIMIT=1)
+    def test_identity_lookup_form(self):
+        """
+        The identity lookup form should check the whole upload, but return
+        the upload instead of the phone numbers, so that they can be read as
+        they are looked up.
+        """
+        upload = make_csv('phone number\n1\n1\n')
+        form = IdentityLookupForm({}, {'msisdn_list': upload})
+        self.assertTrue(form.is_valid())
+        self.assertIs(form.cleaned_data['msisdn_list'], upload)
+
+        form = IdentityLookupForm({}, {
+            'msisdn_list': make_csv('phone number\n1\n2\n')})
+        self.assertFalse(form.is_valid())
@@ -1,8 +1,16 @@
+import os
+import time
+
 import pytz
 
 from datetime import datetime
 
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils.six import StringIO
+import responses
+from seed_services_client import HubApiClient
 
 from .. import utils
 
@@ -62,6 +70,130 @@ class UtilsTests(TestCase):
         # Test data format
         self.assertEqual(r2, [1.0, 1.0, 1.0, 0.0, 0.0, 2.0])
 
+    def test_timeseries_window(self):
+        """
+        Points should be placed in their nearest bucket, with missing buckets
+        being zero, regardless of the order that they're in.
+        """
+        ts = utils.Timeseries.from_metrics({
+            'registrations.created.sum': [
+                {'x': 3000, 'y': 3.0},
+                {'x': 1000, 'y': 1.0},
+                {'x': 4010, 'y': 4.0},
+                {'x': 6000, 'y': 6.0},
+            ]
+        })
+        self.assertEqual(ts.xs, [1000, 3000, 4010, 6000])
+        self.assertEqual(ts.window(1000, 5000, 1000), [1.0, 0, 3.0, 4.0, 0])
+        self.assertEqual(
+            ts.windows([(0, 2000), (4000, 7000)], 1000),
+            [[0, 1.0, 0], [4.0, 0, 6.0, 0]])
+        self.assertEqual(
+            utils.Timeseries.from_metrics({}).window(0, 2000, 1000),
+            [0, 0, 0])
+
+    def test_benchmark_timeseries_command(self):
+        """
+        The benchmark should time both ways of windowing a series.
+        """
+        stdout = StringIO()
+        call_command(
+            'benchmark_timeseries', '--points=100', '--repeat=1',
+            stdout=stdout)
+        self.assertIn('scanning:', stdout.getvalue())
+        self.assertIn('bisection:', stdout.getvalue())
+
+    def test_get_ranged_windows_from_timeseries(self):
+        """
+        Each datetime's week should be returned from the same timeseries.
+        """
+        day = 24 * 60 * 60 * 1000
+        # Monday 2 January 2017 00:00 UTC
+        monday = 1483315200000
+        ts = {'message.sent.sum': [
+            {'x': monday + i * day, 'y': float(i)} for i in range(-7, 7)]}
+        this_week, last_week = utils.get_ranged_windows_from_timeseries(
+            ts, [
+                pytz.utc.localize(datetime(2017, 1, 4, 12)),
+                pytz.utc.localize(datetime(2016, 12, 28, 12)),
+            ])
+        self.assertEqual(this_week, [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+        self.assertEqual(last_week, [-7.0, -6.0, -5.0, -4.0, -3.0, -2.0, -1.0])
+        self.assertEqual(utils.get_ranged_data_from_timeseries(
+            ts, pytz.utc.localize(datetime(2017, 1, 4, 12))), this_week)
+        self.assertRaises(
+            ValueError, utils.get_ranged_data_from_timeseries, ts,
+            pytz.utc.localize(datetime(2017, 1, 4, 12)), 'month')
+
+    def test_downsample_series(self):
+        """
+        The first and last points, and the points that most affect the shape
+        of the series, should be kept.
+        """
+        points = [{'x': x, 'y': 0.0} for x in range(100)]
+        points[40]['y'] = 50.0
+        points[70]['y'] = None
+
+        sampled = utils.downsample_series(points, 10)
+        self.assertEqual(len(sampled), 10)
+        self.assertEqual(sampled[0], points[0])
+        self.assertEqual(sampled[-1], points[-1])
+        self.assertIn(points[40], sampled)
+        self.assertEqual(sampled, sorted(sampled, key=lambda p: p['x']))
+
+        self.assertIs(utils.downsample_series(points, None), points)
+        self.assertIs(utils.downsample_series(points, 100), points)
+
+    def test_to_columnar_series(self):
+        """
+        The x values should be the differences from the previous x.
+        """
+        self.assertEqual(utils.to_columnar_series({
+            'key': 'one.sum',
+            'values': [
+                {'x': 3600000, 'y': 1.0},
+                {'x': 7200000, 'y': 2.0},
+                {'x': 10800000, 'y': 0.0},
+            ]
+        }), {
+            'key': 'one.sum',
+            'x': [3600000, 3600000, 3600000],
+            'y': [1.0, 2.0, 0.0],
+        })
+        self.assertEqual(
+            utils.to_columnar_series({'key': 'one.sum', 'values': []}),
+            {'key': 'one.sum', 'x': [], 'y': []})
+        self.assertEqual(utils.to_columnar_widgets({
+            'w1': {'objects': [{'key': 'one.sum', 'values': []}]},
+            'w2': {'error': 'Could not load metrics'},
+        }), {
+            'w1': {'objects': [{'key': 'one.sum', 'x': [], 'y': []}]},
+            'w2': {'error': 'Could not load metrics'},
+        })
+
+    def test_reduce_series(self):
+        points = [
+            {'x': 1, 'y': 2.0},
+            {'x': 2, 'y': None},
+            {'x': 3, 'y': 6.0},
+            {'x': 4, 'y': 1.0},
+        ]
+        self.assertEqual(utils.reduce_series(points, 'last'), 1.0)
+        self.assertEqual(utils.reduce_series(points, 'sum'), 9.0)
+        self.assertEqual(utils.reduce_series(points, 'max'), 6.0)
+        self.assertEqual(utils.reduce_series(points, 'min'), 1.0)
+        self.assertEqual(utils.reduce_series(points, 'avg'), 3.0)
+        self.assertEqual(utils.reduce_series([], 'sum'), None)
+        self.assertEqual(
+            utils.get_series_object('one.sum', points, reduction='sum'),
+            {'key': 'one.sum', 'value': 9.0})
+
+    def test_parse_max_points(self):
+        self.assertEqual(utils.parse_max_points('200'), 200)
+        self.assertEqual(utils.parse_max_points(1), 3)
+        self.assertEqual(utils.parse_max_points('lots'), None)
+        self.assertEqual(utils.parse_max_points(None), None)
+
     def test_get_last_value_from_timeseries(self):
         ts = {
             'subscriptions.send.estimate.1.last': [
@@ -78,6 +210,31 @@ class UtilsTests(TestCase):
         r2 = utils.get_last_value_from_timeseries({})
         self.assertEqual(r2, 0)
 
+    def test_get_timestamp(self):
+        """
+        Timestamps should be for UTC, whatever the server's timezone is.
+        """
+        tz = pytz.timezone('Africa/Johannesburg')
+        expected = 1480896000000
+        old_tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'America/New_York'
+        time.tzset()
+        try:
+            self.assertEqual(
+                utils.get_timestamp(datetime(2016, 12, 5)), expected)
+            self.assertEqual(
+                utils.get_timestamp(pytz.utc.localize(datetime(2016, 12, 5))),
+                expected)
+            self.assertEqual(
+                utils.get_timestamp(tz.localize(datetime(2016, 12, 5, 2))),
+                expected)
+        finally:
+            if old_tz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = old_tz
+            time.tzset()
+
     def test_week_from_datetime(self):
         tz = pytz.timezone('Africa/Johannesburg')
         utc = pytz.timezone('UTC')
@@ -167,3 +324,215 @@ class UtilsTests(TestCase):
         page = utils.get_page_of_iterator(iterator, 5, 100)
         self.assertEqual(page.number, 1)
         self.assertEqual(list(page), [0, 1, 2, 3, 4])
+
+    def test_upstream_page(self):
+        """
+        The next and previous page numbers are the upstream page tokens.
+        """
+        page = utils.UpstreamPage(['a', 'b'], 'cursor=abc', None)
+        self.assertEqual(page.has_next(), True)
+        self.assertEqual(page.has_previous(), False)
+        self.assertEqual(page.next_page_number(), 'cursor=abc')
+        self.assertEqual(list(page), ['a', 'b'])
+        self.assertEqual(len(page), 2)
+
+    def test_get_page_token(self):
+        """
+        The page token should only contain the upstream link's query
+        parameters that select the page.
+        """
+        self.assertEqual(utils._get_page_token(None, {}), None)
+        self.assertEqual(utils._get_page_token(
+            'http://ms.example.com/outbound/?to_identity=1&cursor=abc'
+            '&page_size=30', {'to_identity': '1'}),
+            'cursor=abc')
+
+    def test_parse_page_token(self):
+        """
+        Only the parameters that select a page should be taken from a page
+        token, and tokens without any should be rejected.
+        """
+        self.assertEqual(utils.parse_page_token(None), {})
+        self.assertEqual(
+            utils.parse_page_token('cursor=abc&page_size=100000'),
+            {'cursor': ['abc']})
+        for token in ('2', 'page_size=100000'):
+            with self.assertRaises(utils.InvalidPageToken):
+                utils.parse_page_token(token)
+
+    def add_registrations_pages(self, pages, page_size):
+        for i in range(pages):
+            if i + 1 < pages:
+                next_url = 'http://hub.example.com/registrations/' + (
+                    '?cursor=%s' % (i + 1))
+            else:
+                next_url = None
+            responses.add(
+                responses.GET,
+                'http://hub.example.com/registrations/' + (
+                    '?cursor=%s' % i if i else ''),
+                json={
+                    'next': next_url,
+                    'previous': None,
+                    'results': [
+                        {'id': i * page_size + j} for j in range(page_size)],
+                },
+                match_querystring=True)
+
+    @responses.activate
+    def test_get_page_of_upstream_reuses_cursors(self):
+        """
+        Fetching a page after having visited an earlier one should start from
+        the remembered upstream next link, instead of the first page.
+        """
+        cache.clear()
+        hub = HubApiClient('token', 'http://hub.example.com/')
+        self.add_registrations_pages(5, 2)
+
+        page = utils.get_page_of_upstream(
+            hub.session, '/registrations/', {}, 2, 2, user=1, prefetch=False)
+        self.assertEqual([r['id'] for r in page], [2, 3])
+        self.assertEqual(page.has_next(), True)
+        self.assertEqual(len(responses.calls), 3)
+
+        page = utils.get_page_of_upstream(
+            hub.session, '/registrations/', {}, 2, 4, user=1, prefetch=False)
+        self.assertEqual([r['id'] for r in page], [6, 7])
+        self.assertEqual(len(responses.calls), 5)
+        self.assertEqual(
+            responses.calls[3].request.url,
+            'http://hub.example.com/registrations/?cursor=3')
+
+        page = utils.get_page_of_upstream(
+            hub.session, '/registrations/', {}, 2, 5, user=1, prefetch=False)
+        self.assertEqual([r['id'] for r in page], [8, 9])
+        self.assertEqual(page.has_next(), False)
+        self.assertEqual(len(responses.calls), 6)
+
+    @responses.activate
+    def test_get_page_of_upstream_back_to_first_page(self):
+        """
+        Going back to the first page after having visited a later one should
+        fetch it from the start again.
+        """
+        cache.clear()
+        hub = HubApiClient('token', 'http://hub.example.com/')
+        self.add_registrations_pages(3, 2)
+
+        utils.get_page_of_upstream(
+            hub.session, '/registrations/', {}, 2, 2, user=1, prefetch=False)
+        calls = len(responses.calls)
+        page = utils.get_page_of_upstream(
+            hub.session, '/registrations/', {}, 2, 1, user=1, prefetch=False)
+        self.assertEqual([r['id'] for r in page], [0, 1])
+        self.assertEqual(
+            responses.calls[calls].request.url,
+            'http://hub.example.com/registrations/')
+
+    @responses.activate
+    def test_get_page_of_upstream_large_upstream_pages(self):
+        """
+        When the upstream pages are larger than the pages shown, pages that
+        start before the first remembered next link should be fetched from
+        the start.
+        """
+        cache.clear()
+        hub = HubApiClient('token', 'http://hub.example.com/')
+        self.add_registrations_pages(2, 5)
+
+        page = utils.get_page_of_upstream(
+            hub.session, '/registrations/', {}, 2, 1, user=1, prefetch=False)
+        self.assertEqual([r['id'] for r in page], [0, 1])
+        page = utils.get_page_of_upstream(
+            hub.session, '/registrations/', {}, 2, 2, user=1, prefetch=False)
+        self.assertEqual([r['id'] for r in page], [2, 3])
+        page = utils.get_page_of_upstream(
+            hub.session, '/registrations/', {}, 2, 4, user=1, prefetch=False)
+        self.assertEqual([r['id'] for r in page], [6, 7])
+        self.assertEqual(
+            responses.calls[-1].request.url,
+            'http://hub.example.com/registrations/?cursor=1')
+
+    @responses.activate
+    def test_get_page_of_upstream_prefetched(self):
+        """
+        A prefetched page should be served without any upstream requests.
+        """
+        cache.clear()
+        hub = HubApiClient('token', 'http://hub.example.com/')
+        self.add_registrations_pages(3, 2)
+        key = utils._get_pagination_key(
+            hub.session, '/registrations/', {}, 1)
+
+        utils._prefetch_page(hub.session, '/registrations/', {}, 2, 2, key)
+        calls = len(responses.calls)
+
+        page = utils.get_page_of_upstream(
+            hub.session, '/registrations/', {}, 2, 2, user=1, prefetch=False)
+        self.assertEqual([r['id'] for r in page], [2, 3])
+        self.assertEqual(page.has_next(), True)
+        self.assertEqual(len(responses.calls), calls)
+
+    @responses.activate
+    def test_invalidate_upstream_pages(self):
+        """
+        Invalidating an upstream API should make its prefetched pages be
+        fetched again.
+        """
+        cache.clear()
+        hub = HubApiClient('token', 'http://hub.example.com/')
+        self.add_registrations_pages(3, 2)
+        key = utils._get_pagination_key(
+            hub.session, '/registrations/', {}, 1)
+        utils._prefetch_page(hub.session, '/registrations/', {}, 2, 2, key)
+
+        utils.invalidate_upstream_pages(hub.session, '/registrations/')
+        calls = len(responses.calls)
+        utils.get_page_of_upstream(
+            hub.session, '/registrations/', {}, 2, 2, user=1, prefetch=False)
+        self.assertGreater(len(responses.calls), calls)
+
+    @responses.activate
+    def test_iter_upstream(self):
+        """
+        Iterating should yield every item, fetching each page lazily, one page
+        ahead of the items being consumed.
+        """
+        hub = HubApiClient('token', 'http://hub.example.com/')
+        self.add_registrations_pages(3, 2)
+
+        items = utils.iter_upstream(hub.session, '/registrations/', {})
+        self.assertEqual(next(items), {'id': 0})
+        self.assertLessEqual(len(responses.calls), 2)
+        self.assertEqual([r['id'] for r in items], [1, 2, 3, 4, 5])
+        self.assertEqual(len(responses.calls), 3)
+
+    def test_stream_csv(self):
+        self.assertEqual(
+            list(utils.stream_csv(['a', 'b'], [[1, 'x,y'], [None, True]])),
+            ['a,b\r\n', '1,"x,y"\r\n', ',True\r\n'])
+
+    @responses.activate
+    def test_stream_csv_upstream_error(self):
+        """
+        If fetching the rows fails part way through, the rows so far should be
+        followed by a line marking the export as incomplete.
+        """
+        hub = HubApiClient('token', 'http://hub.example.com/')
+        responses.add(
+            responses.GET, 'http://hub.example.com/registrations/',
+            match_querystring=True,
+            json={'next': 'http://hub.example.com/registrations/?cursor=1',
+                  'results': [{'id': 0}]})
+        responses.add(
+            responses.GET, 'http://hub.example.com/registrations/?cursor=1',
+            match_querystring=True, status=500)
+
+        rows = (
+            [r['id']] for r in
+            utils.iter_upstream(hub.session, '/registrations/', {}))
+        with self.assertLogs('ci.utils', level='ERROR'):
+            self.assertEqual(
+                list(utils.stream_csv(['id'], rows)),
+                ['id\r\n', '0\r\n',
+                 '# export incomplete: upstream error\r\n'])
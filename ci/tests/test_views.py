@@ -2,29 +2,39 @@ import json
 import responses
 
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
-from django.test import TestCase, Client, override_settings
+from django.test import TestCase, Client, RequestFactory, override_settings
 
+from .. import auditlog, caching, clients, users, utils, views
+from ..models import AuditLogEntry, BulkActionJob, BulkActionRow
 from ..views import get_identity_addresses
 
 
 class ViewTestsTemplate(TestCase):
     def setUp(self):
         self.client = Client()
+        cache.clear()
 
     def login(self):
         self.client.login(username='testuser', password='testpass')
         session = self.client.session
         session['user_token'] = 'temptoken'
         session['user_permissions'] = [{"object_id": 1, "type": "ci:view"}]
-        session['user_dashboards'] = []
         session['user_id'] = 123
-        session['user_list'] = {'123': "fred@something.com"}
+        users.set_user_data(session, {
+            "tokens": {}, "dashboards": [], "default_dashboard": None})
         session.save()
+        cache.set(
+            caching._user_directory_key(
+                settings.AUTH_SERVICE_URL, 'temptoken'),
+            {'123': "fred@something.com"})
 
     def set_session_user_tokens(self):
         session = self.client.session
-        session['user_tokens'] = {
+        data = users.get_user_data(self.get_session_request(session))
+        data["tokens"] = {
             "SEED_IDENTITY_SERVICE": {
                 "url": 'http://idstore.example.com/', "token": 'idstoretoken'},
             "HUB": {
@@ -35,8 +45,14 @@ class ViewTestsTemplate(TestCase):
                 "url": 'http://ms.example.com/', 'token': 'mstoken'
             }
         }
+        users.set_user_data(session, data)
         session.save()
 
+    def get_session_request(self, session):
+        request = RequestFactory().get('/')
+        request.session = session
+        return request
+
     def add_identities_callback(self, num=10, identities=None, qs=None):
         """
         Adds a callback for getting the list of identities.
@@ -248,6 +264,81 @@ class ViewTests(ViewTestsTemplate):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, "Please login to see this page")
 
+    def add_login_callbacks(self):
+        auth_url = settings.AUTH_SERVICE_URL
+        responses.add(
+            responses.POST, auth_url + '/user/tokens/',
+            json={'token': 'usertoken'})
+        responses.add(
+            responses.GET, auth_url + '/user/',
+            json={
+                'id': 123, 'email': 'fred@something.com',
+                'permissions': [{'object_id': 1, 'type': 'ci:view'}]})
+        ci_url = clients.get_ci_client().session.url
+        responses.add(
+            responses.GET, ci_url + '/userdashboard/',
+            json={'next': None, 'results': [{
+                'dashboards': [{'id': 1, 'name': 'Overview'}],
+                'default_dashboard': {'id': 1},
+            }]})
+        responses.add(
+            responses.GET, ci_url + '/userservicetoken/',
+            json={'next': None, 'results': [{
+                'token': 'hubtoken',
+                'service': {'name': 'HUB', 'url': 'http://hub.example.com'},
+            }]})
+
+    @responses.activate
+    def test_login(self):
+        """
+        Logging in should store the user's details in the session, and their
+        dashboards and tokens in the cache, without fetching the user
+        directory.
+        """
+        self.add_login_callbacks()
+
+        response = self.client.post('/login/', {
+            'username': 'fred@something.com', 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+        session = self.client.session
+        self.assertEqual(session['user_id'], 123)
+        self.assertNotIn('user_list', session)
+        self.assertNotIn('user_tokens', session)
+        request = self.get_session_request(session)
+        self.assertEqual(users.get_user_default_dashboard(request), 1)
+        self.assertEqual(users.get_user_tokens(request), {'HUB': {
+            'token': 'hubtoken', 'url': 'http://hub.example.com/api/v1'}})
+        self.assertEqual(len(responses.calls), 4)
+        urls = [c.request.url for c in responses.calls]
+        self.assertFalse(any(url.endswith('/users/') for url in urls))
+
+        self.client.post('/login/', {
+            'username': 'fred@something.com', 'password': 'secret'})
+        urls = [c.request.url for c in responses.calls[4:]]
+        self.assertFalse(any('/userdashboard/' in url for url in urls))
+
+    @responses.activate
+    def test_user_data_refetched(self):
+        """
+        If the user's data is no longer in the cache, it should be fetched
+        again from the control interface service.
+        """
+        self.add_login_callbacks()
+        self.login()
+        cache.clear()
+
+        session = self.client.session
+        request = self.get_session_request(session)
+        self.assertEqual(users.get_user_tokens(request), {'HUB': {
+            'token': 'hubtoken', 'url': 'http://hub.example.com/api/v1'}})
+        self.assertEqual(users.get_user_dashboards(request), [
+            {'id': 1, 'name': 'Overview'}])
+
+        request = self.get_session_request(session)
+        calls = len(responses.calls)
+        self.assertEqual(users.get_user_default_dashboard(request), 1)
+        self.assertEqual(len(responses.calls), calls)
+
     def test_get_identy_addresses_good(self):
         self.assertEqual(get_identity_addresses({
             'details': {
@@ -351,27 +442,31 @@ class ViewTests(ViewTestsTemplate):
                 "subscription": subscription_id
             })
 
-        audit_request_language = responses.calls[3].request
-        self.assertEqual(
-            json.loads(audit_request_language.body),
+        # The audit log entries are only sent when they're flushed
+        self.assertFalse(any(
+            call.request.url.endswith('/auditlog/')
+            for call in responses.calls))
+        self.assertEqual(auditlog.flush(), (2, 0))
+        audit_requests = sorted(
+            (json.loads(call.request.body) for call in responses.calls
+             if call.request.url.endswith('/auditlog/')),
+            key=lambda body: body["detail"])
+        self.assertEqual(audit_requests, [
             {
                 "identity_id": identity_id,
                 "action": "Update",
                 "action_by": 123,
                 "model": "subscription",
                 "detail": "Updated language: eng_ZA to zul_ZA"
-            })
-
-        audit_request_messageset = responses.calls[4].request
-        self.assertEqual(
-            json.loads(audit_request_messageset.body),
+            },
             {
                 "identity_id": identity_id,
                 "action": "Update",
                 "action_by": 123,
                 "model": "subscription",
                 "detail": "Updated messageset: test to test2"
-            })
+            }])
+        self.assertFalse(AuditLogEntry.objects.exists())
 
     @responses.activate
     @override_settings(METRIC_API_URL='http://metrics-api.org/')
@@ -416,43 +511,264 @@ class ViewTests(ViewTestsTemplate):
                 }
             ]})
 
+    @responses.activate
+    @override_settings(METRIC_API_URL='http://metrics-api.org/')
+    def test_dashboard_metric_max_points(self):
+        """
+        If max_points is given, the series should be downsampled rather than
+        max_points being passed on to the metrics api.
+        """
+        self.login()
+        responses.add(
+            responses.GET,
+            "http://metrics-api.org/metrics/?start=-90d&interval=1h&"
+            "m=one.total.sum&nulls=zeroize",
+            match_querystring=True,
+            json={'one.total.sum': [
+                {'y': float(i % 7), 'x': i} for i in range(2160)]})
+
+        response = self.client.get(
+            "/api/v1/metric/?start=-90d&interval=1h&m=one.total.sum"
+            "&nulls=zeroize&max_points=100")
+
+        self.assertEqual(response.status_code, 200)
+        [series] = json.loads(response.content.decode('utf-8'))["objects"]
+        self.assertEqual(series["key"], "one.total.sum")
+        self.assertEqual(len(series["values"]), 100)
+        self.assertEqual(series["values"][0], {'y': 0.0, 'x': 0})
+        self.assertEqual(series["values"][-1], {'y': 3.0, 'x': 2159})
+
+    @responses.activate
+    @override_settings(METRIC_API_URL='http://metrics-api.org/')
+    def test_dashboard_metric_columnar(self):
+        """
+        If the columnar format is requested, each series should be returned
+        as lists of x deltas and y values.
+        """
+        self.login()
+        responses.add(
+            responses.GET,
+            "http://metrics-api.org/metrics/?start=-30d&interval=1d&"
+            "m=one.total.sum&nulls=zeroize",
+            match_querystring=True,
+            json={'one.total.sum': [
+                {'y': 1.0, 'x': 111}, {'y': 2.0, 'x': 222}]})
+
+        response = self.client.get(
+            "/api/v1/metric/?start=-30d&interval=1d&m=one.total.sum"
+            "&nulls=zeroize&format=columnar")
+
+        self.assertEqual(
+            response.content.decode('utf-8'),
+            '{"objects":[{"key":"one.total.sum","x":[111,111],'
+            '"y":[1.0,2.0]}]}')
+
+    @responses.activate
+    @override_settings(METRIC_API_URL='http://metrics-api.org/')
+    def test_dashboard_metric_reduce(self):
+        """
+        If a reduction is given, only the reduced value of each series should
+        be returned.
+        """
+        self.login()
+        responses.add(
+            responses.GET,
+            "http://metrics-api.org/metrics/?start=-30d&interval=1d&"
+            "m=one.total.sum&m=two.total.sum&nulls=zeroize",
+            match_querystring=True,
+            json={'one.total.sum': [
+                {'y': 1.0, 'x': 111}, {'y': 2.0, 'x': 222}]})
+
+        response = self.client.get(
+            "/api/v1/metric/?start=-30d&interval=1d&m=one.total.sum"
+            "&m=two.total.sum&nulls=zeroize&reduce=sum")
+        self.assertEqual(json.loads(response.content.decode('utf-8')), {
+            "objects": [
+                {"key": "one.total.sum", "value": 3.0},
+                {"key": "two.total.sum", "value": None},
+            ]})
+
+        response = self.client.get(
+            "/api/v1/metric/?start=-30d&interval=1d&m=one.total.sum"
+            "&reduce=median")
+        self.assertEqual(response.status_code, 400)
+
+    @responses.activate
+    @override_settings(METRIC_API_URL='http://metrics-api.org/')
+    def test_dashboard_metrics_batch(self):
+        """
+        Widgets with the same query parameters should be fetched with a single
+        Metrics API request, and each widget's series returned under its id.
+        """
+        self.login()
+        self.set_session_user_tokens()
+
+        responses.add(
+            responses.GET,
+            "http://metrics-api.org/metrics/?start=-30d&interval=1d&"
+            "m=one.total.sum&m=two.total.sum&nulls=zeroize",
+            match_querystring=True,
+            json={
+                'one.total.sum': [{'y': 1.0, 'x': 111}],
+                'two.total.sum': [{'y': 4.0, 'x': 333}],
+            })
+        responses.add(
+            responses.GET,
+            "http://metrics-api.org/metrics/?start=-7d&interval=1d&"
+            "m=three.total.sum&nulls=",
+            match_querystring=True,
+            json={'three.total.sum': [{'y': 6.0, 'x': 123}]})
+
+        response = self.client.post(
+            "/api/v1/metric/batch/", json.dumps({"widgets": [
+                {"id": "w1", "m": ["one.total.sum"], "start": "-30d",
+                 "interval": "1d", "nulls": "zeroize"},
+                {"id": "w2", "m": ["two.total.sum", "one.total.sum"],
+                 "start": "-30d", "interval": "1d", "nulls": "zeroize"},
+                {"id": "w3", "m": ["three.total.sum"], "start": "-7d",
+                 "interval": "1d", "nulls": ""},
+            ]}), content_type="application/json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(json.loads(response.content.decode('utf-8')), {
+            "widgets": {
+                "w1": {"objects": [{
+                    "key": "one.total.sum",
+                    "values": [{"y": 1.0, "x": 111}]}]},
+                "w2": {"objects": [{
+                    "key": "two.total.sum",
+                    "values": [{"y": 4.0, "x": 333}]
+                }, {
+                    "key": "one.total.sum",
+                    "values": [{"y": 1.0, "x": 111}]}]},
+                "w3": {"objects": [{
+                    "key": "three.total.sum",
+                    "values": [{"y": 6.0, "x": 123}]}]},
+            }})
+
+    @responses.activate
+    @override_settings(METRIC_API_URL='http://metrics-api.org/')
+    def test_health_messages_estimated_vs_sent(self):
+        """
+        The sent and estimated metrics should be fetched with a single
+        Metrics API request.
+        """
+        self.login()
+        responses.add(
+            responses.GET, "http://metrics-api.org/metrics/",
+            json={
+                'subscriptions.send.estimate.%s.last' % day: [
+                    {'x': 1, 'y': float(day)}, {'x': 2, 'y': 0.0}]
+                for day in range(7)
+            })
+
+        response = self.client.get(
+            "/health/messages/?chart_type=estimated-vs-sent",
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(responses.calls), 1)
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['Estimated'], [0, 1, 2, 3, 4, 5, 6])
+        self.assertEqual(data['Sent'], [0] * 7)
+        params = utils.extract_query_params(responses.calls[0].request.url)
+        self.assertEqual(params['from'], ['-7d'])
+        self.assertEqual(len(params['m']), 8)
+
+    def test_dashboard_metrics_batch_invalid(self):
+        """
+        An invalid request body should be rejected.
+        """
+        self.login()
+        response = self.client.post(
+            "/api/v1/metric/batch/", "nope", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+        for widget in ({"m": ["a.sum"]}, {"id": 1, "m": "abc"},
+                       {"id": 1, "m": [1]}, {"id": 1},
+                       {"id": 1, "m": [], "reduce": "nope"}):
+            response = self.client.post(
+                "/api/v1/metric/batch/", json.dumps({"widgets": [widget]}),
+                content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+
 
 class IdentityViewTest(ViewTestsTemplate):
     def add_message_sender_inbound_responses(
-            self, count=1, identity='operator_id'):
+            self, count=1, identity='operator_id', cursor=None,
+            next_cursor=None):
+        """
+        Adds a callback for a single page of inbound messages. If cursor is
+        specified, the callback is for the page at that cursor. If
+        next_cursor is specified, the page links to the page at that cursor.
+        """
         message = {
             'content': 'Inbound message',
             'created_at': '2017-09-12T00:00Z',
             'updated_at': '2017-09-12T00:00Z',
         }
 
+        url = (
+            'http://ms.example.com/inbound/?from_identity={}'
+            '&ordering=-created_at&page_size={}'.format(
+                identity, settings.IDENTITY_MESSAGES_PAGE_SIZE))
+        next_url = None
+        if next_cursor is not None:
+            next_url = '{}&cursor={}'.format(url, next_cursor)
+        if cursor is not None:
+            url = '{}&cursor={}'.format(url, cursor)
+
         responses.add(
             responses.GET,
-            ('http://ms.example.com/inbound/?from_identity={}'
-             '&ordering=-created_at'.format(identity)),
+            url,
             match_querystring=True,
-            json={'results': [message for i in range(count)]},
+            json={
+                'next': next_url,
+                'previous': None,
+                'results': [message for i in range(count)],
+            },
             status=200,
             content_type='application/json')
 
     def add_message_sender_outbound_responses(
-            self, count=1, identity='operator_id'):
+            self, count=1, identity='operator_id', cursor=None,
+            next_cursor=None):
+        """
+        Adds a callback for a single page of outbound messages. If cursor is
+        specified, the callback is for the page at that cursor. If
+        next_cursor is specified, the page links to the page at that cursor.
+        """
         message = {
             'content': 'Outbound message',
             'created_at': '2017-09-12T00:00Z',
             'updated_at': '2017-09-12T00:00Z',
         }
 
+        url = (
+            'http://ms.example.com/outbound/?to_identity={}'
+            '&ordering=-created_at&page_size={}'.format(
+                identity, settings.IDENTITY_MESSAGES_PAGE_SIZE))
+        next_url = None
+        if next_cursor is not None:
+            next_url = '{}&cursor={}'.format(url, next_cursor)
+        if cursor is not None:
+            url = '{}&cursor={}'.format(url, cursor)
+
         responses.add(
             responses.GET,
-            ('http://ms.example.com/outbound/?to_identity={}'
-             '&ordering=-created_at'.format(identity)),
+            url,
             match_querystring=True,
-            json={'results': [message for i in range(count)]},
+            json={
+                'next': next_url,
+                'previous': None,
+                'results': [message for i in range(count)],
+            },
             status=200,
             content_type='application/json')
 
     def setUp(self):
+        super(IdentityViewTest, self).setUp()
         self.login()
         self.set_session_user_tokens()
         self.add_messagesets_callback([{
@@ -472,7 +788,8 @@ class IdentityViewTest(ViewTestsTemplate):
         self.add_message_sender_inbound_responses()
         self.add_message_sender_outbound_responses()
         self.add_auditlog_callback("operator_id")
-        response = self.client.get('/identities/operator_id/')
+        response = self.client.get(
+            '/identities/operator_id/sections/messages/')
 
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'Outbound message')
@@ -480,20 +797,92 @@ class IdentityViewTest(ViewTestsTemplate):
     @responses.activate
     @override_settings(IDENTITY_MESSAGES_PAGE_SIZE=1)
     def test_should_paginate_outbound_messages(self):
+        """
+        The next page link should pass the upstream cursor for the next page
+        of messages back to the view.
+        """
         self.add_message_sender_inbound_responses()
-        self.add_message_sender_outbound_responses(count=2)
+        self.add_message_sender_outbound_responses(next_cursor='abc')
         self.add_auditlog_callback("operator_id")
+        response = self.client.get(
+            '/identities/operator_id/sections/messages/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '?outbound_page=cursor%3Dabc')
+
+    @responses.activate
+    @override_settings(IDENTITY_MESSAGES_PAGE_SIZE=1)
+    def test_should_fetch_only_requested_outbound_page(self):
+        """
+        When given a page token, only the page of messages it refers to
+        should be fetched from the message sender.
+        """
+        self.add_message_sender_inbound_responses()
+        self.add_message_sender_outbound_responses(cursor='abc')
+        self.add_auditlog_callback("operator_id")
+        response = self.client.get(
+            '/identities/operator_id/sections/messages/'
+            '?outbound_page=cursor%3Dabc')
+
+        self.assertEqual(response.status_code, 200)
+        page = response.context['outbound_messages']
+        self.assertEqual(len(page), 1)
+        self.assertFalse(page.has_next())
+
+    @responses.activate
+    @override_settings(IDENTITY_MESSAGES_PAGE_SIZE=1)
+    def test_old_page_number_shows_first_page(self):
+        """
+        An old page number link should show the first page of messages, with
+        a warning, rather than being passed upstream.
+        """
+        self.add_message_sender_inbound_responses()
+        self.add_message_sender_outbound_responses(next_cursor='abc')
+        self.add_auditlog_callback("operator_id")
+        response = self.client.get(
+            '/identities/operator_id/sections/messages/?outbound_page=2')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['outbound_messages'].has_next())
+        self.assertContains(
+            response, 'That page of messages no longer exists, showing the '
+            'first page instead.')
+
+        # The identity page itself doesn't use the page tokens
+        response = self.client.get('/identities/operator_id/?outbound_page=2')
+        self.assertEqual(list(response.context['messages']), [])
+
+    @responses.activate
+    def test_failed_section_does_not_break_page(self):
+        """
+        If one of the sections can't be fetched, the page should still be
+        displayed, with an error message in the failed section.
+        """
+        responses.add(
+            responses.GET,
+            'http://localhost:8003/api/v1/auditlog/?identity_id=operator_id',
+            match_querystring=True, status=500, json={})
         response = self.client.get('/identities/operator_id/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Loading history')
 
+        response = self.client.get('/identities/operator_id/sections/audit/')
         self.assertEqual(response.status_code, 200)
-        self.assertContains(response, '?outbound_page=2')
+        self.assertContains(response, 'Could not load audit logs.')
+        self.assertEqual(response.context['audit_logs'], {'results': []})
+
+    @responses.activate
+    def test_unknown_section(self):
+        response = self.client.get('/identities/operator_id/sections/foo/')
+        self.assertEqual(response.status_code, 404)
 
     @responses.activate
     def test_should_display_inbound_messages(self):
         self.add_message_sender_inbound_responses()
         self.add_message_sender_outbound_responses()
         self.add_auditlog_callback("operator_id")
-        response = self.client.get('/identities/operator_id/')
+        response = self.client.get(
+            '/identities/operator_id/sections/messages/')
 
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'Inbound message')
@@ -501,13 +890,37 @@ class IdentityViewTest(ViewTestsTemplate):
     @responses.activate
     @override_settings(IDENTITY_MESSAGES_PAGE_SIZE=1)
     def test_should_paginate_inbound_messages(self):
-        self.add_message_sender_inbound_responses(count=2)
+        """
+        The next page link should pass the upstream cursor for the next page
+        of messages back to the view.
+        """
+        self.add_message_sender_inbound_responses(next_cursor='abc')
         self.add_message_sender_outbound_responses()
         self.add_auditlog_callback("operator_id")
-        response = self.client.get('/identities/operator_id/')
+        response = self.client.get(
+            '/identities/operator_id/sections/messages/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '?inbound_page=cursor%3Dabc')
+
+    @responses.activate
+    @override_settings(IDENTITY_MESSAGES_PAGE_SIZE=1)
+    def test_should_fetch_only_requested_inbound_page(self):
+        """
+        When given a page token, only the page of messages it refers to
+        should be fetched from the message sender.
+        """
+        self.add_message_sender_outbound_responses()
+        self.add_message_sender_inbound_responses(cursor='abc')
+        self.add_auditlog_callback("operator_id")
+        response = self.client.get(
+            '/identities/operator_id/sections/messages/'
+            '?inbound_page=cursor%3Dabc')
 
         self.assertEqual(response.status_code, 200)
-        self.assertContains(response, '?inbound_page=2')
+        page = response.context['inbound_messages']
+        self.assertEqual(len(page), 1)
+        self.assertFalse(page.has_next())
 
     @responses.activate
     def test_optout_identity(self):
@@ -575,6 +988,7 @@ class IdentityViewTest(ViewTestsTemplate):
         messages = list(response.context['messages'])
         self.assertEqual(messages[0].message, 'Successfully opted out.')
 
+        auditlog.flush()
         [_, _, request_audit] = filter(
             lambda r: r.method == 'POST',
             (r.request for r in responses.calls))
@@ -587,6 +1001,93 @@ class IdentityViewTest(ViewTestsTemplate):
             "detail": "Optout identity"
         })
 
+    @responses.activate
+    def test_optout_identity_partial_failure(self):
+        """
+        The addresses should be opted out separately, so that the ones that
+        failed are reported and can be retried, and addresses that are already
+        opted out should be skipped.
+        """
+        def optout_callback(request):
+            if json.loads(request.body)['address'] == '+2340000000002':
+                return (500, {}, '{}')
+            return (201, {}, '{}')
+        responses.add_callback(
+            responses.POST, 'http://idstore.example.com/optout/',
+            callback=optout_callback, content_type='application/json')
+        responses.add(
+            responses.POST, 'http://hub.example.com/optout_admin/',
+            json={}, status=201)
+
+        details = {'addresses': {'msisdn': {
+            '+2340000000000': {'optedout': True},
+            '+2340000000001': {},
+            '+2340000000002': {},
+        }}}
+        opted_out, failed = views.optout_identity(
+            users.get_service_client(
+                self.get_session_request(self.client.session),
+                'SEED_IDENTITY_SERVICE'),
+            users.get_service_client(
+                self.get_session_request(self.client.session), 'HUB'),
+            'operator_id', details)
+
+        self.assertEqual(opted_out, [
+            ('hub', 'operator_id'), ('msisdn', '+2340000000001')])
+        self.assertEqual(failed, [('msisdn', '+2340000000002')])
+        self.assertEqual(details['addresses']['msisdn'], {
+            '+2340000000000': {'optedout': True},
+            '+2340000000001': {'optedout': True},
+            '+2340000000002': {},
+        })
+        self.assertEqual(len(responses.calls), 3)
+
+    @responses.activate
+    def test_identity_sections_cached(self):
+        """
+        The identity page's sections should be cached between views, and a
+        change made through the page should read the identity afresh and only
+        refetch the sections that it affects.
+        """
+        self.add_message_sender_inbound_responses()
+        self.add_message_sender_outbound_responses()
+        self.add_auditlog_callback('operator_id')
+        responses.add(
+            responses.PATCH,
+            'http://sbm.example.com/subscriptions/subscription_id/',
+            json={}, status=201, content_type='application/json')
+
+        seen = []
+
+        def fetched():
+            calls = list(responses.calls)[len(seen):]
+            seen.extend(calls)
+            return sorted(
+                name for name in (
+                    'auditlog', 'changes', 'identities', 'registrations',
+                    'subscriptions')
+                if any('/{}/'.format(name) in call.request.url and
+                       call.request.method == 'GET' for call in calls))
+
+        def get_page():
+            self.client.get('/identities/operator_id/')
+            for section in ('registrations', 'changes', 'messages', 'audit'):
+                self.client.get(
+                    '/identities/operator_id/sections/%s/' % section)
+
+        get_page()
+        self.assertEqual(fetched(), [
+            'auditlog', 'changes', 'identities', 'registrations',
+            'subscriptions'])
+
+        get_page()
+        self.assertEqual(fetched(), [])
+
+        self.client.post('/identities/operator_id/', {
+            'deactivate_subscription': '',
+            'subscription_id': 'subscription_id'})
+        self.assertEqual(fetched(), ['identities', 'subscriptions'])
+
     @responses.activate
     def test_add_subscription_to_identity(self):
         """
@@ -618,6 +1119,7 @@ class IdentityViewTest(ViewTestsTemplate):
         self.assertEqual(
             list(response.context['messages'])[0].message,
             "Successfully created a subscription.")
+        auditlog.flush()
         [request, request_audit] = filter(
             lambda r: r.method == 'POST',
             (r.request for r in responses.calls))
@@ -671,6 +1173,7 @@ class IdentityViewTest(ViewTestsTemplate):
         self.assertEqual(
             list(response.context['messages'])[0].message,
             "Successfully created a subscription.")
+        auditlog.flush()
         [request, request_audit] = filter(
             lambda r: r.method == 'POST',
             (r.request for r in responses.calls))
@@ -728,6 +1231,7 @@ class IdentityViewTest(ViewTestsTemplate):
             list(response.context['messages'])[0].message,
             "Successfully deactivated the subscription.")
 
+        auditlog.flush()
         [request, request_audit] = filter(
             lambda r: r.method in ('POST', 'PATCH'),
             (r.request for r in responses.calls))
@@ -799,6 +1303,66 @@ class IdentitiesViewTest(ViewTestsTemplate):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(context['identities']), 5)
 
+    @responses.activate
+    def test_identity_lookup(self):
+        """
+        Uploading a list of phone numbers should stream back the identities
+        for each of them, and cache the lookups.
+        """
+        self.login()
+        self.set_session_user_tokens()
+        url = ('http://idstore.example.com/identities/search/'
+               '?details__addresses__msisdn=%2B{}')
+        responses.add(
+            responses.GET, url.format('27820000001'), match_querystring=True,
+            json={'next': None, 'results': [
+                {'id': 'identity-1'}, {'id': 'identity-2'}]})
+        responses.add(
+            responses.GET, url.format('27820000002'), match_querystring=True,
+            json={'next': None, 'results': []})
+        responses.add(
+            responses.GET, url.format('27820000003'), match_querystring=True,
+            status=500)
+
+        def lookup():
+            upload = SimpleUploadedFile(
+                'numbers.csv',
+                b'Phone number\n+27820000001\n+27820000002\n+27820000003\n')
+            response = self.client.post(
+                reverse('identity_lookup'), {'msisdn_list': upload})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                response['Content-Disposition'],
+                'attachment; filename="identities.csv"')
+            return b''.join(response.streaming_content).decode().splitlines()
+
+        expected = [
+            'Phone number,Identity,Status',
+            '+27820000001,identity-1,Found',
+            '+27820000001,identity-2,Found',
+            '+27820000002,,Not found',
+            '+27820000003,,Lookup failed',
+        ]
+        self.assertEqual(lookup(), expected)
+        seen = len(responses.calls)
+        self.assertEqual(lookup(), expected)
+        # Only the failed lookup is made again
+        self.assertEqual(
+            [call.request.url for call in responses.calls[seen:]],
+            [url.format('27820000003')])
+
+    def test_identity_lookup_invalid_file(self):
+        """
+        An upload without phone numbers should show the form's errors.
+        """
+        self.login()
+        self.set_session_user_tokens()
+        upload = SimpleUploadedFile('numbers.csv', b'Name\nSomeone\n')
+        response = self.client.post(
+            reverse('identity_lookup'), {'msisdn_list': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors['msisdn_list'])
+
 
 class RegistrationsViewTest(ViewTestsTemplate):
     @override_settings(REGISTRATION_LIST_PAGE_SIZE=5)
@@ -859,6 +1423,102 @@ class RegistrationsViewTest(ViewTestsTemplate):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(context['registrations']), 5)
 
+    @override_settings(REGISTRATION_LIST_PAGE_SIZE=5)
+    @responses.activate
+    def test_get_registrations_results_fragment(self):
+        """
+        In-page requests should only render the table of results, and the
+        response should vary on the header that marks them.
+        """
+        self.login()
+        self.set_session_user_tokens()
+        self.add_registrations_callback(num=10)
+
+        response = self.client.get(
+            reverse('registrations'), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [t.name for t in response.templates][0],
+            'ci/includes/registrations_results.html')
+        self.assertNotContains(response, '<html')
+        self.assertNotContains(response, 'list-filter')
+        self.assertContains(response, 'pagination__link--next')
+        self.assertIn('X-Requested-With', response['Vary'])
+        self.assertEqual(response['X-List-Results'], '1')
+
+        response = self.client.get(reverse('registrations'))
+        self.assertContains(response, '<html')
+        self.assertContains(response, 'list-results')
+        self.assertNotIn('X-List-Results', response)
+
+    def test_list_results_logged_out(self):
+        """
+        In-page requests made after the session has expired should be
+        redirected to the login page without the results header, so that the
+        page loads the login page in full.
+        """
+        response = self.client.get(
+            reverse('registrations'), HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            follow=True)
+        self.assertEqual(
+            [t.name for t in response.templates][0], 'ci/login.html')
+        self.assertNotIn('X-List-Results', response)
+
+    @responses.activate
+    def test_export_registrations(self):
+        """
+        Exporting should stream every page of the filtered registrations as
+        CSV rows.
+        """
+        self.login()
+        self.set_session_user_tokens()
+        qs = "?validated=True&{}=1234&{}={}".format(
+            settings.IDENTITY_FIELD, settings.STAGE_FIELD,
+            settings.STAGES[0][0])
+        responses.add(
+            responses.GET, 'http://hub.example.com/registrations/' + qs,
+            match_querystring=True, json={
+                'next': 'http://hub.example.com/registrations/?cursor=2',
+                'results': [{'id': 'registration-1', 'validated': True}],
+            })
+        responses.add(
+            responses.GET, 'http://hub.example.com/registrations/?cursor=2',
+            match_querystring=True, json={
+                'next': None,
+                'results': [{'id': 'registration-2', 'validated': True}],
+            })
+
+        response = self.client.get(
+            '{}?mother_id=1234&stage={}&validated=True'.format(
+                reverse('registrations-export'), settings.STAGES[0][0]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename="registrations.csv"')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines, [
+            'id,{},{},validated,source,created_at,updated_at'.format(
+                settings.IDENTITY_FIELD, settings.STAGE_FIELD),
+            'registration-1,,,True,,,',
+            'registration-2,,,True,,,',
+        ])
+
+    @responses.activate
+    def test_export_registrations_invalid_filter(self):
+        """
+        An invalid filter should export an empty list, like the list page.
+        """
+        self.login()
+        self.set_session_user_tokens()
+        response = self.client.get('{}{}'.format(
+            reverse('registrations-export'),
+            '?mother_id=&stage=invalid&validated='))
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(len(responses.calls), 0)
+
 
 class ChangesViewTest(ViewTestsTemplate):
     @override_settings(CHANGE_LIST_PAGE_SIZE=5)
@@ -937,6 +1597,43 @@ class SubscriptionsViewTest(ViewTestsTemplate):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(context['subscriptions']), 5)
 
+    @responses.activate
+    def test_export_subscriptions(self):
+        """
+        Exported subscriptions should have the messageset short names.
+        """
+        self.login()
+        self.set_session_user_tokens()
+        self.add_subscriptions_callback(num=2)
+        self.add_messagesets_callback([{'id': 1, 'short_name': 'ms.1'}])
+
+        response = self.client.get(reverse('subscriptions-export'))
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], (
+            'id,identity,messageset,next_sequence_number,lang,active,'
+            'completed,created_at,updated_at'))
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith('subscription-0,identity-0,ms.1,'))
+
+    @responses.activate
+    def test_messagesets_are_cached(self):
+        """
+        The messagesets should only be fetched from the stage based messaging
+        service once across requests.
+        """
+        self.login()
+        self.set_session_user_tokens()
+        self.add_subscriptions_callback(num=1)
+        self.add_messagesets_callback([{'id': 1, 'short_name': 'ms.1'}])
+
+        self.client.get(reverse('subscriptions'))
+        response = self.client.get(reverse('subscriptions'))
+
+        self.assertEqual(response.context['messagesets'], {1: 'ms.1'})
+        messageset_calls = [
+            c for c in responses.calls if '/messageset/' in c.request.url]
+        self.assertEqual(len(messageset_calls), 1)
+
     @override_settings(SUBSCRIPTION_LIST_PAGE_SIZE=5)
     @responses.activate
     def test_get_subscriptions_list_filter_error(self):
@@ -981,6 +1678,7 @@ class SubscriptionsViewTest(ViewTestsTemplate):
 class UserDetailViewTest(ViewTestsTemplate):
 
     def setUp(self):
+        super(UserDetailViewTest, self).setUp()
         self.login()
         self.set_session_user_tokens()
 
@@ -1018,3 +1716,134 @@ class UserDetailViewTest(ViewTestsTemplate):
                          "linked_to_identity")
         self.assertEqual(context['operator']['identity'],
                          "operator_id")
+
+    @responses.activate
+    def test_get_user_detail_linked_error(self):
+        """
+        If a linked identity can't be fetched, the page should still be shown
+        with an error message for it.
+        """
+        self.add_identity_callback(
+            'identity_id', {
+                'preferred_language': "zul_ZA",
+                'linked_to': "linked_to_identity",
+                'operator': "operator_id"
+            })
+        self.add_identity_callback('linked_to_identity', {})
+        responses.add(
+            responses.GET,
+            'http://idstore.example.com/identities/operator_id/', status=500)
+        self.add_messagesets_callback([{
+            'id': 1,
+            'short_name': 'ms.1',
+            'default_schedule': 2,
+        }])
+        self.add_registrations_callback(qs="?mother_id=identity_id")
+        self.add_subscriptions_callback(num=10, qs="?identity=identity_id")
+
+        response = self.client.get(reverse('user-management-detail',
+                                   kwargs={'identity': 'identity_id'}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['operator'], {})
+        self.assertEqual(
+            [str(message) for message in response.context['messages']],
+            ['Could not load the operator identity.'])
+
+    @responses.activate
+    def test_get_user_detail_section_error(self):
+        """
+        If the registrations, subscriptions or messagesets can't be fetched,
+        the page should still be shown with an error message for each.
+        """
+        self.add_identity_callback('identity_id', {})
+        responses.add(
+            responses.GET, 'http://sbm.example.com/messageset/', status=500)
+        responses.add(
+            responses.GET, 'http://hub.example.com/registrations/',
+            status=500)
+        self.add_subscriptions_callback(num=1, qs="?identity=identity_id")
+
+        response = self.client.get(reverse('user-management-detail',
+                                   kwargs={'identity': 'identity_id'}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['registrations'], {'results': []})
+        self.assertEqual(len(response.context['subscriptions']['results']), 1)
+        self.assertEqual(
+            [str(message) for message in response.context['messages']],
+            ['Could not load messagesets.', 'Could not load registrations.'])
+
+
+class BulkActionsViewTest(ViewTestsTemplate):
+    def test_create_job(self):
+        """
+        Uploading a file of actions should create a pending job with the
+        user's tokens, and redirect to its status page.
+        """
+        self.login()
+        self.set_session_user_tokens()
+        upload = SimpleUploadedFile(
+            'actions.csv',
+            b'Identity,Action,Language\nidentity-1,change,eng_ZA\n')
+        response = self.client.post(
+            reverse('bulk-actions'), {'actions_file': upload})
+
+        job = BulkActionJob.objects.get()
+        self.assertRedirects(
+            response, reverse('bulk-actions-detail', args=[job.pk]))
+        self.assertEqual(job.file_name, 'actions.csv')
+        self.assertEqual(job.created_by, 123)
+        self.assertEqual(job.total_rows, 1)
+        self.assertEqual(
+            json.loads(job.services)['HUB'],
+            {"url": 'http://hub.example.com/', "token": 'hubtoken'})
+
+        response = self.client.get(reverse('bulk-actions'))
+        self.assertEqual(list(response.context['jobs']), [job])
+
+    def test_create_job_invalid_file(self):
+        """
+        An invalid file should show the form's errors without creating a job.
+        """
+        self.login()
+        self.set_session_user_tokens()
+        upload = SimpleUploadedFile(
+            'actions.csv', b'Identity,Action\nidentity-1,delete\n')
+        response = self.client.post(
+            reverse('bulk-actions'), {'actions_file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors['actions_file'])
+        self.assertFalse(BulkActionJob.objects.exists())
+
+    def test_job_status(self):
+        """
+        The status page should show the job's failed rows, and the export
+        should include every row's result.
+        """
+        self.login()
+        job = BulkActionJob.objects.create(
+            file_name='actions.csv', created_by=123, total_rows=2,
+            processed_rows=2, failed_rows=1, status=BulkActionJob.FINISHED)
+        BulkActionRow.objects.create(
+            job=job, row_number=2, identity='identity-1',
+            action='deactivate', status=BulkActionRow.SUCCEEDED,
+            result='Deactivated subscription')
+        failed = BulkActionRow.objects.create(
+            job=job, row_number=3, identity='identity-2',
+            action='deactivate', status=BulkActionRow.FAILED,
+            result='No active subscriptions')
+
+        response = self.client.get(
+            reverse('bulk-actions-detail', args=[job.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['failed_rows']), [failed])
+
+        response = self.client.get(
+            reverse('bulk-actions-export', args=[job.pk]))
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines, [
+            'Row,Identity,Action,Status,Result',
+            '2,identity-1,deactivate,succeeded,Deactivated subscription',
+            '3,identity-2,deactivate,failed,No active subscriptions',
+        ])
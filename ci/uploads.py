@@ -0,0 +1,121 @@
+import codecs
+import csv
+
+from django.conf import settings
+from openpyxl import load_workbook
+
+
+class UploadError(ValueError):
+    """
+    Raised when the contents of an uploaded file are invalid.
+    """
+
+
+def iter_rows(upload):
+    """
+    Yields the rows of an uploaded CSV file or the first sheet of an uploaded
+    workbook as tuples of cell values. Workbooks are read in read-only mode,
+    so that only the current row is held in memory.
+
+    Raises UploadError if the file isn't a UTF-8 encoded CSV file or a
+    workbook.
+    """
+    if upload.name.lower().endswith('.csv'):
+        upload.seek(0)
+        # The file is decoded as it's read, so this can fail part way through
+        try:
+            for row in csv.reader(codecs.iterdecode(upload, 'utf-8-sig')):
+                yield tuple(value or None for value in row)
+        except UnicodeDecodeError:
+            raise UploadError('CSV files must be saved as UTF-8 CSV files')
+        except csv.Error as e:
+            raise UploadError('File is not a valid CSV file: %s' % e)
+        return
+
+    try:
+        wb = load_workbook(upload, read_only=True)
+    except Exception:
+        raise UploadError('File must be a CSV file or an Excel workbook')
+    try:
+        ws = wb[wb.sheetnames[0]]  # There should only be one sheet
+        for row in ws.rows:
+            yield tuple(cell.value for cell in row)
+    finally:
+        _close_workbook(wb)
+
+
+def _close_workbook(wb):
+    """
+    Closes the file that a read-only workbook reads its rows from.
+    """
+    if hasattr(wb, 'close'):
+        wb.close()
+    elif getattr(wb, '_archive', None) is not None:
+        # Versions of openpyxl before 2.4.2 have no close method
+        wb._archive.close()
+
+
+def find_column(header, name):
+    """
+    Returns the index of the column in the header row with the given name,
+    ignoring case, or None if there isn't one.
+    """
+    for i, value in enumerate(header):
+        if value is not None and str(value).strip().lower() == name.lower():
+            return i
+
+
+def iter_column(rows, name):
+    """
+    Yields the non-empty values of the named column from rows, the first of
+    which is the header row.
+    """
+    header = next(rows, ())
+    column = find_column(header, name)
+    if column is None:
+        raise UploadError(
+            "File must contain '%s' column in the first sheet" % name)
+    for row in rows:
+        if column < len(row) and row[column] is not None:
+            yield row[column]
+
+
+def normalise_msisdn(value):
+    """
+    Returns the MSISDN in value without any whitespace, or None if it isn't a
+    valid MSISDN. Numbers stored in a spreadsheet as numbers are accepted.
+    """
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    msisdn = ''.join(str(value).split())
+    if not msisdn.replace('+', '', 1).isdigit():
+        return None
+    return msisdn
+
+
+def iter_msisdns(upload, max_msisdns=None):
+    """
+    Yields the unique MSISDNs in the 'Phone number' column of an uploaded
+    file, normalised with `normalise_msisdn`, in the order that they first
+    appear.
+
+    Raises UploadError if the column is missing, a value isn't a valid
+    MSISDN, or there are more than `max_msisdns` (by default the
+    MSISDN_UPLOAD_LIMIT setting) unique MSISDNs, which bounds the memory used
+    to remove the duplicates.
+    """
+    if max_msisdns is None:
+        max_msisdns = settings.MSISDN_UPLOAD_LIMIT
+    seen = set()
+    for value in iter_column(iter_rows(upload), 'Phone number'):
+        msisdn = normalise_msisdn(value)
+        if msisdn is None:
+            raise UploadError(
+                "'Phone number' column must only contain valid phone numbers")
+        if msisdn in seen:
+            continue
+        if len(seen) >= max_msisdns:
+            raise UploadError(
+                'File must contain at most %s phone numbers' % max_msisdns)
+        seen.add(msisdn)
+        yield msisdn
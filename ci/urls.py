@@ -13,17 +13,31 @@ urlpatterns = [
     url(r'^dashboard/(?P<dashboard_id>\d+)/', views.dashboard,
         name='dashboard'),
     url('^api/v1/metric/$', views.dashboard_metric, name='dashboard_metric'),
+    url('^api/v1/metric/batch/$', views.dashboard_metrics_batch,
+        name='dashboard_metrics_batch'),
+    url(r'^api/v1/dashboard/(?P<dashboard_id>\d+)/stream/$',
+        views.dashboard_stream, name='dashboard_stream'),
     url('^identities/$', views.identities, name='identities'),
+    url('^identities/lookup/$', views.identity_lookup,
+        name='identity_lookup'),
     url(r'^identities/(?P<identity>[^/]+)/$', views.identity,
         name='identities-detail'),
+    url(r'^identities/(?P<identity>[^/]+)/sections/(?P<section>\w+)/$',
+        views.identity_section, name='identities-section'),
 
     url('^registrations/$', views.registrations, name='registrations'),
+    url('^registrations/export/$', views.registrations_export,
+        name='registrations-export'),
     url(r'^registrations/(?P<registration>[^/]+)/$', views.registration,
         name='registrations-detail'),
     url('^changes/$', views.changes, name='changes'),
+    url('^changes/export/$', views.changes_export,
+        name='changes-export'),
     url(r'^changes/(?P<change>[^/]+)/$', views.change,
         name='changes-detail'),
     url('^subscriptions/$', views.subscriptions, name='subscriptions'),
+    url('^subscriptions/export/$', views.subscriptions_export,
+        name='subscriptions-export'),
     url(
         '^failures/subscriptions/$',
         views.subscription_failures,
@@ -41,6 +55,11 @@ urlpatterns = [
     ),
     url(r'^subscriptions/(?P<subscription>[^/]+)/$', views.subscription,
         name='subscriptions-detail'),
+    url('^bulk-actions/$', views.bulk_actions, name='bulk-actions'),
+    url(r'^bulk-actions/(?P<job>\d+)/$', views.bulk_action,
+        name='bulk-actions-detail'),
+    url(r'^bulk-actions/(?P<job>\d+)/export/$', views.bulk_action_export,
+        name='bulk-actions-export'),
     url('^services/$', views.services, name='services'),
     url('^reports/$', views.report_generation, name='reports'),
     url(r'^services/(?P<service>[^/]+)/$', views.service,
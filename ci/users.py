@@ -0,0 +1,112 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import caching, clients
+
+
+def _user_data_key(user_id, version):
+    return 'ci:user:{}:{}'.format(user_id, version)
+
+
+def fetch_user_data(user_id):
+    """
+    Fetches the user's service tokens and dashboards from the control
+    interface service.
+    """
+    ci_api = clients.get_ci_client()
+    calls = {
+        'tokens': clients.fetch_all(
+            ci_api.get_user_service_tokens, params={"user_id": user_id}),
+    }
+    if not settings.HIDE_DASHBOARDS:
+        calls['dashboards'] = lambda: caching.get_user_dashboards(
+            ci_api, user_id)
+    results, errors = clients.fan_out(calls)
+    for error in errors.values():
+        raise error
+
+    data = {
+        "tokens": {},
+        "dashboards": [],
+        "default_dashboard": None,
+    }
+    # Format the user access tokens for easy access
+    for token in results['tokens']['results']:
+        data["tokens"][token["service"]["name"]] = {
+            "token": token["token"],
+            "url": token["service"]["url"] + "/api/v1"
+        }
+    if results.get('dashboards'):
+        data["dashboards"] = results['dashboards'][0]["dashboards"]
+        data["default_dashboard"] = \
+            results['dashboards'][0]["default_dashboard"]["id"]
+    return data
+
+
+def set_user_data(session, data):
+    """
+    Stores the data for the user in the session under a new version stamp.
+    """
+    session['user_version'] = uuid.uuid4().hex
+    cache.set(
+        _user_data_key(session['user_id'], session['user_version']), data,
+        settings.USER_DATA_CACHE_TTL)
+
+
+def get_user_data(request):
+    """
+    Returns the data for the logged in user: their service tokens and
+    dashboards. This is kept in the shared cache rather than in the session,
+    which only holds the user's id and a version stamp. If the data is no
+    longer in the cache, it is fetched again.
+    """
+    data = getattr(request, '_ci_user_data', None)
+    if data is not None:
+        return data
+
+    session = request.session
+    data = None
+    if 'user_version' in session:
+        data = cache.get(
+            _user_data_key(session['user_id'], session['user_version']))
+    if data is None:
+        data = fetch_user_data(session['user_id'])
+        set_user_data(session, data)
+    request._ci_user_data = data
+    return data
+
+
+def clear_user_data(session):
+    if 'user_id' in session and 'user_version' in session:
+        cache.delete(
+            _user_data_key(session['user_id'], session['user_version']))
+
+
+def get_user_tokens(request):
+    return get_user_data(request)["tokens"]
+
+
+def get_user_dashboards(request):
+    return get_user_data(request)["dashboards"]
+
+
+def get_user_default_dashboard(request):
+    return get_user_data(request)["default_dashboard"]
+
+
+def get_service_client(request, service):
+    """
+    Returns the shared client for the given service, authenticated with the
+    logged in user's token for it.
+    """
+    return clients.get_token_client(service, get_user_tokens(request)[service])
+
+
+def get_user_directory(request):
+    """
+    Returns a dict of user id (as a string): email address, for looking up
+    users by id.
+    """
+    return caching.get_user_directory(clients.get_auth_client(request))
@@ -1,20 +1,36 @@
-import time
+import calendar
+import csv
+import hashlib
+import json
+import logging
+import uuid
+from bisect import bisect_left
 from itertools import islice
+from operator import itemgetter
 from datetime import timedelta
 
+from django.conf import settings
+from django.core.cache import cache
 from django.core.paginator import EmptyPage, Page, PageNotAnInteger
 from django.utils import timezone
-from six.moves.urllib.parse import urlparse, parse_qs
+from six.moves.urllib.parse import urlparse, parse_qs, urlencode
 from six import string_types
 
 import attr
 
+from .clients import get_executor
+
+logger = logging.getLogger(__name__)
+
 
 def transform_timeseries_data(timeseries, start, end=None):
     """Transforms a Go Metrics API metric result into a list of
     values for a given window period.
 
-    start and end are expected to be Unix timestamps in microseconds.
+    start and end are expected to be Unix timestamps in milliseconds.
+
+    The health pages use `Timeseries` instead, this is kept as the baseline
+    that the benchmark_timeseries command compares it against.
     """
     data = []
     include = False
@@ -39,8 +55,10 @@ def get_last_value_from_timeseries(timeseries):
 
 
 def get_timestamp(dt):
-    """Returns a Unix timestamp in microseconds for a given datetime."""
-    return time.mktime(dt.timetuple()) * 1000
+    """Returns a Unix timestamp in milliseconds for a given datetime, which
+    is taken to be in UTC if it is naive. This doesn't depend on the server's
+    timezone."""
+    return calendar.timegm(dt.utctimetuple()) * 1000
 
 
 @attr.s
@@ -85,26 +103,181 @@ class DTBoundry(object):
 
 def right_pad_list(lst, length, value):
     """Returns a copy of the lst padded to the length specified with the
-    given value.
+    given value. Used with `transform_timeseries_data`.
     """
     return lst + [value] * (length - len(lst))
 
 
-def get_ranged_data_from_timeseries(timeseries, dt, range_type='week'):
-    if range_type == 'week':
-        get_boundry = DTBoundry.week_from_datetime
-        padding = 7
-    elif range_type == 'day':
-        get_boundry = DTBoundry.day_from_datetime
-        padding = 24
-    else:
+@attr.s
+class Timeseries(object):
+    """A single metric's data points from a Go Metrics API result, as lists of
+    timestamps and values sorted by timestamp, so that the points in a window
+    can be found by bisection instead of scanning the whole series.
+    """
+    xs = attr.ib()
+    ys = attr.ib()
+
+    @classmethod
+    def from_metrics(cls, timeseries):
+        """Returns a Timeseries for the first metric in the result."""
+        points = next(iter(timeseries.values()), [])
+        points = sorted(points, key=itemgetter('x'))
+        return cls(xs=[p['x'] for p in points], ys=[p['y'] for p in points])
+
+    def window(self, start, end, interval):
+        """Returns the values of the interval long buckets from start to end
+        inclusive. Points are placed in the nearest bucket, so timestamps that
+        are slightly off still line up, and buckets without a point are zero.
+
+        start, end and interval are expected to be in milliseconds.
+        """
+        values = [0] * (int(round((end - start) / interval)) + 1)
+        first = bisect_left(self.xs, start - interval / 2)
+        last = bisect_left(self.xs, end + interval / 2)
+        for i in range(first, last):
+            values[int(round((self.xs[i] - start) / interval))] = self.ys[i]
+        return values
+
+    def windows(self, ranges, interval):
+        """Returns the values for each of the (start, end) ranges, as for
+        `window`."""
+        return [self.window(start, end, interval) for start, end in ranges]
+
+
+RANGE_TYPES = {
+    'week': (DTBoundry.week_from_datetime, 24 * 60 * 60 * 1000),
+    'day': (DTBoundry.day_from_datetime, 60 * 60 * 1000),
+}
+
+
+def get_ranged_windows_from_timeseries(timeseries, dts, range_type='week'):
+    """Returns the daily values for the weeks, or hourly values for the days,
+    containing each of the given datetimes. The timeseries is only sorted
+    once, however many windows are needed.
+    """
+    try:
+        get_boundry, interval = RANGE_TYPES[range_type]
+    except KeyError:
         raise ValueError('Invalid value for range_type')
 
-    boundries = get_boundry(dt)
-    start = get_timestamp(boundries.start)
-    end = get_timestamp(boundries.end)
-    sent_data = transform_timeseries_data(timeseries, start, end)
-    return right_pad_list(sent_data, length=padding, value=0)
+    ranges = []
+    for dt in dts:
+        boundries = get_boundry(dt)
+        ranges.append(
+            (get_timestamp(boundries.start), get_timestamp(boundries.end)))
+    return Timeseries.from_metrics(timeseries).windows(ranges, interval)
+
+
+def get_ranged_data_from_timeseries(timeseries, dt, range_type='week'):
+    return get_ranged_windows_from_timeseries(
+        timeseries, [dt], range_type=range_type)[0]
+
+
+def parse_max_points(value):
+    """Returns the number of points to downsample a series to, from the given
+    request parameter, or None if it isn't a usable number. Anything below
+    3 is treated as 3, since the first and last points are always kept.
+    """
+    try:
+        return max(int(value), 3)
+    except (TypeError, ValueError):
+        return None
+
+
+def downsample_series(points, max_points):
+    """Downsamples a list of Go Metrics API points to max_points, using the
+    Largest-Triangle-Three-Buckets algorithm, which keeps the points that
+    contribute most to the shape of the series. The first and last points
+    are always kept. Returns the points unchanged if max_points is None or
+    there are already few enough of them.
+    """
+    n = len(points)
+    if max_points is None or n <= max_points:
+        return points
+
+    def y(point):
+        return point['y'] or 0
+
+    sampled = [points[0]]
+    every = (n - 2) / (max_points - 2)
+    a = 0
+    for i in range(max_points - 2):
+        # The average of the next bucket is the third point of the triangle
+        next_points = points[int((i + 1) * every) + 1:
+                             min(int((i + 2) * every) + 1, n)]
+        avg_x = sum(p['x'] for p in next_points) / len(next_points)
+        avg_y = sum(y(p) for p in next_points) / len(next_points)
+
+        ax, ay = points[a]['x'], y(points[a])
+        max_area = -1
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs(
+                (ax - avg_x) * (y(points[j]) - ay) -
+                (ax - points[j]['x']) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                next_a = j
+        sampled.append(points[next_a])
+        a = next_a
+    sampled.append(points[-1])
+    return sampled
+
+
+REDUCTIONS = {
+    'last': lambda ys: ys[-1],
+    'sum': sum,
+    'max': max,
+    'min': min,
+    'avg': lambda ys: sum(ys) / len(ys),
+}
+
+
+def reduce_series(points, reduction):
+    """Reduces a list of Go Metrics API points to a single value using one of
+    the REDUCTIONS, ignoring null values. Returns None for a series without
+    any values.
+    """
+    ys = [p['y'] for p in points if p['y'] is not None]
+    if not ys:
+        return None
+    return REDUCTIONS[reduction](ys)
+
+
+def get_series_object(key, points, max_points=None, reduction=None):
+    """Returns the response object for a metric's series, either reduced to
+    `{"key": ..., "value": ...}` if a reduction is given, or otherwise
+    `{"key": ..., "values": [...]}` downsampled to max_points.
+    """
+    if reduction is not None:
+        return {"key": key, "value": reduce_series(points, reduction)}
+    return {"key": key, "values": downsample_series(points, max_points)}
+
+
+def to_columnar_series(series):
+    """Returns a `{"key": ..., "values": [{"x": ..., "y": ...}]}` series in
+    the columnar form `{"key": ..., "x": [...], "y": [...]}`, which doesn't
+    repeat the point keys. Each x is the difference from the previous one,
+    with the first being the difference from zero, which keeps the numbers
+    short for evenly spaced timestamps. Reduced series are left alone.
+    """
+    if "values" not in series:
+        return series
+    xs = [p['x'] for p in series['values']]
+    return {
+        "key": series["key"],
+        "x": [x - previous for x, previous in zip(xs, [0] + xs)],
+        "y": [p['y'] for p in series['values']],
+    }
+
+
+def to_columnar_widgets(widgets):
+    """Converts the series of each widget in a dict of widget id:
+    `{"objects": [...]}` to the columnar form, leaving any errors alone."""
+    return dict(
+        (widget_id, dict(
+            widget, objects=[to_columnar_series(o) for o in widget["objects"]])
+         if "objects" in widget else widget)
+        for widget_id, widget in widgets.items())
 
 
 def extract_query_params(url):
@@ -183,3 +356,279 @@ def get_page_of_iterator(iterator, page_size, page_number):
     items = items[:page_size]
 
     return NoCountPage(items, page_number, page_size, has_next)
+
+
+def _get_pagination_generation_key(session, path):
+    return 'ci:pagination:generation:{}:{}'.format(session.url, path)
+
+
+def _get_pagination_key(session, path, params, user):
+    generation = cache.get_or_set(
+        _get_pagination_generation_key(session, path), uuid.uuid4().hex,
+        None)
+    digest = hashlib.sha1(json.dumps(
+        [user, session.url, path, sorted(params.items())], default=str
+    ).encode('utf-8')).hexdigest()
+    return 'ci:pagination:{}:{}'.format(generation, digest)
+
+
+def invalidate_upstream_pages(session, path):
+    """
+    Forgets the cached pages and cursors of a paginated upstream API, for
+    every user and set of params, after it has been changed.
+    """
+    cache.set(
+        _get_pagination_generation_key(session, path), uuid.uuid4().hex,
+        None)
+
+
+def _fetch_range(session, path, params, start, stop, cursors):
+    """
+    Returns the items from start to stop of a paginated upstream API,
+    starting at the closest known upstream page before start. The offsets
+    and URLs of any upstream pages found along the way are added to cursors.
+    """
+    # The first upstream page, at offset 0, isn't stored as a cursor
+    offset = max([o for o in cursors if o <= start] or [0])
+    if offset:
+        url, query = cursors[offset], {}
+    else:
+        url, query = path, params
+
+    items = []
+    while url is not None and offset < stop:
+        data = session.get(url, params=query)
+        results = data.get('results', [])
+        items.extend(
+            results[max(start - offset, 0):max(stop - offset, 0)])
+        offset += len(results)
+        url = data.get('next')
+        if url is not None:
+            # We remove part of the url that the session already has
+            url = url.replace(session.url, '')
+            cursors[offset] = url
+        # params are included in the next url
+        query = {}
+        if not results:
+            break
+    return items
+
+
+def _fetch_page(session, path, params, page_size, page_number, key):
+    """
+    Returns a page worth of items, plus one to see if there's another page.
+    """
+    items = cache.get('{}:page:{}:{}'.format(key, page_size, page_number))
+    if items is not None:
+        return items
+
+    cursors = cache.get('{}:cursors'.format(key)) or {}
+    start = (page_number - 1) * page_size
+    items = _fetch_range(
+        session, path, params, start, start + page_size + 1, cursors)
+    # Merge with any cursors that were stored while we were fetching
+    cursors.update(cache.get('{}:cursors'.format(key)) or {})
+    cache.set(
+        '{}:cursors'.format(key), cursors,
+        settings.PAGINATION_CURSOR_CACHE_TTL)
+    return items
+
+
+def _prefetch_page(session, path, params, page_size, page_number, key):
+    try:
+        items = _fetch_page(
+            session, path, params, page_size, page_number, key)
+    except Exception:
+        logger.exception('Prefetching page %s of %s failed', page_number, path)
+        return
+    cache.set(
+        '{}:page:{}:{}'.format(key, page_size, page_number), items,
+        settings.PAGINATION_PREFETCH_TTL)
+
+
+def get_page_of_upstream(session, path, params, page_size, page_number,
+                         user=None, prefetch=None):
+    """
+    Get a page of a paginated upstream API, handling invalid input from the
+    page number by defaulting to the first page.
+
+    Rather than iterating through all of the preceding pages, the upstream
+    next links that have been seen for this user and set of params are
+    remembered, so that the fetching can start from the closest one.
+    If prefetch is true (the default is the PAGINATION_PREFETCH setting), the
+    following page is fetched in the background.
+    """
+    try:
+        page_number = validate_page_number(page_number)
+    except (PageNotAnInteger, EmptyPage):
+        page_number = 1
+
+    key = _get_pagination_key(session, path, params, user)
+    items = _fetch_page(session, path, params, page_size, page_number, key)
+    if len(items) == 0 and page_number != 1:
+        page_number = 1
+        items = _fetch_page(session, path, params, page_size, 1, key)
+
+    has_next = len(items) > page_size
+    items = items[:page_size]
+
+    if prefetch is None:
+        prefetch = settings.PAGINATION_PREFETCH
+    if prefetch and has_next:
+        get_executor('prefetch').submit(
+            _prefetch_page, session, path, params, page_size,
+            page_number + 1, key)
+
+    return NoCountPage(items, page_number, page_size, has_next)
+
+
+class UpstreamPage(Page):
+    """
+    A page of results fetched directly from a paginated upstream API.
+
+    The "page numbers" of the next and previous pages are tokens containing
+    the query parameters of the upstream API's next and previous links, so
+    that they can be passed back to `get_upstream_page` as is.
+    """
+    def __init__(self, object_list, next_token=None, previous_token=None):
+        self.object_list = object_list
+        self.next_token = next_token
+        self.previous_token = previous_token
+
+    def __repr__(self):
+        return '<UpstreamPage>'
+
+    def has_next(self):
+        return self.next_token is not None
+
+    def has_previous(self):
+        return self.previous_token is not None
+
+    def next_page_number(self):
+        return self.next_token
+
+    def previous_page_number(self):
+        return self.previous_token
+
+    def start_index(self):
+        raise NotImplementedError
+
+    def end_index(self):
+        raise NotImplementedError
+
+
+# The upstream query parameters that select a page, which are the only ones
+# that can be set by a page token
+PAGE_TOKEN_PARAMS = ('cursor', 'offset', 'page')
+
+
+class InvalidPageToken(ValueError):
+    """
+    Raised for a page token that doesn't select an upstream page, such as the
+    page numbers that the message lists used to be paginated with.
+    """
+
+
+def _get_page_token(url, params):
+    """
+    Returns the parameters of the given upstream pagination link that select
+    its page as a page token.
+    """
+    if url is None:
+        return None
+    query = extract_query_params(url)
+    return urlencode(sorted(
+        (key, value) for key, values in query.items()
+        if key in PAGE_TOKEN_PARAMS and key not in params
+        for value in values))
+
+
+def parse_page_token(page_token):
+    """
+    Returns the upstream query parameters from a page token, ignoring any
+    that don't select a page. Raises InvalidPageToken if it doesn't contain
+    any that do.
+    """
+    if not page_token:
+        return {}
+    query = dict(
+        (key, values) for key, values in parse_qs(page_token).items()
+        if key in PAGE_TOKEN_PARAMS)
+    if not query:
+        raise InvalidPageToken('Invalid page token: %r' % page_token)
+    return query
+
+
+def get_upstream_page(session, path, params, page_size, page_token=None,
+                      page_size_param='page_size'):
+    """
+    Fetches a single page of results from a paginated upstream API, instead
+    of iterating over all of the pages to get to the one that is needed.
+
+    page_token is the next or previous page number of a page returned from
+    here, or None for the first page. The upstream API is asked for
+    page_size results per page. Raises InvalidPageToken for a page token that
+    wasn't returned from here.
+    """
+    query = {page_size_param: page_size}
+    query.update(parse_page_token(page_token))
+    query.update(params)
+
+    data = session.get(path, params=query)
+    return UpstreamPage(
+        data.get('results', []),
+        next_token=_get_page_token(data.get('next'), params),
+        previous_token=_get_page_token(data.get('previous'), params))
+
+
+def iter_upstream(session, path, params):
+    """
+    Yields every item of a paginated upstream API, without holding more than
+    two pages in memory. The next page is fetched in the background, on the
+    'export' executor, while the items of the current one are being consumed.
+    """
+    executor = get_executor('export')
+    future = executor.submit(session.get, path, params=params)
+    while future is not None:
+        data = future.result()
+        url = data.get('next')
+        future = None
+        if url is not None and data.get('results'):
+            # We remove part of the url that the session already has, and
+            # the params are included in the next url
+            future = executor.submit(
+                session.get, url.replace(session.url, ''))
+        for item in data.get('results', []):
+            yield item
+
+
+class _EchoBuffer(object):
+    """
+    A file-like object that returns what is written to it, so that
+    `csv.writer` can be used to format rows one at a time.
+    """
+    def write(self, value):
+        return value
+
+
+# The last line of a CSV export whose rows couldn't all be fetched
+EXPORT_INCOMPLETE = '# export incomplete: upstream error'
+
+
+def stream_csv(header, rows):
+    """
+    Yields the header and each of the rows formatted as CSV lines, for use as
+    the content of a `StreamingHttpResponse`.
+
+    The response has already been sent by the time the rows are fetched, so
+    if fetching them fails the error is logged and an `EXPORT_INCOMPLETE`
+    line is added, so that the file can't be mistaken for a full export.
+    """
+    writer = csv.writer(_EchoBuffer())
+    yield writer.writerow(header)
+    try:
+        for row in rows:
+            yield writer.writerow(row)
+    except Exception:
+        logger.exception('CSV export failed')
+        yield writer.writerow([EXPORT_INCOMPLETE])
@@ -1,20 +1,19 @@
-from functools import wraps
+from functools import partial, wraps
 import logging
 import json
-from datetime import timedelta
 
 from demands import HTTPServiceError
 from django.shortcuts import render, redirect, resolve_url
+from django.utils.cache import patch_vary_headers
 from django.utils.decorators import available_attrs
 from django.utils.six.moves.urllib.parse import urlparse
 from django.contrib.auth import REDIRECT_FIELD_NAME
 from django.contrib.sites.shortcuts import get_current_site
 from django.contrib import messages
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.urls import reverse
 from django.utils.http import is_safe_url
-from django.utils.timezone import now
-from django.http import HttpResponseRedirect, JsonResponse
+from django.http import (
+    Http404, HttpResponseRedirect, JsonResponse, StreamingHttpResponse)
 from django.template.defaulttags import register
 from django.template.response import TemplateResponse
 from django.template.context_processors import csrf
@@ -22,16 +21,6 @@ from django.conf import settings
 from django import forms
 import dateutil.parser
 
-from seed_services_client import (
-    ControlInterfaceApiClient,
-    HubApiClient,
-    IdentityStoreApiClient,
-    MessageSenderApiClient,
-    SchedulerApiClient,
-    StageBasedMessagingApiClient,
-)
-from seed_services_client.metrics import MetricsApiClient
-
 from urlobject import URLObject
 
 from .forms import (AuthenticationForm, IdentitySearchForm,
@@ -39,8 +28,11 @@ from .forms import (AuthenticationForm, IdentitySearchForm,
                     ChangeFilterForm, ReportGenerationForm,
                     AddSubscriptionForm, DeactivateSubscriptionForm,
                     ChangeSubscriptionForm, MsisdnReportGenerationForm,
-                    UserDetailSearchForm)
-from . import utils
+                    UserDetailSearchForm, IdentityLookupForm,
+                    BulkActionForm)
+from . import (auditlog, bulkactions, caching, clients, dashboards, health,
+               uploads, users, utils)
+from .models import BulkActionJob, BulkActionRow
 
 logger = logging.getLogger(__name__)
 
@@ -73,12 +65,6 @@ def replace_query_param(url, parameter, value):
     return url.set_query_params([(parameter, value)])
 
 
-ciApi = ControlInterfaceApiClient(
-    api_url=settings.CONTROL_INTERFACE_SERVICE_URL,
-    auth_token=settings.CONTROL_INTERFACE_SERVICE_TOKEN
-)
-
-
 def request_passes_test(test_func, login_url=None,
                         redirect_field_name=REDIRECT_FIELD_NAME):
     """
@@ -158,13 +144,98 @@ def tokens_required(service_list):
         @wraps(func)
         def inner(request, *args, **kwargs):
             for service in service_list:
-                if service not in request.session["user_tokens"]:
+                if service not in users.get_user_tokens(request):
                     return redirect('denied')
             return func(request, *args, **kwargs)
         return inner
     return decorator
 
 
+def render_list(request, name, context):
+    """
+    Renders the list page `ci/<name>.html`, or only its results table
+    `ci/includes/<name>_results.html` for the in-page requests that the page
+    makes when it is filtered or paginated.
+
+    The results table is marked with an `X-List-Results` header, so that the
+    page can tell it apart from another page that the request was redirected
+    to, like the login page when the session has expired.
+    """
+    if request.is_ajax():
+        template_name = 'ci/includes/{}_results.html'.format(name)
+    else:
+        template_name = 'ci/{}.html'.format(name)
+    response = render(request, template_name, context)
+    if request.is_ajax():
+        response['X-List-Results'] = '1'
+    # The two responses have the same URL
+    patch_vary_headers(response, ('X-Requested-With',))
+    return response
+
+
+def get_registration_filter(request):
+    """
+    Returns the registration filter form for the request, and the filter to
+    apply to the hub's registrations, or None if the form isn't valid.
+    """
+    if 'mother_id' not in request.GET:
+        return RegistrationFilterForm(), {}
+    form = RegistrationFilterForm(request.GET)
+    if not form.is_valid():
+        return form, None
+    return form, {
+        settings.STAGE_FIELD: form.cleaned_data['stage'],
+        "validated": form.cleaned_data['validated'],
+        settings.IDENTITY_FIELD: form.cleaned_data['mother_id']
+    }
+
+
+def get_change_filter(request):
+    """
+    Returns the change filter form for the request, and the filter to apply
+    to the hub's changes, or None if the form isn't valid.
+    """
+    if 'mother_id' not in request.GET:
+        return ChangeFilterForm(), {}
+    form = ChangeFilterForm(request.GET)
+    if not form.is_valid():
+        return form, None
+    return form, {
+        "action": form.cleaned_data['action'],
+        "validated": form.cleaned_data['validated'],
+        settings.IDENTITY_FIELD: form.cleaned_data['mother_id']
+    }
+
+
+def get_subscription_filter(request):
+    """
+    Returns the subscription filter form for the request, and the filter to
+    apply to the subscriptions, or None if the form isn't valid.
+    """
+    if 'identity' not in request.GET:
+        return SubscriptionFilterForm(), {}
+    form = SubscriptionFilterForm(request.GET)
+    if not form.is_valid():
+        return form, None
+    return form, {
+        "identity": form.cleaned_data['identity'],
+        "active": form.cleaned_data['active'],
+        "completed": form.cleaned_data['completed']
+    }
+
+
+def csv_export(name, header, rows):
+    """
+    Returns a response that streams the rows to the browser as a CSV file
+    download, as they are fetched.
+    """
+    response = StreamingHttpResponse(
+        utils.stream_csv(header, rows), content_type='text/csv')
+    response['Content-Disposition'] = (
+        'attachment; filename="{}.csv"'.format(name))
+    return response
+
+
 def login(request, template_name='ci/login.html',
           redirect_field_name=REDIRECT_FIELD_NAME,
           authentication_form=AuthenticationForm):
@@ -189,33 +260,10 @@ def login(request, template_name='ci/login.html',
             request.session['user_email'] = user["email"]
             request.session['user_permissions'] = user["permissions"]
             request.session['user_id'] = user["id"]
-            request.session['user_list'] = user["user_list"]
-
-            if not settings.HIDE_DASHBOARDS:
-                # Set user dashboards because they are slow to change
-                dashboards = ciApi.get_user_dashboards(user["id"])
-                dashboard_list = list(dashboards['results'])
-                if len(dashboard_list) > 0:
-                    request.session['user_dashboards'] = \
-                        dashboard_list[0]["dashboards"]
-                    request.session['user_default_dashboard'] = \
-                        dashboard_list[0]["default_dashboard"]["id"]
-                else:
-                    request.session['user_dashboards'] = []
-                    request.session['user_default_dashboard'] = None
-
-            # Get the user access tokens too and format for easy access
-            tokens = ciApi.get_user_service_tokens(
-                params={"user_id": user["id"]})
-            token_list = list(tokens['results'])
-            user_tokens = {}
-            if len(token_list) > 0:
-                for token in token_list:
-                    user_tokens[token["service"]["name"]] = {
-                        "token": token["token"],
-                        "url": token["service"]["url"] + "/api/v1"
-                    }
-            request.session['user_tokens'] = user_tokens
+            # The user's tokens and dashboards are kept in the shared cache,
+            # to keep the session small
+            users.set_user_data(
+                request.session, users.fetch_user_data(user["id"]))
 
             return HttpResponseRedirect(redirect_to)
     else:
@@ -234,13 +282,13 @@ def login(request, template_name='ci/login.html',
 
 
 def logout(request):
+    users.clear_user_data(request.session)
     try:
         del request.session['user_token']
         del request.session['user_email']
         del request.session['user_permissions']
         del request.session['user_id']
-        del request.session['user_dashboards']
-        del request.session['user_default_dashboard']
+        del request.session['user_version']
     except KeyError:
         pass
     return redirect('index')
@@ -249,11 +297,10 @@ def logout(request):
 @login_required(login_url='/login/')
 @permission_required(permission='ci:view', login_url='/login/')
 def index(request):
-    if "user_default_dashboard" in request.session and \
-            request.session["user_default_dashboard"] is not None and \
-            not settings.HIDE_DASHBOARDS:
+    if not settings.HIDE_DASHBOARDS and \
+            users.get_user_default_dashboard(request) is not None:
         return HttpResponseRedirect(reverse('dashboard', args=(
-            request.session["user_default_dashboard"],)))
+            users.get_user_default_dashboard(request),)))
     else:
         return render(request, 'ci/index.html')
 
@@ -264,60 +311,10 @@ def health_messages(request):
     if settings.HIDE_HEALTH:
         return redirect('denied')
     if request.is_ajax():
-        METRIC_SENT_SUM = 'message.sent.sum'
-        client = MetricsApiClient(
-            settings.METRIC_API_URL,
-            auth=(settings.METRIC_API_USER, settings.METRIC_API_PASSWORD))
-        chart_type = request.GET.get('chart_type', None)
-        today = now()
-        if chart_type == 'estimated-vs-sent':
-            get_days = today.weekday() + 1
-            sent = client.get_metrics(
-                m=METRIC_SENT_SUM, from_='-%sd' % get_days, interval='1d',
-                nulls='zeroize')
-            sent_data = utils.get_ranged_data_from_timeseries(
-                sent, today, range_type='week')
-
-            # The estimate data is stored as .last metrics with 0 - 6
-            # representing the days of the week. The cron format specifies
-            # 0 = Sunday whereas Python datetime.weekday() specifies
-            # 0 = Monday.
-            estimate_data = []
-            for day in range(7):
-                estimated = client.get_metrics(
-                    m='subscriptions.send.estimate.%s.last' % day, from_='-7d',
-                    interval='1d', nulls='zeroize')
-                estimate_data.append(
-                    utils.get_last_value_from_timeseries(estimated))
-            return JsonResponse({
-                'Estimated': estimate_data,
-                'Sent': sent_data
-            })
-
-        elif chart_type == 'sent-today':
-            get_hours = today.hour
-            sent = client.get_metrics(
-                m=METRIC_SENT_SUM, from_='-%sh' % get_hours, interval='1h',
-                nulls='zeroize')
-            sent_data = utils.get_ranged_data_from_timeseries(
-                sent, today, range_type='day')
-            return JsonResponse({
-                'Today': sent_data
-            })
-
-        elif chart_type == 'sent-this-week':
-            get_days = today.weekday() + 7  # Include last week in the set.
-            sent = client.get_metrics(
-                m=METRIC_SENT_SUM, from_='-%sd' % get_days, interval='1d',
-                nulls='zeroize')
-            this_week_data = utils.get_ranged_data_from_timeseries(
-                sent, today, range_type='week')
-            last_week_data = utils.get_ranged_data_from_timeseries(
-                sent, today-timedelta(weeks=1), range_type='week')
-            return JsonResponse({
-                'Last week': last_week_data,
-                'This week': this_week_data
-            })
+        payload = health.get_chart(
+            'messages', request.GET.get('chart_type', None))
+        if payload is not None:
+            return JsonResponse(payload)
 
     return render(request, 'ci/health_messages.html')
 
@@ -328,39 +325,10 @@ def health_subscriptions(request):
     if settings.HIDE_HEALTH:
         return redirect('denied')
     if request.is_ajax():
-        METRIC_SUBSCRIPTIONS_SUM = 'subscriptions.created.sum'
-        client = MetricsApiClient(
-            settings.METRIC_API_URL,
-            auth=(settings.METRIC_API_USER, settings.METRIC_API_PASSWORD))
-        chart_type = request.GET.get('chart_type', None)
-        today = now()
-        if chart_type == 'subscriptions-today':
-            get_hours = today.hour + 24  # Include yesterday in the set.
-            subscriptions = client.get_metrics(
-                m=METRIC_SUBSCRIPTIONS_SUM, from_='-%sh' % get_hours,
-                interval='1h', nulls='zeroize')
-            today_data = utils.get_ranged_data_from_timeseries(
-                subscriptions, today, range_type='day')
-            yesterday_data = utils.get_ranged_data_from_timeseries(
-                subscriptions, today - timedelta(days=1), range_type='day')
-            return JsonResponse({
-                'Yesterday': yesterday_data,
-                'Today': today_data
-            })
-
-        elif chart_type == 'subscriptions-this-week':
-            get_days = today.weekday() + 7  # Include last week in the set.
-            subscriptions = client.get_metrics(
-                m=METRIC_SUBSCRIPTIONS_SUM, from_='-%sd' % get_days,
-                interval='1d', nulls='zeroize')
-            this_week_data = utils.get_ranged_data_from_timeseries(
-                subscriptions, today, range_type='week')
-            last_week_data = utils.get_ranged_data_from_timeseries(
-                subscriptions, today-timedelta(weeks=1), range_type='week')
-            return JsonResponse({
-                'Last week': last_week_data,
-                'This week': this_week_data
-            })
+        payload = health.get_chart(
+            'subscriptions', request.GET.get('chart_type', None))
+        if payload is not None:
+            return JsonResponse(payload)
 
     return render(request, 'ci/health_subscriptions.html')
 
@@ -371,39 +339,10 @@ def health_registrations(request):
     if settings.HIDE_HEALTH:
         return redirect('denied')
     if request.is_ajax():
-        METRIC_REGISTRATIONS_SUM = 'registrations.created.sum'
-        client = MetricsApiClient(
-            settings.METRIC_API_URL,
-            auth=(settings.METRIC_API_USER, settings.METRIC_API_PASSWORD))
-        chart_type = request.GET.get('chart_type', None)
-        today = now()
-        if chart_type == 'registrations-today':
-            get_hours = today.hour + 24  # Include yesterday in the set.
-            registrations = client.get_metrics(
-                m=METRIC_REGISTRATIONS_SUM, from_='-%sh' % get_hours,
-                interval='1h', nulls='zeroize')
-            today_data = utils.get_ranged_data_from_timeseries(
-                registrations, today, range_type='day')
-            yesterday_data = utils.get_ranged_data_from_timeseries(
-                registrations, today - timedelta(days=1), range_type='day')
-            return JsonResponse({
-                'Yesterday': yesterday_data,
-                'Today': today_data
-            })
-
-        elif chart_type == 'registrations-this-week':
-            get_days = today.weekday() + 7  # Include last week in the set.
-            registrations = client.get_metrics(
-                m=METRIC_REGISTRATIONS_SUM, from_='-%sd' % get_days,
-                interval='1d', nulls='zeroize')
-            this_week_data = utils.get_ranged_data_from_timeseries(
-                registrations, today, range_type='week')
-            last_week_data = utils.get_ranged_data_from_timeseries(
-                registrations, today-timedelta(weeks=1), range_type='week')
-            return JsonResponse({
-                'Last week': last_week_data,
-                'This week': this_week_data
-            })
+        payload = health.get_chart(
+            'registrations', request.GET.get('chart_type', None))
+        if payload is not None:
+            return JsonResponse(payload)
 
     return render(request, 'ci/health_registrations.html')
 
@@ -413,8 +352,13 @@ def health_registrations(request):
 def dashboard(request, dashboard_id):
     if settings.HIDE_DASHBOARDS:
         return redirect('denied')
-    dashboard = ciApi.get_dashboard(int(dashboard_id))
-    context = {"dashboard": dashboard}
+    dashboard = caching.get_dashboard(
+        clients.get_ci_client(), int(dashboard_id))
+    context = {
+        "dashboard": dashboard,
+        "dashboard_id": dashboard_id,
+        "dashboard_streaming": settings.DASHBOARD_STREAMING,
+    }
     return render(request, 'ci/dashboard.html', context)
 
 
@@ -423,9 +367,7 @@ def dashboard(request, dashboard_id):
 def dashboard_metric(request):
     if settings.HIDE_DASHBOARDS:
         return redirect('denied')
-    client = MetricsApiClient(
-        settings.METRIC_API_URL,
-        auth=(settings.METRIC_API_USER, settings.METRIC_API_PASSWORD))
+    client = clients.get_metrics_client()
     response = {"objects": []}
     filters = {
         "m": [],
@@ -440,18 +382,100 @@ def dashboard_metric(request):
     if filters.get('from') is not None:
         filters['from'] = filters['start']
 
-    results = client.get_metrics(**filters)
-    for metric in filters['m']:
-        if metric in results:
-            response["objects"].append({
-                "key": metric, "values": results[metric]})
-        else:
-            response["objects"].append({
-                "key": metric, "values": []})
+    # Not Metrics API parameters, these are handled here
+    max_points = utils.parse_max_points(
+        filters.pop('max_points', [None])[0])
+    columnar = filters.pop('format', [None])[0] == 'columnar'
+    reduction = filters.pop('reduce', [None])[0]
+    if reduction is not None and reduction not in utils.REDUCTIONS:
+        return JsonResponse({"error": "Invalid reduce"}, status=400)
 
+    results = caching.get_metrics(client, filters)
+    for metric in filters['m']:
+        response["objects"].append(utils.get_series_object(
+            metric, results.get(metric, []), max_points, reduction))
+
+    if columnar:
+        response["objects"] = [
+            utils.to_columnar_series(o) for o in response["objects"]]
+        return JsonResponse(response, json_dumps_params={
+            'separators': dashboards.COMPACT_SEPARATORS})
     return JsonResponse(response)
 
 
+@login_required(login_url='/login/')
+@permission_required(permission='ci:view', login_url='/login/')
+def dashboard_metrics_batch(request):
+    """
+    Returns the metric values for several dashboard widgets at once. The
+    request body is JSON of the form
+    `{"widgets": [{"id": ..., "m": [...], "start": ..., "interval": ...,
+    "nulls": ..., "max_points": ..., "tail": ..., "reduce": ...}],
+    "format": ...}`, where
+    format may be `columnar` for the series to be returned in the columnar
+    form.
+    """
+    if settings.HIDE_DASHBOARDS:
+        return redirect('denied')
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST is allowed"}, status=405)
+    try:
+        body = json.loads(request.body.decode('utf-8'))
+        widgets = body["widgets"]
+        if not isinstance(widgets, list):
+            raise ValueError("Widgets must be a list")
+        for widget in widgets:
+            if not isinstance(widget, dict) or "id" not in widget:
+                raise ValueError("Missing widget id")
+            metrics = widget["m"]
+            if not isinstance(metrics, list) or not all(
+                    isinstance(metric, str) for metric in metrics):
+                raise ValueError("Metrics must be a list of strings")
+            if widget.get("reduce") not in (None,) + tuple(utils.REDUCTIONS):
+                raise ValueError("Invalid reduce")
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"error": "Invalid request body"}, status=400)
+
+    response = dashboards.fetch_widget_metrics(widgets)
+    if body.get("format") == "columnar":
+        return JsonResponse(
+            {"widgets": utils.to_columnar_widgets(response)},
+            json_dumps_params={'separators': dashboards.COMPACT_SEPARATORS})
+    return JsonResponse({"widgets": response})
+
+
+@login_required(login_url='/login/')
+@permission_required(permission='ci:view', login_url='/login/')
+def dashboard_stream(request, dashboard_id):
+    """
+    Streams the dashboard's widget values as server sent events. Everyone
+    viewing the same dashboard and timeframe shares a single set of Metrics
+    API queries, and only the widgets whose values changed are sent.
+    """
+    if settings.HIDE_DASHBOARDS:
+        return redirect('denied')
+    if not settings.DASHBOARD_STREAMING:
+        raise Http404('Dashboard streaming is turned off')
+    start = request.GET.get('start', '-30d')
+    interval = request.GET.get('interval', '1d')
+    max_points = utils.parse_max_points(request.GET.get('max_points'))
+    dashboard = caching.get_dashboard(
+        clients.get_ci_client(), int(dashboard_id))
+    widgets = [
+        dashboards.get_widget_query(widget, start, interval, max_points)
+        for widget in dashboard["widgets"]]
+
+    response = StreamingHttpResponse(
+        dashboards.event_stream(
+            (int(dashboard_id), start, interval, max_points), widgets,
+            columnar=request.GET.get('format') == 'columnar'),
+        content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the events
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @login_required(login_url='/login/')
 @permission_required(permission='ci:view', login_url='/login/')
 def denied(request):
@@ -469,68 +493,231 @@ def not_found(request):
 @tokens_required(['SEED_IDENTITY_SERVICE'])
 def identities(request):
     context = {}
-    idApi = IdentityStoreApiClient(
-        api_url=request.session["user_tokens"]["SEED_IDENTITY_SERVICE"]["url"],  # noqa
-        auth_token=request.session["user_tokens"]["SEED_IDENTITY_SERVICE"]["token"]  # noqa
-    )
+    idApi = users.get_service_client(request, 'SEED_IDENTITY_SERVICE')
     if 'address_value' in request.GET:
         form = IdentitySearchForm(request.GET)
         if form.is_valid():
-            results = idApi.get_identity_by_address(
-                address_type=form.cleaned_data['address_type'],
-                address_value=form.cleaned_data['address_value'])['results']
+            identities = utils.get_page_of_upstream(
+                idApi.session, '/identities/search/', {
+                    "details__addresses__%s" % (
+                        form.cleaned_data['address_type']):
+                    form.cleaned_data['address_value']
+                }, settings.IDENTITY_LIST_PAGE_SIZE, request.GET.get('page'),
+                user=request.session.get('user_id'))
         else:
-            results = []
+            identities = utils.get_page_of_iterator(
+                [], settings.IDENTITY_LIST_PAGE_SIZE, request.GET.get('page'))
     else:
         form = IdentitySearchForm()
-        results = idApi.get_identities()['results']
-
-    identities = utils.get_page_of_iterator(
-        results, settings.IDENTITY_LIST_PAGE_SIZE,
-        request.GET.get('page')
-    )
+        identities = utils.get_page_of_upstream(
+            idApi.session, '/identities/', {},
+            settings.IDENTITY_LIST_PAGE_SIZE, request.GET.get('page'),
+            user=request.session.get('user_id'))
 
     context['identities'] = identities
     context['form'] = form
-    return render(request, 'ci/identities.html', context)
+    return render_list(request, 'identities', context)
 
 
 @login_required(login_url='/login/')
 @permission_required(permission='ci:view', login_url='/login/')
-@tokens_required(['SEED_IDENTITY_SERVICE', 'HUB',
-                  'SEED_STAGE_BASED_MESSAGING'])
-def identity(request, identity):
-    idApi = IdentityStoreApiClient(
-        api_url=request.session["user_tokens"]["SEED_IDENTITY_SERVICE"]["url"],  # noqa
-        auth_token=request.session["user_tokens"]["SEED_IDENTITY_SERVICE"]["token"]  # noqa
-    )
-    hubApi = HubApiClient(
-        api_url=request.session["user_tokens"]["HUB"]["url"],  # noqa
-        auth_token=request.session["user_tokens"]["HUB"]["token"]  # noqa
-    )
-    sbmApi = StageBasedMessagingApiClient(
-        api_url=request.session["user_tokens"]["SEED_STAGE_BASED_MESSAGING"]["url"],  # noqa
-        auth_token=request.session["user_tokens"]["SEED_STAGE_BASED_MESSAGING"]["token"]  # noqa
-    )
-    msApi = MessageSenderApiClient(
-        api_url=request.session["user_tokens"]["SEED_MESSAGE_SENDER"]["url"],  # noqa
-        auth_token=request.session["user_tokens"]["SEED_MESSAGE_SENDER"]["token"]  # noqa
-    )
+@tokens_required(['SEED_IDENTITY_SERVICE'])
+def identity_lookup(request):
+    """
+    Looks up the identities for each of the phone numbers in an uploaded
+    file, and streams them back as a CSV file as they are found. The phone
+    numbers are read from the file as the earlier lookups finish.
+    """
+    if request.method == "POST":
+        form = IdentityLookupForm(request.POST, request.FILES)
+        if form.is_valid():
+            idApi = users.get_service_client(
+                request, 'SEED_IDENTITY_SERVICE')
+
+            def lookup(msisdn):
+                return caching.get_identities_by_address(
+                    idApi, 'msisdn', msisdn)
+
+            def rows():
+                msisdns = uploads.iter_msisdns(
+                    form.cleaned_data['msisdn_list'],
+                    settings.IDENTITY_LOOKUP_LIMIT)
+                for msisdn, identities, error in clients.map_concurrently(
+                        lookup, msisdns,
+                        settings.IDENTITY_LOOKUP_CONCURRENCY,
+                        executor='bulk'):
+                    if error is not None:
+                        yield [msisdn, '', 'Lookup failed']
+                    elif not identities:
+                        yield [msisdn, '', 'Not found']
+                    for identity in identities or []:
+                        yield [msisdn, identity, 'Found']
+
+            return csv_export(
+                'identities', ('Phone number', 'Identity', 'Status'), rows())
+    else:
+        form = IdentityLookupForm()
+
+    context = {"form": form}
+    context.update(csrf(request))
+    return render(request, 'ci/identity_lookup.html', context)
+
+
+def optout_identity(idApi, hubApi, identity, details):
+    """
+    Opts out each of the identity's addresses that isn't already opted out,
+    and opts the identity out on the hub, concurrently.
+
+    Returns a tuple of lists of the (address_type, address) pairs that were
+    opted out and that failed. A failed hub opt out is reported as
+    ('hub', identity).
+    """
+    calls = {}
+    for address_type, addresses in details.get('addresses', {}).items():
+        for address, info in addresses.items():
+            if info.get('optedout'):
+                continue
+            calls[(address_type, address)] = partial(idApi.create_optout, {
+                "identity": identity,
+                "optout_type": "stop",
+                "address_type": address_type,
+                "address": address,
+                "request_source": "ci"})
+    calls[('hub', identity)] = partial(hubApi.create_optout_admin, {
+        settings.IDENTITY_FIELD: identity
+    })
 
-    messagesets_results = sbmApi.get_messagesets()
-    messagesets = {}
-    schedules = {}
-    choices = []
-    for messageset in messagesets_results["results"]:
-        messagesets[messageset["id"]] = messageset["short_name"]
-        schedules[messageset["id"]] = messageset["default_schedule"]
-        choices.append((messageset["id"], messageset["short_name"]))
+    results, errors = clients.fan_out(calls)
+    for address_type, address in results:
+        if address_type != 'hub':
+            details['addresses'][address_type][address]['optedout'] = True
+    return sorted(results), sorted(errors)
 
-    results = idApi.get_identity(identity)
+
+def get_message_page_tokens(request):
+    """
+    Returns a dict of the page tokens for the identity page's messages from
+    the request, and whether any of them were invalid, in which case the
+    first page is shown instead.
+    """
+    tokens = {}
+    invalid = False
+    for name in ('outbound_page', 'inbound_page'):
+        token = request.GET.get(name)
+        try:
+            utils.parse_page_token(token)
+        except utils.InvalidPageToken:
+            # Most likely an old link, from when the messages were paginated
+            # by page number
+            invalid = True
+            token = None
+        tokens[name] = token
+    return tokens, invalid
+
+
+def get_identity_sections(request, identity, page_tokens=None):
+    """
+    Returns a dict of section name: callable that fetches that section of the
+    identity page, for passing to `clients.fan_out`. All but the message
+    pages are cached per identity. page_tokens are the message pages to
+    fetch, from `get_message_page_tokens`, or the first pages by default.
+    """
+    if page_tokens is None:
+        page_tokens = {}
+    hubApi = users.get_service_client(request, 'HUB')
+    sbmApi = users.get_service_client(
+        request, 'SEED_STAGE_BASED_MESSAGING')
+    msApi = users.get_service_client(request, 'SEED_MESSAGE_SENDER')
+    ciApi = clients.get_ci_client()
+
+    hub_filter = {
+        settings.IDENTITY_FIELD: identity
+    }
     sbm_filter = {
         "identity": identity
     }
-    subscriptions = sbmApi.get_subscriptions(params=sbm_filter)
+    outbound_message_params = {
+        'to_identity': identity,
+        'ordering': '-created_at',
+    }
+    inbound_message_params = {
+        'from_identity': identity,
+        'ordering': '-created_at',
+    }
+
+    def cached(api, section, fetch):
+        return lambda: caching.get_identity_section(
+            api, identity, section, fetch)
+
+    return {
+        "subscriptions": cached(sbmApi, "subscriptions", clients.fetch_all(
+            sbmApi.get_subscriptions, params=sbm_filter)),
+        "registrations": cached(hubApi, "registrations", clients.fetch_all(
+            hubApi.get_registrations, params=hub_filter)),
+        "changes": cached(hubApi, "changes", clients.fetch_all(
+            hubApi.get_changes, params=hub_filter)),
+        "outbound_messages": lambda: utils.get_upstream_page(
+            msApi.session, '/outbound/', outbound_message_params,
+            settings.IDENTITY_MESSAGES_PAGE_SIZE,
+            page_tokens.get('outbound_page')),
+        "inbound_messages": lambda: utils.get_upstream_page(
+            msApi.session, '/inbound/', inbound_message_params,
+            settings.IDENTITY_MESSAGES_PAGE_SIZE,
+            page_tokens.get('inbound_page')),
+        "audit_logs": cached(ciApi, "audit_logs", clients.fetch_all(
+            ciApi.get_auditlogs, {"identity_id": identity})),
+    }
+
+
+def get_empty_section(name):
+    if name in ("outbound_messages", "inbound_messages"):
+        return utils.UpstreamPage([])
+    return {"results": []}
+
+
+@login_required(login_url='/login/')
+@permission_required(permission='ci:view', login_url='/login/')
+@tokens_required(['SEED_IDENTITY_SERVICE', 'HUB',
+                  'SEED_STAGE_BASED_MESSAGING'])
+def identity(request, identity):
+    idApi = users.get_service_client(request, 'SEED_IDENTITY_SERVICE')
+    hubApi = users.get_service_client(request, 'HUB')
+    sbmApi = users.get_service_client(
+        request, 'SEED_STAGE_BASED_MESSAGING')
+
+    # The other sections are loaded by the page separately, see
+    # identity_section
+    sections = {
+        "subscriptions": get_identity_sections(
+            request, identity)["subscriptions"],
+    }
+    calls = {
+        "messagesets": lambda: caching.get_messagesets(sbmApi),
+        "identity": lambda: caching.get_identity_section(
+            idApi, identity, "identity",
+            lambda: idApi.get_identity(identity)),
+    }
+    if request.method != "POST":
+        # Nothing is going to be changed, so fetch everything at once
+        calls.update(sections)
+        sections = {}
+    else:
+        # Changes are made based on the identity's current details, not
+        # cached ones
+        caching.invalidate_identity(identity, ['identity'])
+
+    data, errors = clients.fan_out(calls)
+    for name in ("messagesets", "identity"):
+        if name in errors:
+            raise errors[name]
+
+    results = data["identity"]
+    if results is None:
+        return redirect('not_found')
+
+    messagesets = data["messagesets"].short_names
+    schedules = data["messagesets"].schedules
+    choices = data["messagesets"].choices
 
     if request.method == "POST":
         if 'add_subscription' in request.POST:
@@ -552,6 +739,7 @@ def identity(request, identity):
                         "process_status": 0,
                     }
                     sbmApi.create_subscription(subscription)
+                    caching.invalidate_identity(identity, ['subscriptions'])
 
                     messages.add_message(
                         request,
@@ -560,7 +748,7 @@ def identity(request, identity):
                         extra_tags='success'
                     )
 
-                    ciApi.create_auditlog({
+                    auditlog.record({
                         "identity_id": identity,
                         "action": "Create",
                         "action_by": request.session['user_id'],
@@ -584,6 +772,7 @@ def identity(request, identity):
                 }
                 sbmApi.update_subscription(
                     form.cleaned_data['subscription_id'], data)
+                caching.invalidate_identity(identity, ['subscriptions'])
 
                 messages.add_message(
                     request,
@@ -592,7 +781,7 @@ def identity(request, identity):
                     extra_tags='success'
                 )
 
-                ciApi.create_auditlog({
+                auditlog.record({
                     "identity_id": identity,
                     "subscription_id": form.cleaned_data['subscription_id'],
                     "action": "Update",
@@ -602,89 +791,66 @@ def identity(request, identity):
                 })
 
         elif 'optout_identity' in request.POST:
-            try:
-                details = results.get('details', {})
-                addresses = details.get('addresses', {})
-
-                for address_type, addresses in addresses.items():
-                    for address, info in addresses.items():
-                        idApi.create_optout({
-                            "identity": identity,
-                            "optout_type": "stop",
-                            "address_type": address_type,
-                            "address": address,
-                            "request_source": "ci"})
-
-                        info['optedout'] = True
-
-                hubApi.create_optout_admin({
-                    settings.IDENTITY_FIELD: identity
-                })
+            opted_out, failed = optout_identity(
+                idApi, hubApi, identity, results.get('details', {}))
+            # The hub deactivates the identity's subscriptions too
+            caching.invalidate_identity(
+                identity, ['identity', 'subscriptions', 'changes'])
+
+            for address_type, address in failed:
+                if address_type == 'hub':
+                    message = 'Optout failed on the hub.'
+                else:
+                    message = 'Optout failed for {} {}.'.format(
+                        address_type, address)
+                messages.add_message(
+                    request,
+                    messages.ERROR,
+                    message,
+                    extra_tags='danger'
+                )
 
+            if not failed:
                 messages.add_message(
                     request,
                     messages.INFO,
                     'Successfully opted out.',
                     extra_tags='success'
                 )
+            elif opted_out:
+                messages.add_message(
+                    request,
+                    messages.WARNING,
+                    'Partially opted out, opt out again to retry the '
+                    'failed addresses.',
+                    extra_tags='warning'
+                )
 
-                ciApi.create_auditlog({
+            if opted_out:
+                detail = "Optout identity"
+                if failed:
+                    detail = "Partial optout identity, failed: {}".format(
+                        ', '.join(
+                            ' '.join(address) for address in failed))
+                auditlog.record({
                     "identity_id": identity,
                     "action": "Update",
                     "action_by": request.session['user_id'],
                     "model": "identity",
-                    "detail": "Optout identity"
+                    "detail": detail
                 })
-            except:
-                messages.add_message(
-                    request,
-                    messages.ERROR,
-                    'Optout failed.',
-                    extra_tags='danger'
-                )
 
-    hub_filter = {
-        settings.IDENTITY_FIELD: identity
-    }
-    registrations = hubApi.get_registrations(params=hub_filter)
-    changes = hubApi.get_changes(params=hub_filter)
-    if results is None:
-        return redirect('not_found')
-
-    outbound_message_params = {
-        'to_identity': identity,
-        'ordering': '-created_at',
-    }
-    outbound_messages = msApi.get_outbounds(params=outbound_message_params)
-    outbound_page = request.GET.get('outbound_page')
-    outbound_paginator = Paginator(
-        list(outbound_messages['results']),
-        settings.IDENTITY_MESSAGES_PAGE_SIZE)
-
-    try:
-        outbound_messages = outbound_paginator.page(outbound_page)
-    except PageNotAnInteger:
-        outbound_messages = outbound_paginator.page(1)
-    except EmptyPage:
-        outbound_messages = outbound_paginator.page(
-            outbound_paginator.num_pages)
-
-    inbound_message_params = {
-        'from_identity': identity,
-        'ordering': '-created_at',
-    }
-    inbound_messages = msApi.get_inbounds(inbound_message_params)
-    inbound_page = request.GET.get('inbound_page')
-    inbound_paginator = Paginator(
-        list(inbound_messages['results']),
-        settings.IDENTITY_MESSAGES_PAGE_SIZE)
-
-    try:
-        inbound_messages = inbound_paginator.page(inbound_page)
-    except PageNotAnInteger:
-        inbound_messages = inbound_paginator.page(1)
-    except EmptyPage:
-        inbound_messages = inbound_paginator.page(inbound_paginator.num_pages)
+    section_data, section_errors = clients.fan_out(sections)
+    data.update(section_data)
+    errors.update(section_errors)
+    for name in errors:
+        data[name] = get_empty_section(name)
+        messages.add_message(
+            request,
+            messages.ERROR,
+            'Could not load {}.'.format(name.replace('_', ' ')),
+            extra_tags='danger'
+        )
 
     deactivate_subscription_form = DeactivateSubscriptionForm()
     add_subscription_form = AddSubscriptionForm()
@@ -698,70 +864,117 @@ def identity(request, identity):
     optout_visible = any(
         (not d.get('optedout') for _, d in msisdns.items()))
 
-    audit_logs = ciApi.get_auditlogs({"identity_id": identity})
     context = {
+        "identity_id": identity,
         "identity": results,
-        "registrations": registrations,
-        "changes": changes,
         "messagesets": messagesets,
-        "subscriptions": subscriptions,
-        "outbound_messages": outbound_messages,
+        "subscriptions": data["subscriptions"],
         "add_subscription_form": add_subscription_form,
         "deactivate_subscription_form": deactivate_subscription_form,
-        "inbound_messages": inbound_messages,
         "optout_visible": optout_visible,
-        "audit_logs": audit_logs,
-        "users": request.session['user_list']
     }
 
     context.update(csrf(request))
     return render(request, 'ci/identities_detail.html', context)
 
 
+# The sections of the identity page that are loaded separately, and the
+# identity sections that each is made up of
+IDENTITY_PAGE_SECTIONS = {
+    "registrations": ("registrations",),
+    "changes": ("changes",),
+    "messages": ("outbound_messages", "inbound_messages"),
+    "audit": ("audit_logs",),
+}
+
+
+@login_required(login_url='/login/')
+@permission_required(permission='ci:view', login_url='/login/')
+@tokens_required(['SEED_IDENTITY_SERVICE', 'HUB',
+                  'SEED_STAGE_BASED_MESSAGING'])
+def identity_section(request, identity, section):
+    """
+    Renders one of the sections of the identity page as an HTML fragment, so
+    that the page can be shown before the slower sections are fetched.
+    """
+    if section not in IDENTITY_PAGE_SECTIONS:
+        raise Http404()
+
+    page_tokens, invalid_page = None, False
+    if section == "messages":
+        page_tokens, invalid_page = get_message_page_tokens(request)
+    calls = get_identity_sections(request, identity, page_tokens)
+    data, errors = clients.fan_out(dict(
+        (name, calls[name]) for name in IDENTITY_PAGE_SECTIONS[section]))
+    for name in errors:
+        data[name] = get_empty_section(name)
+
+    section_errors = [
+        'Could not load {}.'.format(name.replace('_', ' '))
+        for name in sorted(errors)]
+    if invalid_page:
+        section_errors.insert(
+            0, 'That page of messages no longer exists, showing the first '
+            'page instead.')
+    context = {
+        "identity_id": identity,
+        "errors": section_errors,
+        # Links to other pages of messages are for the whole page
+        "page_url": request.build_absolute_uri(
+            reverse('identities-detail', args=(identity,))) + (
+            '?' + request.GET.urlencode() if request.GET else ''),
+    }
+    context.update(data)
+    if section == "audit":
+        context["users"] = users.get_user_directory(request)
+    return render(
+        request, 'ci/includes/identity_{}.html'.format(section), context)
+
+
 @login_required(login_url='/login/')
 @permission_required(permission='ci:view', login_url='/login/')
 @tokens_required(['HUB'])
 def registrations(request):
     context = {}
-    hubApi = HubApiClient(
-        api_url=request.session["user_tokens"]["HUB"]["url"],  # noqa
-        auth_token=request.session["user_tokens"]["HUB"]["token"]  # noqa
-    )
-    if 'mother_id' in request.GET:
-        form = RegistrationFilterForm(request.GET)
-        if form.is_valid():
-            reg_filter = {
-                settings.STAGE_FIELD: form.cleaned_data['stage'],
-                "validated": form.cleaned_data['validated'],
-                settings.IDENTITY_FIELD:
-                    form.cleaned_data['mother_id']
-            }
-            registrations = hubApi.get_registrations(
-                params=reg_filter)['results']
-        else:
-            registrations = []
+    hubApi = users.get_service_client(request, 'HUB')
+    form, reg_filter = get_registration_filter(request)
+    if reg_filter is not None:
+        registrations = utils.get_page_of_upstream(
+            hubApi.session, '/registrations/', reg_filter,
+            settings.REGISTRATION_LIST_PAGE_SIZE, request.GET.get('page'),
+            user=request.session.get('user_id'))
     else:
-        form = RegistrationFilterForm()
-        registrations = hubApi.get_registrations()['results']
+        registrations = utils.get_page_of_iterator(
+            [], settings.REGISTRATION_LIST_PAGE_SIZE, request.GET.get('page'))
 
     context['form'] = form
-    context['registrations'] = utils.get_page_of_iterator(
-        registrations,
-        settings.REGISTRATION_LIST_PAGE_SIZE,
-        request.GET.get('page')
-    )
+    context['registrations'] = registrations
+
+    return render_list(request, 'registrations', context)
+
 
-    return render(request, 'ci/registrations.html', context)
+@login_required(login_url='/login/')
+@permission_required(permission='ci:view', login_url='/login/')
+@tokens_required(['HUB'])
+def registrations_export(request):
+    hubApi = users.get_service_client(request, 'HUB')
+    _, reg_filter = get_registration_filter(request)
+    fields = ('id', settings.IDENTITY_FIELD, settings.STAGE_FIELD,
+              'validated', 'source', 'created_at', 'updated_at')
+    registrations = iter(())
+    if reg_filter is not None:
+        registrations = utils.iter_upstream(
+            hubApi.session, '/registrations/', reg_filter)
+    return csv_export('registrations', fields, (
+        [registration.get(field) for field in fields]
+        for registration in registrations))
 
 
 @login_required(login_url='/login/')
 @permission_required(permission='ci:view', login_url='/login/')
 @tokens_required(['HUB'])
 def registration(request, registration):
-    hubApi = HubApiClient(
-        api_url=request.session["user_tokens"]["HUB"]["url"],  # noqa
-        auth_token=request.session["user_tokens"]["HUB"]["token"]  # noqa
-    )
+    hubApi = users.get_service_client(request, 'HUB')
     if request.method == "POST":
         pass
     else:
@@ -779,44 +992,45 @@ def registration(request, registration):
 @permission_required(permission='ci:view', login_url='/login/')
 @tokens_required(['HUB'])
 def changes(request):
-    hubApi = HubApiClient(
-        api_url=request.session["user_tokens"]["HUB"]["url"],
-        auth_token=request.session["user_tokens"]["HUB"]["token"]
-    )
-    if 'mother_id' in request.GET:
-        form = ChangeFilterForm(request.GET)
-        if form.is_valid():
-            change_filter = {
-                "action": form.cleaned_data['action'],
-                "validated": form.cleaned_data['validated'],
-                settings.IDENTITY_FIELD:
-                    form.cleaned_data['mother_id']
-            }
-            changes = hubApi.get_changes(params=change_filter)['results']
-        else:
-            changes = []
+    hubApi = users.get_service_client(request, 'HUB')
+    form, change_filter = get_change_filter(request)
+    if change_filter is not None:
+        changes = utils.get_page_of_upstream(
+            hubApi.session, '/changes/', change_filter,
+            settings.CHANGE_LIST_PAGE_SIZE, request.GET.get('page'),
+            user=request.session.get('user_id'))
     else:
-        form = ChangeFilterForm()
-        changes = hubApi.get_changes()['results']
-
-    changes = utils.get_page_of_iterator(
-        changes, settings.CHANGE_LIST_PAGE_SIZE, request.GET.get('page'))
+        changes = utils.get_page_of_iterator(
+            [], settings.CHANGE_LIST_PAGE_SIZE, request.GET.get('page'))
 
     context = {
         "changes": changes,
         "form": form
     }
-    return render(request, 'ci/changes.html', context)
+    return render_list(request, 'changes', context)
+
+
+@login_required(login_url='/login/')
+@permission_required(permission='ci:view', login_url='/login/')
+@tokens_required(['HUB'])
+def changes_export(request):
+    hubApi = users.get_service_client(request, 'HUB')
+    _, change_filter = get_change_filter(request)
+    fields = ('id', settings.IDENTITY_FIELD, 'action', 'validated', 'source',
+              'created_at', 'updated_at')
+    changes = iter(())
+    if change_filter is not None:
+        changes = utils.iter_upstream(
+            hubApi.session, '/changes/', change_filter)
+    return csv_export('changes', fields, (
+        [change.get(field) for field in fields] for change in changes))
 
 
 @login_required(login_url='/login/')
 @permission_required(permission='ci:view', login_url='/login/')
 @tokens_required(['HUB'])
 def change(request, change):
-    hubApi = HubApiClient(
-        api_url=request.session["user_tokens"]["HUB"]["url"],
-        auth_token=request.session["user_tokens"]["HUB"]["token"]
-    )
+    hubApi = users.get_service_client(request, 'HUB')
     if request.method == "POST":
         pass
     else:
@@ -832,35 +1046,20 @@ def change(request, change):
 @permission_required(permission='ci:view', login_url='/login/')
 @tokens_required(['SEED_STAGE_BASED_MESSAGING'])
 def subscriptions(request):
-    sbmApi = StageBasedMessagingApiClient(
-        api_url=request.session["user_tokens"]["SEED_STAGE_BASED_MESSAGING"]["url"],  # noqa
-        auth_token=request.session["user_tokens"]["SEED_STAGE_BASED_MESSAGING"]["token"]  # noqa
-    )
+    sbmApi = users.get_service_client(
+        request, 'SEED_STAGE_BASED_MESSAGING')
 
-    messagesets_results = sbmApi.get_messagesets()
-    messagesets = {}
-    for messageset in messagesets_results["results"]:
-        messagesets[messageset["id"]] = messageset["short_name"]
+    messagesets = caching.get_messagesets(sbmApi).short_names
 
-    if 'identity' in request.GET:
-        form = SubscriptionFilterForm(request.GET)
-        if form.is_valid():
-            sbm_filter = {
-                "identity": form.cleaned_data['identity'],
-                "active": form.cleaned_data['active'],
-                "completed": form.cleaned_data['completed']
-            }
-            subscriptions = sbmApi.get_subscriptions(
-                params=sbm_filter)['results']
-        else:
-            subscriptions = []
+    form, sbm_filter = get_subscription_filter(request)
+    if sbm_filter is not None:
+        subscriptions = utils.get_page_of_upstream(
+            sbmApi.session, '/subscriptions/', sbm_filter,
+            settings.SUBSCRIPTION_LIST_PAGE_SIZE, request.GET.get('page'),
+            user=request.session.get('user_id'))
     else:
-        form = SubscriptionFilterForm()
-        subscriptions = sbmApi.get_subscriptions()['results']
-
-    subscriptions = utils.get_page_of_iterator(
-        subscriptions, settings.SUBSCRIPTION_LIST_PAGE_SIZE,
-        request.GET.get('page'))
+        subscriptions = utils.get_page_of_iterator(
+            [], settings.SUBSCRIPTION_LIST_PAGE_SIZE, request.GET.get('page'))
 
     context = {
         "subscriptions": subscriptions,
@@ -868,21 +1067,41 @@ def subscriptions(request):
         "form": form
     }
     context.update(csrf(request))
-    return render(request, 'ci/subscriptions.html', context)
+    return render_list(request, 'subscriptions', context)
+
+
+@login_required(login_url='/login/')
+@permission_required(permission='ci:view', login_url='/login/')
+@tokens_required(['SEED_STAGE_BASED_MESSAGING'])
+def subscriptions_export(request):
+    sbmApi = users.get_service_client(
+        request, 'SEED_STAGE_BASED_MESSAGING')
+    messagesets = caching.get_messagesets(sbmApi).short_names
+    _, sbm_filter = get_subscription_filter(request)
+    fields = ('id', 'identity', 'messageset', 'next_sequence_number', 'lang',
+              'active', 'completed', 'created_at', 'updated_at')
+    subscriptions = iter(())
+    if sbm_filter is not None:
+        subscriptions = utils.iter_upstream(
+            sbmApi.session, '/subscriptions/', sbm_filter)
+
+    def rows():
+        for subscription in subscriptions:
+            row = dict(subscription)
+            row['messageset'] = messagesets.get(
+                subscription.get('messageset'), subscription.get('messageset'))
+            yield [row.get(field) for field in fields]
+
+    return csv_export('subscriptions', fields, rows())
 
 
 @login_required(login_url='/login/')
 @permission_required(permission='ci:view', login_url='/login/')
 @tokens_required(['SEED_STAGE_BASED_MESSAGING'])
 def subscription(request, subscription):
-    sbmApi = StageBasedMessagingApiClient(
-        api_url=request.session["user_tokens"]["SEED_STAGE_BASED_MESSAGING"]["url"],  # noqa
-        auth_token=request.session["user_tokens"]["SEED_STAGE_BASED_MESSAGING"]["token"]  # noqa
-    )
-    messagesets_results = sbmApi.get_messagesets()
-    messagesets = {}
-    for messageset in messagesets_results["results"]:
-        messagesets[messageset["id"]] = messageset["short_name"]
+    sbmApi = users.get_service_client(
+        request, 'SEED_STAGE_BASED_MESSAGING')
+    messagesets = caching.get_messagesets(sbmApi).short_names
 
     results = sbmApi.get_subscription(subscription)
     if results is None:
@@ -898,9 +1117,7 @@ def subscription(request, subscription):
 
                 if (lang != results["lang"] or
                         messageset != results["messageset"]):
-                    hubApi = HubApiClient(
-                        request.session["user_tokens"]["HUB"]["token"],
-                        api_url=request.session["user_tokens"]["HUB"]["url"])  # noqa
+                    hubApi = users.get_service_client(request, 'HUB')
 
                     change = {
                         settings.IDENTITY_FIELD: results["identity"],
@@ -913,6 +1130,8 @@ def subscription(request, subscription):
                         change["messageset"] = messagesets[messageset]
 
                     hubApi.create_change_admin(change)
+                    caching.invalidate_identity(
+                        results["identity"], ['subscriptions', 'changes'])
 
                     messages.add_message(
                         request,
@@ -922,7 +1141,7 @@ def subscription(request, subscription):
                     )
 
                     if lang != results["lang"]:
-                        ciApi.create_auditlog({
+                        auditlog.record({
                             "identity_id": results["identity"],
                             "action": "Update",
                             "action_by": request.session['user_id'],
@@ -931,7 +1150,7 @@ def subscription(request, subscription):
                                 results["lang"], lang)
                         })
                     if messageset != results["messageset"]:
-                        ciApi.create_auditlog({
+                        auditlog.record({
                             "identity_id": results["identity"],
                             "action": "Update",
                             "action_by": request.session['user_id'],
@@ -949,7 +1168,7 @@ def subscription(request, subscription):
                 extra_tags='danger'
             )
 
-    languages = sbmApi.get_messageset_languages()
+    languages = caching.get_messageset_languages(sbmApi)
 
     context = {
         "subscription": results,
@@ -960,10 +1179,78 @@ def subscription(request, subscription):
     return render(request, 'ci/subscriptions_detail.html', context)
 
 
+@login_required(login_url='/login/')
+@permission_required(permission='ci:view', login_url='/login/')
+@tokens_required(bulkactions.SERVICES)
+def bulk_actions(request):
+    if request.method == "POST":
+        form = BulkActionForm(request.POST, request.FILES)
+        if form.is_valid():
+            job = bulkactions.create_job(
+                request.FILES['actions_file'].name,
+                request.session['user_id'],
+                users.get_user_tokens(request),
+                form.cleaned_data['actions_file'])
+
+            messages.add_message(
+                request,
+                messages.INFO,
+                'Successfully created the bulk action job.',
+                extra_tags='success'
+            )
+            return redirect('bulk-actions-detail', job=job.pk)
+    else:
+        form = BulkActionForm()
+
+    context = {
+        "form": form,
+        "jobs": BulkActionJob.objects.all()[
+            :settings.BULK_ACTION_LIST_PAGE_SIZE],
+    }
+    context.update(csrf(request))
+    return render(request, 'ci/bulk_actions.html', context)
+
+
+@login_required(login_url='/login/')
+@permission_required(permission='ci:view', login_url='/login/')
+def bulk_action(request, job):
+    job = BulkActionJob.objects.filter(pk=job).first()
+    if job is None:
+        return redirect('not_found')
+
+    remaining = None
+    if job.status == BulkActionJob.RUNNING and job.throughput:
+        remaining = int(
+            (job.total_rows - job.processed_rows) / job.throughput)
+
+    context = {
+        "job": job,
+        "remaining": remaining,
+        "failed_rows": job.rows.filter(status=BulkActionRow.FAILED)[
+            :settings.BULK_ACTION_LIST_PAGE_SIZE],
+    }
+    return render(request, 'ci/bulk_actions_detail.html', context)
+
+
+@login_required(login_url='/login/')
+@permission_required(permission='ci:view', login_url='/login/')
+def bulk_action_export(request, job):
+    job = BulkActionJob.objects.filter(pk=job).first()
+    if job is None:
+        return redirect('not_found')
+
+    rows = (
+        [row.row_number, row.identity, row.action, row.status, row.result]
+        for row in job.rows.order_by('id').iterator())
+    return csv_export(
+        'bulk-action-{}'.format(job.pk),
+        ('Row', 'Identity', 'Action', 'Status', 'Result'), rows)
+
+
 @login_required(login_url='/login/')
 @permission_required(permission='ci:view', login_url='/login/')
 def services(request):
-    services = ciApi.get_services()
+    services = clients.get_ci_client().get_services()
     context = {"services": services}
     return render(request, 'ci/services.html', context)
 
@@ -971,6 +1258,7 @@ def services(request):
 @login_required(login_url='/login/')
 @permission_required(permission='ci:view', login_url='/login/')
 def service(request, service):
+    ciApi = clients.get_ci_client()
     results = ciApi.get_service(service)
     service_status = ciApi.get_service_status(service)
     context = {
@@ -984,12 +1272,12 @@ def service(request, service):
 @permission_required(permission='ci:view', login_url='/login/')
 @tokens_required(['SEED_STAGE_BASED_MESSAGING'])
 def subscription_failures(request):
-    sbmApi = StageBasedMessagingApiClient(
-        api_url=request.session["user_tokens"]["SEED_STAGE_BASED_MESSAGING"]["url"],  # noqa
-        auth_token=request.session["user_tokens"]["SEED_STAGE_BASED_MESSAGING"]["token"]  # noqa
-    )
+    sbmApi = users.get_service_client(
+        request, 'SEED_STAGE_BASED_MESSAGING')
     if request.method == "POST":
         requeue = sbmApi.requeue_failed_tasks()
+        # The requeued tasks are no longer failures
+        utils.invalidate_upstream_pages(sbmApi.session, '/failed-tasks/')
         if ('requeued_failed_tasks' in requeue and
                 requeue['requeued_failed_tasks']):
             messages.add_message(
@@ -1003,26 +1291,25 @@ def subscription_failures(request):
                 messages.ERROR,
                 'Could not re-queued all subscription tasks'
             )
-    failures = sbmApi.get_failed_tasks()['results']
-    failures = utils.get_page_of_iterator(
-        failures, settings.FAILURE_LIST_PAGE_SIZE, request.GET.get('page'))
+    failures = utils.get_page_of_upstream(
+        sbmApi.session, '/failed-tasks/', {}, settings.FAILURE_LIST_PAGE_SIZE,
+        request.GET.get('page'), user=request.session.get('user_id'))
     context = {
         'failures': failures
     }
     context.update(csrf(request))
-    return render(request, 'ci/failures_subscriptions.html', context)
+    return render_list(request, 'failures_subscriptions', context)
 
 
 @login_required(login_url='/login/')
 @permission_required(permission='ci:view', login_url='/login/')
 @tokens_required(['SEED_SCHEDULER'])
 def schedule_failures(request):
-    schdApi = SchedulerApiClient(
-        request.session["user_tokens"]["SEED_SCHEDULER"]["token"],  # noqa
-        api_url=request.session["user_tokens"]["SEED_SCHEDULER"]["url"]  # noqa
-    )
+    schdApi = users.get_service_client(request, 'SEED_SCHEDULER')
     if request.method == "POST":
         requeue = schdApi.requeue_failed_tasks()
+        # The requeued tasks are no longer failures
+        utils.invalidate_upstream_pages(schdApi.session, '/failed-tasks/')
         if ('requeued_failed_tasks' in requeue and
                 requeue['requeued_failed_tasks']):
             messages.add_message(
@@ -1036,26 +1323,25 @@ def schedule_failures(request):
                 messages.ERROR,
                 'Could not re-queued all scheduler tasks'
             )
-    failures = schdApi.get_failed_tasks()['results']
-    failures = utils.get_page_of_iterator(
-        failures, settings.FAILURE_LIST_PAGE_SIZE, request.GET.get('page'))
+    failures = utils.get_page_of_upstream(
+        schdApi.session, '/failed-tasks/', {}, settings.FAILURE_LIST_PAGE_SIZE,
+        request.GET.get('page'), user=request.session.get('user_id'))
     context = {
         'failures': failures,
     }
     context.update(csrf(request))
-    return render(request, 'ci/failures_schedules.html', context)
+    return render_list(request, 'failures_schedules', context)
 
 
 @login_required(login_url='/login/')
 @permission_required(permission='ci:view', login_url='/login/')
 @tokens_required(['SEED_MESSAGE_SENDER'])
 def outbound_failures(request):
-    msApi = MessageSenderApiClient(
-        request.session["user_tokens"]["SEED_MESSAGE_SENDER"]["token"],  # noqa
-        api_url=request.session["user_tokens"]["SEED_MESSAGE_SENDER"]["url"]  # noqa
-    )
+    msApi = users.get_service_client(request, 'SEED_MESSAGE_SENDER')
     if request.method == "POST":
         requeue = msApi.requeue_failed_tasks()
+        # The requeued tasks are no longer failures
+        utils.invalidate_upstream_pages(msApi.session, '/failed-tasks/')
         if ('requeued_failed_tasks' in requeue and
                 requeue['requeued_failed_tasks']):
             messages.add_message(
@@ -1069,23 +1355,21 @@ def outbound_failures(request):
                 messages.ERROR,
                 'Could not re-queued all outbound tasks'
             )
-    failures = msApi.get_failed_tasks()['results']
-    failures = utils.get_page_of_iterator(
-        failures, settings.FAILURE_LIST_PAGE_SIZE, request.GET.get('page'))
+    failures = utils.get_page_of_upstream(
+        msApi.session, '/failed-tasks/', {}, settings.FAILURE_LIST_PAGE_SIZE,
+        request.GET.get('page'), user=request.session.get('user_id'))
     context = {
         'failures': failures
     }
     context.update(csrf(request))
-    return render(request, 'ci/failures_outbounds.html', context)
+    return render_list(request, 'failures_outbounds', context)
 
 
 @login_required(login_url='/login/')
 @permission_required(permission='ci:view', login_url='/login/')
 @tokens_required(['HUB'])
 def report_generation(request):
-    hubApi = HubApiClient(
-        request.session["user_tokens"]["HUB"]["token"],
-        api_url=request.session["user_tokens"]["HUB"]["url"])
+    hubApi = users.get_service_client(request, 'HUB')
 
     if request.method == "POST":
         report_type = request.POST['report_type']
@@ -1159,10 +1443,7 @@ def user_management(request):
     if not settings.SHOW_USER_DETAILS:
         return redirect('denied')
 
-    hubApi = HubApiClient(
-        api_url=request.session["user_tokens"]["HUB"]["url"],  # noqa
-        auth_token=request.session["user_tokens"]["HUB"]["token"]  # noqa
-    )
+    hubApi = users.get_service_client(request, 'HUB')
 
     page = int(request.GET.get('page', 1))
     filters = {"page": page}
@@ -1196,45 +1477,64 @@ def user_management(request):
 @tokens_required(['SEED_IDENTITY_SERVICE', 'HUB',
                   'SEED_STAGE_BASED_MESSAGING'])
 def user_management_detail(request, identity):
-    idApi = IdentityStoreApiClient(
-        api_url=request.session["user_tokens"]["SEED_IDENTITY_SERVICE"]["url"],  # noqa
-        auth_token=request.session["user_tokens"]["SEED_IDENTITY_SERVICE"]["token"]  # noqa
-    )
-    sbmApi = StageBasedMessagingApiClient(
-        api_url=request.session["user_tokens"]["SEED_STAGE_BASED_MESSAGING"]["url"],  # noqa
-        auth_token=request.session["user_tokens"]["SEED_STAGE_BASED_MESSAGING"]["token"]  # noqa
-    )
-    hubApi = HubApiClient(
-        api_url=request.session["user_tokens"]["HUB"]["url"],  # noqa
-        auth_token=request.session["user_tokens"]["HUB"]["token"]  # noqa
-    )
-    messagesets_results = sbmApi.get_messagesets()
-
-    messagesets = {}
-    linked_to = {}
-    operator_id = {}
-
-    for messageset in messagesets_results["results"]:
-        messagesets[messageset["id"]] = messageset["short_name"]
-
-    results = idApi.get_identity(identity)
-
-    if results['details'].get('linked_to'):
-        linked_to = idApi.get_identity(results['details']['linked_to'])
-
-    operator_id = results['details'].get('operator', results.get('operator'))
-    if operator_id:
-        operator_id = idApi.get_identity(operator_id)
+    idApi = users.get_service_client(request, 'SEED_IDENTITY_SERVICE')
+    sbmApi = users.get_service_client(
+        request, 'SEED_STAGE_BASED_MESSAGING')
+    hubApi = users.get_service_client(request, 'HUB')
 
     hub_filter = {
         settings.IDENTITY_FIELD: identity
     }
-    registrations = hubApi.get_registrations(params=hub_filter)
-
     sbm_filter = {
         "identity": identity
     }
-    subscriptions = sbmApi.get_subscriptions(params=sbm_filter)
+    data, errors = clients.fan_out({
+        "messagesets": lambda: caching.get_messagesets(sbmApi),
+        "identity": lambda: idApi.get_identity(identity),
+        "registrations": clients.fetch_all(
+            hubApi.get_registrations, params=hub_filter),
+        "subscriptions": clients.fetch_all(
+            sbmApi.get_subscriptions, params=sbm_filter),
+    })
+    if "identity" in errors:
+        raise errors["identity"]
+    # The rest of the page can be shown without the other sections
+    for name in sorted(errors):
+        messages.add_message(
+            request,
+            messages.ERROR,
+            'Could not load {}.'.format(name),
+            extra_tags='danger'
+        )
+    results = data["identity"]
+    for name in ("registrations", "subscriptions"):
+        if name in errors:
+            data[name] = get_empty_section(name)
+    registrations = data["registrations"]
+    subscriptions = data["subscriptions"]
+
+    messagesets = (
+        data["messagesets"].short_names if "messagesets" in data else {})
+
+    # The linked identities can only be looked up once we have the identity
+    linked_calls = {}
+    linked_to_id = results['details'].get('linked_to')
+    if linked_to_id:
+        linked_calls["linked_to"] = lambda: idApi.get_identity(linked_to_id)
+    operator_id = results['details'].get('operator', results.get('operator'))
+    if operator_id:
+        linked_calls["operator"] = lambda: idApi.get_identity(operator_id)
+    linked, linked_errors = clients.fan_out(linked_calls)
+    for name in sorted(linked_errors):
+        messages.add_message(
+            request,
+            messages.ERROR,
+            'Could not load the {} identity.'.format(
+                name.replace('_', ' ')),
+            extra_tags='danger'
+        )
+    linked_to = linked.get("linked_to", {})
+    operator_id = linked.get("operator", {})
 
     context = {
         "identity": results,
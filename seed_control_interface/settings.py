@@ -207,3 +207,108 @@ REGISTRATION_LIST_PAGE_SIZE = 30
 CHANGE_LIST_PAGE_SIZE = 30
 SUBSCRIPTION_LIST_PAGE_SIZE = 30
 FAILURE_LIST_PAGE_SIZE = 30
+BULK_ACTION_LIST_PAGE_SIZE = 30
+
+# Upstream API clients are shared per process, see ci/clients.py
+UPSTREAM_POOL_CONNECTIONS = int(
+    os.environ.get('UPSTREAM_POOL_CONNECTIONS', '10'))
+UPSTREAM_POOL_MAXSIZE = int(os.environ.get('UPSTREAM_POOL_MAXSIZE', '10'))
+UPSTREAM_CLIENT_IDLE_TIMEOUT = int(
+    os.environ.get('UPSTREAM_CLIENT_IDLE_TIMEOUT', '300'))
+UPSTREAM_MAX_WORKERS = int(os.environ.get('UPSTREAM_MAX_WORKERS', '10'))
+# Prefetching the next page of a list happens on a separate, smaller pool
+UPSTREAM_PREFETCH_WORKERS = int(
+    os.environ.get('UPSTREAM_PREFETCH_WORKERS', '2'))
+# And so does fetching the pages of CSV exports ahead of the download
+UPSTREAM_EXPORT_WORKERS = int(
+    os.environ.get('UPSTREAM_EXPORT_WORKERS', '2'))
+# And so do bulk identity lookups and bulk action rows, which are shared by
+# every lookup and job that is running in the process at once
+UPSTREAM_BULK_WORKERS = int(os.environ.get('UPSTREAM_BULK_WORKERS', '10'))
+
+# Use a cache shared between processes (eg. memcached) in production, so that
+# cached upstream data and invalidations apply to every worker.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+MESSAGESET_CACHE_TTL = int(os.environ.get('MESSAGESET_CACHE_TTL', '3600'))
+DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', '600'))
+USER_DIRECTORY_CACHE_TTL = int(
+    os.environ.get('USER_DIRECTORY_CACHE_TTL', '3600'))
+# Logged in users' service tokens and dashboards are kept in the cache rather
+# than their sessions, and fetched again if they've expired
+USER_DATA_CACHE_TTL = int(os.environ.get('USER_DATA_CACHE_TTL', '3600'))
+# The identity page's data is cached per identity for a short while, and
+# invalidated by the changes made through the control interface
+IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', '60'))
+
+# Upstream next links are remembered per user and filter for list pages, and
+# the following page is fetched in the background
+PAGINATION_CURSOR_CACHE_TTL = int(
+    os.environ.get('PAGINATION_CURSOR_CACHE_TTL', '600'))
+PAGINATION_PREFETCH = os.environ.get('PAGINATION_PREFETCH', 'true') == 'true'
+PAGINATION_PREFETCH_TTL = int(os.environ.get('PAGINATION_PREFETCH_TTL', '60'))
+
+# Dashboard metric queries are cached for their interval, up to this long
+METRIC_CACHE_TTL = int(os.environ.get('METRIC_CACHE_TTL', '300'))
+
+# Health chart payloads are cached until the start of their next bucket, or
+# for this long if that is sooner. Run the refresh_health_charts command to
+# precompute them.
+HEALTH_CHART_CACHE_TTL = int(os.environ.get('HEALTH_CHART_CACHE_TTL', '600'))
+
+# With DASHBOARD_STREAMING on, dashboards subscribe to a stream of widget
+# updates instead of polling for them. Each open dashboard holds a request
+# worker for as long as it's streaming, so only turn it on when running
+# gunicorn with gthread or async workers. Updates are fetched every
+# DASHBOARD_STREAM_STEP seconds. Streams are closed after
+# DASHBOARD_STREAM_MAX_AGE seconds, and the browser reconnects.
+DASHBOARD_STREAMING = os.environ.get('DASHBOARD_STREAMING', 'false') == 'true'
+DASHBOARD_STREAM_STEP = int(os.environ.get('DASHBOARD_STREAM_STEP', '100'))
+DASHBOARD_STREAM_MAX_AGE = int(
+    os.environ.get('DASHBOARD_STREAM_MAX_AGE', '600'))
+
+# Audit log entries are recorded in the database and sent to the control
+# interface service in the background, in batches. Entries that fail are
+# retried after AUDITLOG_RETRY_DELAY seconds, doubling up to
+# AUDITLOG_MAX_RETRY_DELAY. Run the flush_auditlogs command to send any that
+# the web processes didn't.
+AUDITLOG_FLUSH_IN_PROCESS = os.environ.get(
+    'AUDITLOG_FLUSH_IN_PROCESS', 'true') == 'true'
+AUDITLOG_BATCH_SIZE = int(os.environ.get('AUDITLOG_BATCH_SIZE', '50'))
+AUDITLOG_FLUSH_INTERVAL = int(os.environ.get('AUDITLOG_FLUSH_INTERVAL', '30'))
+AUDITLOG_RETRY_DELAY = int(os.environ.get('AUDITLOG_RETRY_DELAY', '30'))
+AUDITLOG_MAX_RETRY_DELAY = int(
+    os.environ.get('AUDITLOG_MAX_RETRY_DELAY', '3600'))
+# How long a flush has to send the entries it has claimed before they're due
+# again. This should be longer than the upstream timeout.
+AUDITLOG_LEASE_TIME = int(os.environ.get('AUDITLOG_LEASE_TIME', '300'))
+
+# The most unique phone numbers that an uploaded file may contain
+MSISDN_UPLOAD_LIMIT = int(os.environ.get('MSISDN_UPLOAD_LIMIT', '500000'))
+
+# Bulk identity lookups accept uploads of up to IDENTITY_LOOKUP_LIMIT phone
+# numbers, and look up IDENTITY_LOOKUP_CONCURRENCY of them at once. A lookup
+# holds a request worker until it has finished, so keep the limit low enough
+# for that. The results are cached for IDENTITY_LOOKUP_CACHE_TTL seconds
+IDENTITY_LOOKUP_LIMIT = int(os.environ.get('IDENTITY_LOOKUP_LIMIT', '5000'))
+IDENTITY_LOOKUP_CONCURRENCY = int(
+    os.environ.get('IDENTITY_LOOKUP_CONCURRENCY', '5'))
+IDENTITY_LOOKUP_CACHE_TTL = int(
+    os.environ.get('IDENTITY_LOOKUP_CACHE_TTL', '300'))
+
+# Bulk action jobs are run in the background by the run_bulk_actions command,
+# with BULK_ACTION_CONCURRENCY rows in flight at once. Runners check for new
+# jobs every BULK_ACTION_POLL_INTERVAL seconds, and take over running jobs that
+# haven't processed a row in BULK_ACTION_STALE_AFTER seconds.
+BULK_ACTION_LIMIT = int(os.environ.get('BULK_ACTION_LIMIT', '10000'))
+BULK_ACTION_CONCURRENCY = int(os.environ.get('BULK_ACTION_CONCURRENCY', '5'))
+BULK_ACTION_POLL_INTERVAL = int(
+    os.environ.get('BULK_ACTION_POLL_INTERVAL', '10'))
+BULK_ACTION_STALE_AFTER = int(
+    os.environ.get('BULK_ACTION_STALE_AFTER', '900'))
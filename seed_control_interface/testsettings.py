@@ -7,3 +7,9 @@ SECRET_KEY = 'TESTSEKRET'
 DEBUG = True
 
 TEMPLATE_DEBUG = True
+
+# Background prefetching would outlive the mocked responses of a test
+PAGINATION_PREFETCH = False
+
+# Audit log entries are flushed explicitly, for the same reason
+AUDITLOG_FLUSH_IN_PROCESS = False